@@ -0,0 +1,71 @@
+"""Compare the precompiled classifier against a full ``Searcher`` scan.
+
+Run with ``python benchmarks/bench_classifier.py [iterations]``.
+"""
+
+import hashlib
+import pathlib
+import sys
+import time
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+from iocsearcher.searcher import Searcher  # noqa: E402
+
+from ioc_checker import classifier  # noqa: E402
+
+
+def sample_iocs(count: int) -> list[str]:
+    iocs = []
+    for i in range(count):
+        digest = hashlib.sha256(str(i).encode()).hexdigest()
+        iocs.extend(
+            [
+                f"{i % 200 + 20}.{i % 250}.{i % 7 + 1}.{i % 250 + 1}",
+                digest,
+                digest[:32],
+                f"host{i}.example.com",
+                f"https://host{i}.example.net/path/{i}",
+            ]
+        )
+    return iocs
+
+
+def searcher_classify(searcher: Searcher, ioc: str) -> str:
+    kinds = {item.name.lower() for item in searcher.search_data(ioc)}
+    return classifier._classify_kinds(kinds)
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    iocs = sample_iocs(count)
+
+    searcher = Searcher()
+    start = time.perf_counter()
+    for ioc in iocs:
+        searcher_classify(searcher, ioc)
+    searcher_time = time.perf_counter() - start
+
+    classifier.classify_ioc.cache_clear()
+    start = time.perf_counter()
+    for ioc in iocs:
+        classifier.classify_ioc(ioc)
+    cold_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for ioc in iocs:
+        classifier.classify_ioc(ioc)
+    warm_time = time.perf_counter() - start
+
+    total = len(iocs)
+    print(f"{total} IOCs")
+    for name, elapsed in (
+        ("searcher", searcher_time),
+        ("classifier (cold)", cold_time),
+        ("classifier (memoised)", warm_time),
+    ):
+        print(f"{name:>22}: {elapsed * 1e6 / total:8.2f} us/ioc")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""End-to-end throughput of ``/scan`` against local provider stand-ins.
+
+Every configuration pushes ``--iocs`` IOCs through ``POST /scan`` and waits
+until all tasks have finished. Kaspersky OpenTIP is replaced by an httpx
+mock transport with configurable latency and error rate; VirusTotal lookups
+load a local static page that mimics the GUI and its ``/ui/`` JSON (this
+needs ``playwright install chromium``).
+
+Run with, for example::
+
+    python benchmarks/bench_throughput.py --iocs 2000 --workers 1,8,32 --hit-ratio 0,0.9
+
+Each configuration runs in a fresh process, so peak RSS is comparable.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import pathlib
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+GUI_PAGE = """<!doctype html>
+<html><body><div id="view-container"></div><script>
+const [, , kind, ioc] = location.pathname.split("/");
+const api = {"ip-address": "ip_addresses", "domain": "domains", "file": "files"}[kind];
+const [viewTag, cardTag] = {
+  "ip-address": ["ip-address-view", "vt-ui-ip-card"],
+  "domain": ["domain-view", "vt-ui-domain-card"],
+  "file": ["file-view", "vt-ui-file-card"],
+}[kind];
+fetch(`/ui/${api}/${ioc}?relationships=*`).then(r => r.json()).then(body => {
+  const view = document.createElement(viewTag);
+  view.attachShadow({mode: "open"}).innerHTML =
+    '<div><div><div class="col-12 col-md"></div></div></div>';
+  const card = document.createElement(cardTag);
+  view.shadowRoot.querySelector(".col-md").appendChild(card);
+  const tags = body.data.attributes.tags.map(t => `<a>${t}</a>`).join("");
+  card.attachShadow({mode: "open"}).innerHTML =
+    `<div><div class="card-body d-flex"><div><div class="hstack gap-2">${tags}</div></div></div></div>`;
+  document.getElementById("view-container").appendChild(view);
+});
+</script></body></html>
+"""
+
+
+def sample_iocs(count: int, seed: int) -> list[str]:
+    """Return distinct public IPs, domains and hashes."""
+    rng = random.Random(seed)
+    iocs = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            iocs.append(f"{rng.randint(11, 99)}.{rng.randint(0, 255)}.{i >> 8 & 255}.{i & 255}")
+        elif kind == 1:
+            iocs.append(f"host{i}-{rng.randrange(1 << 30):x}.example.com")
+        else:
+            iocs.append(f"{rng.getrandbits(256):064x}")
+    return list(dict.fromkeys(iocs))
+
+
+def fake_opentip(latency: float, error_rate: float, seed: int):
+    """Return a client factory answering OpenTIP searches locally."""
+    import httpx
+
+    from ioc_checker import kaspersky
+
+    rng = random.Random(seed)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency)
+        if rng.random() < error_rate:
+            return httpx.Response(500, json={"error": "injected"})
+        zone = rng.choice(["Green", "Green", "Grey", "Red"])
+        return httpx.Response(200, json={"Zone": zone, "Status": "known"})
+
+    def create_client(token: str | None = None) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=kaspersky.API_BASE,
+            headers={"x-api-key": token or ""},
+            transport=httpx.MockTransport(handler),
+        )
+
+    return create_client
+
+
+def fake_virustotal(latency: float, error_rate: float, seed: int):
+    """Return a context factory whose contexts serve VirusTotal locally."""
+    from ioc_checker.browser import browser_manager
+
+    rng = random.Random(seed)
+
+    async def handle(route) -> None:
+        url = route.request.url
+        if "/gui/" in url:
+            await route.fulfill(status=200, content_type="text/html", body=GUI_PAGE)
+        elif "/ui/" in url:
+            await asyncio.sleep(latency)
+            if rng.random() < error_rate:
+                await route.fulfill(status=500, body="injected")
+                return
+            stats = {"malicious": rng.randint(0, 3), "harmless": 60, "undetected": 10}
+            body = {"data": {"attributes": {
+                "reputation": rng.randint(-50, 10),
+                "last_analysis_stats": stats,
+                "tags": ["bench"],
+            }}}
+            await route.fulfill(status=200, json=body)
+        else:
+            await route.fulfill(status=204, body="")
+
+    async def new_context():
+        context = await browser_manager.new_context()
+        await context.route("https://www.virustotal.com/**", handle)
+        return context
+
+    return new_context
+
+
+def percentile(values: list[float], share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * share), len(ordered) - 1)]
+
+
+async def run_once(args: argparse.Namespace) -> dict:
+    """Run one configuration in this process and return its measurements."""
+    from ioc_checker.config import settings
+
+    workdir = tempfile.mkdtemp(prefix="ioc-bench-")
+    settings.database_url = f"sqlite+aiosqlite:///{workdir}/bench.db"
+    settings.providers = [args.provider]
+    settings.worker_pools = {args.provider: args.workers}
+    settings.queue_backend = args.queue_backend
+    settings.vt_page_pool_size = max(settings.vt_page_pool_size, args.workers)
+    # The direct /ui call bypasses context routes, so the GUI path is measured.
+    settings.vt_render_tags = True
+    logging.disable(logging.WARNING)
+
+    import httpx
+
+    from ioc_checker import database, main, providers, queue, virustotal
+
+    if args.provider == "kaspersky":
+        providers.PROVIDERS["kaspersky"].client_factory = fake_opentip(
+            args.latency, args.error_rate, args.seed
+        )
+    else:
+        virustotal._new_context = fake_virustotal(args.latency, args.error_rate, args.seed)
+
+    finished: dict[str, float] = {}
+    status_changed = queue.TaskStore.status_changed
+
+    def record(self, task, old) -> None:
+        status_changed(self, task, old)
+        if task.status in queue.FINISHED_STATUSES:
+            finished[task.id] = time.perf_counter()
+
+    queue.TaskStore.status_changed = record
+
+    iocs = sample_iocs(args.iocs, args.seed)
+    await database.init_db()
+    hits = int(len(iocs) * args.hit_ratio)
+    for ioc in random.Random(args.seed).sample(iocs, hits):
+        await database.cache_result(ioc, args.provider, {"status_code": 200, "data": {}})
+    await database.flush_cache()
+    database.memory_cache.clear()
+
+    submitted: dict[str, float] = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            started = time.perf_counter()
+            for start in range(0, len(iocs), args.batch):
+                sent = time.perf_counter()
+                resp = await client.post(
+                    "/scan",
+                    json={
+                        "service": args.provider,
+                        "iocs": iocs[start : start + args.batch],
+                        "token": "bench-token",
+                    },
+                )
+                resp.raise_for_status()
+                answered = time.perf_counter()
+                for task in resp.json()["tasks"]:
+                    submitted[task["id"]] = sent
+                    if task.get("status") == "done":
+                        finished[task["id"]] = answered
+            while queue.get_queue_size():
+                await asyncio.sleep(0.005)
+            elapsed = time.perf_counter() - started
+
+    latencies = [finished[task_id] - sent for task_id, sent in submitted.items()]
+    errors = sum(
+        1 for task_id in submitted if queue.get_task(task_id).status == "error"
+    )
+    peak_rss = None
+    if resource is not None:
+        # ru_maxrss is in KiB on Linux.
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        "provider": args.provider,
+        "workers": args.workers,
+        "hit_ratio": args.hit_ratio,
+        "tasks": len(submitted),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "tasks_per_sec": round(len(submitted) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "peak_rss_mb": round(peak_rss, 1) if peak_rss is not None else None,
+    }
+
+
+def _floats(value: str) -> list[float]:
+    return [float(item) for item in value.split(",") if item]
+
+
+def _ints(value: str) -> list[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--provider", choices=["kaspersky", "virustotal"], default="kaspersky")
+    parser.add_argument("--iocs", type=int, default=2000)
+    parser.add_argument("--workers", default="1,8,32", help="comma separated pool sizes")
+    parser.add_argument("--hit-ratio", default="0,0.5,0.9", help="comma separated cache hit ratios")
+    parser.add_argument("--latency", type=float, default=0.05, help="stand-in latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--batch", type=int, default=500, help="IOCs per /scan request")
+    parser.add_argument("--queue-backend", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print one JSON object per run")
+    parser.add_argument("--one", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.one:
+        args.workers = int(args.workers)
+        args.hit_ratio = float(args.hit_ratio)
+        print(json.dumps(asyncio.run(run_once(args))))
+        return
+
+    header = f"{'workers':>7} {'hits':>5} {'tasks/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>6} {'rss MB':>7}"
+    if not args.json:
+        print(f"{args.provider}: {args.iocs} IOCs, {args.latency * 1000:.0f} ms latency, "
+              f"{args.error_rate:.0%} errors, {args.queue_backend} queue")
+        print(header)
+    for workers in _ints(args.workers):
+        for hit_ratio in _floats(args.hit_ratio):
+            cmd = [
+                sys.executable, __file__, "--one",
+                "--provider", args.provider,
+                "--iocs", str(args.iocs),
+                "--workers", str(workers),
+                "--hit-ratio", str(hit_ratio),
+                "--latency", str(args.latency),
+                "--error-rate", str(args.error_rate),
+                "--batch", str(args.batch),
+                "--queue-backend", args.queue_backend,
+                "--seed", str(args.seed),
+            ]
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+            if proc.returncode:
+                print(f"run with {workers} workers, hit ratio {hit_ratio} failed:\n{proc.stderr}",
+                      file=sys.stderr)
+                continue
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            if args.json:
+                print(json.dumps(result))
+                continue
+            print(
+                f"{workers:>7} {hit_ratio:>5.2f} {result['tasks_per_sec']:>9.1f} "
+                f"{result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['errors']:>6} "
+                f"{result['peak_rss_mb'] or 0:>7.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Process wide Chromium instance shared by browser backed providers."""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Dict
+import logging
+
+from playwright.async_api import Browser, BrowserContext, Playwright, async_playwright
+
+from .config import settings
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class BrowserManager:
+    """Launch one browser on first use and hand out isolated contexts.
+
+    The browser is relaunched on the next request for a context after it
+    crashed or was closed.
+    """
+
+    def __init__(self) -> None:
+        self._lock = asyncio.Lock()
+        self._driver: Playwright | None = None
+        self._browser: Browser | None = None
+        self.launches = 0
+
+    @property
+    def running(self) -> bool:
+        return self._browser is not None and self._browser.is_connected()
+
+    def _disconnected(self, browser: Browser) -> None:
+        if browser is self._browser:
+            logger.warning("Browser disconnected; it will be relaunched on demand")
+            self._browser = None
+
+    async def get_browser(self) -> Browser:
+        async with self._lock:
+            if self.running:
+                return self._browser
+            if self._driver is None:
+                self._driver = await async_playwright().start()
+            logger.info("Launching browser (headless=%s)", settings.headless)
+            try:
+                browser = await self._driver.chromium.launch(headless=settings.headless)
+            except Exception:
+                # Start from a fresh driver next time in case it died too.
+                driver, self._driver = self._driver, None
+                await _stop(driver)
+                raise
+            browser.on("disconnected", self._disconnected)
+            self._browser = browser
+            self.launches += 1
+            return browser
+
+    async def new_context(self, **kwargs: Any) -> BrowserContext:
+        browser = await self.get_browser()
+        return await browser.new_context(**kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running": self.running, "launches": self.launches}
+
+    async def close(self) -> None:
+        async with self._lock:
+            browser, self._browser = self._browser, None
+            driver, self._driver = self._driver, None
+            if browser is not None:
+                logger.info("Closing browser")
+                try:
+                    await browser.close()
+                except Exception as exc:  # noqa: BLE001
+                    logger.debug("Closing browser failed: %s", exc)
+            await _stop(driver)
+
+
+async def _stop(driver: Playwright | None) -> None:
+    if driver is None:
+        return
+    try:
+        await driver.stop()
+    except Exception as exc:  # noqa: BLE001
+        logger.debug("Stopping Playwright failed: %s", exc)
+
+
+browser_manager = BrowserManager()
+registry.gauge(
+    "ioc_browser_running",
+    "Whether the shared browser is running.",
+    lambda: int(browser_manager.running),
+)
+registry.gauge(
+    "ioc_browser_launches",
+    "Browser launches since start, including restarts.",
+    lambda: browser_manager.launches,
+)
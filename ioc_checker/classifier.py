@@ -0,0 +1,100 @@
+"""Lightweight IOC type classification shared by the providers.
+
+Running the full iocsearcher pattern set against a single value is expensive,
+so the common shapes (IP addresses, hashes, URLs and domains) are recognised
+with a handful of precompiled, anchored patterns. Only values that do not
+clearly match one of them are handed to the ``Searcher`` so the returned
+types stay identical to what the providers reported before.
+"""
+
+from __future__ import annotations
+
+from functools import lru_cache
+import ipaddress
+import re
+
+from iocsearcher.searcher import Searcher, default_tlds_file
+
+# Hostname made of DNS labels and an alphabetic TLD, optionally
+# fully-qualified with a trailing dot.
+_HOST = r"(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,63}\.?"
+
+# Ordered by how often each shape shows up in submitted reports.
+HASH_RE = re.compile(r"[0-9a-f]{32}|[0-9a-f]{40}|[0-9a-f]{64}", re.IGNORECASE)
+DOMAIN_RE = re.compile(_HOST, re.IGNORECASE)
+URL_RE = re.compile(
+    rf"(?:https?|ftp)://(?P<host>{_HOST})(?::\d{{1,5}})?(?:[/?#]\S*)?",
+    re.IGNORECASE,
+)
+
+# Hostnames containing something iocsearcher would also report as an IP
+# address or a hash are left to the Searcher.
+_EMBEDDED_RE = re.compile(
+    r"[0-9a-f]{32}|(?:^|\.)\d{1,3}(?:\.\d{1,3}){3}(?:\.|$)", re.IGNORECASE
+)
+# The same for URL paths and queries, where such tokens can sit anywhere;
+# this errs on the side of asking the Searcher.
+_EMBEDDED_PATH_RE = re.compile(
+    r"\d{1,3}(?:\.\d{1,3}){3}|[0-9a-f]{32}|[0-9a-f]*:[0-9a-f]*:", re.IGNORECASE
+)
+
+# TLDs the Searcher accepts; it does not report URLs on other hosts.
+_TLDS = Searcher.read_tlds(default_tlds_file)
+
+HASH_KINDS = {"md5", "sha1", "sha256", "sha512"}
+IP_KINDS = {"ip4", "ip6"}
+
+_searcher: Searcher | None = None
+
+
+def _search_kinds(ioc: str) -> set[str]:
+    global _searcher
+    if _searcher is None:
+        _searcher = Searcher()
+    return {item.name.lower() for item in _searcher.search_data(ioc)}
+
+
+def _classify_kinds(kinds: set[str]) -> str:
+    if IP_KINDS & kinds:
+        return "ip"
+    if HASH_KINDS & kinds:
+        return "hash"
+    if "url" in kinds:
+        return "url"
+    return "domain"
+
+
+def _known_tld(host: str) -> bool:
+    tld = host.rstrip(".").rsplit(".", 1)[-1]
+    # Capitalised TLDs such as "Com" are rejected by the Searcher as well.
+    return tld.lower() in _TLDS and (tld.islower() or tld.isupper())
+
+
+def _fast_classify(ioc: str) -> str | None:
+    """Return the IOC type for unambiguous input or ``None``."""
+    if HASH_RE.fullmatch(ioc):
+        return "hash"
+    if DOMAIN_RE.fullmatch(ioc):
+        return None if _EMBEDDED_RE.search(ioc) else "domain"
+    match = URL_RE.fullmatch(ioc)
+    if match:
+        host = match.group("host")
+        if _EMBEDDED_RE.search(host) or not _known_tld(host):
+            return None
+        return None if _EMBEDDED_PATH_RE.search(ioc, match.end("host")) else "url"
+    try:
+        address = ipaddress.ip_address(ioc)
+    except ValueError:
+        return None
+    # iocsearcher ignores private and reserved ranges.
+    return "ip" if address.is_global else None
+
+
+@lru_cache(maxsize=65536)
+def classify_ioc(ioc: str) -> str:
+    """Return ``"ip"``, ``"hash"``, ``"url"`` or ``"domain"`` for an IOC."""
+    value = ioc.strip()
+    kind = _fast_classify(value)
+    if kind is None:
+        kind = _classify_kinds(_search_kinds(value))
+    return kind
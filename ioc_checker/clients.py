@@ -0,0 +1,108 @@
+"""Pool of long-lived HTTP clients for token based providers."""
+
+from __future__ import annotations
+
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, Tuple
+import logging
+import time
+
+import httpx
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def client_options() -> Dict[str, Any]:
+    """Connection pooling options shared by all provider clients."""
+    http2 = settings.http2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("HTTP/2 requested but the h2 package is missing")
+            http2 = False
+    return {
+        "http2": http2,
+        "limits": httpx.Limits(
+            max_connections=settings.http_max_connections,
+            max_keepalive_connections=settings.http_max_keepalive,
+            keepalive_expiry=settings.http_keepalive_expiry,
+        ),
+    }
+
+
+@dataclass
+class _Entry:
+    client: Any
+    last_used: float = field(default_factory=time.monotonic)
+    active: int = 0
+
+
+class ClientPool:
+    """Keep one client per ``(provider, token)`` pair alive between lookups.
+
+    Clients that have not been used for ``idle_timeout`` seconds are closed
+    the next time the pool is accessed.
+    """
+
+    def __init__(self, idle_timeout: float | None = None) -> None:
+        self.idle_timeout = (
+            settings.http_client_idle_timeout if idle_timeout is None else idle_timeout
+        )
+        self._clients: Dict[Tuple[str, str | None], _Entry] = {}
+        self._last_sweep = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    @asynccontextmanager
+    async def client(
+        self, name: str, token: str | None, factory: Callable[[str | None], Any]
+    ) -> AsyncIterator[Any]:
+        """Yield the pooled client for ``name`` and ``token``."""
+        await self._sweep()
+        key = (name, token)
+        entry = self._clients.get(key)
+        if entry is None:
+            logger.info("Opening %s client", name)
+            entry = self._clients[key] = _Entry(factory(token))
+        entry.active += 1
+        try:
+            yield entry.client
+        finally:
+            entry.active -= 1
+            entry.last_used = time.monotonic()
+
+    async def _sweep(self) -> None:
+        now = time.monotonic()
+        if now - self._last_sweep < min(self.idle_timeout, 60):
+            return
+        self._last_sweep = now
+        await self.evict_idle(now)
+
+    async def evict_idle(self, now: float | None = None) -> int:
+        """Close clients idle for longer than ``idle_timeout``."""
+        now = time.monotonic() if now is None else now
+        # Everything is removed before the first await, so no client on the
+        # list can be borrowed while the others are being closed.
+        idle = [
+            (key, self._clients.pop(key))
+            for key, entry in list(self._clients.items())
+            if not entry.active and now - entry.last_used >= self.idle_timeout
+        ]
+        for key, entry in idle:
+            logger.info("Closing idle %s client", key[0])
+            await entry.client.aclose()
+        return len(idle)
+
+    async def aclose(self) -> None:
+        """Close every pooled client."""
+        clients, self._clients = self._clients, {}
+        for entry in clients.values():
+            await entry.client.aclose()
+
+
+client_pool = ClientPool()
@@ -8,11 +8,98 @@ from typing import Literal
 @dataclass
 class Settings:
     worker_count: int = 2
+    # Per provider worker counts, e.g. {"kaspersky": 32, "virustotal": 4};
+    # providers not listed use worker_count.
+    worker_pools: dict[str, int] = field(default_factory=dict)
     headless: bool = False
-    log_level: str = "DEBUG"
+    log_level: str = "INFO"
     wait_until: Literal["commit", "domcontentloaded", "load", "networkidle"] = "domcontentloaded"
+    # Concurrent VirusTotal pages per browser and lookups before a page is replaced.
+    vt_page_pool_size: int = 8
+    vt_page_max_uses: int = 50
+    # Load the GUI page for every lookup to scrape rendered tags. When false
+    # the /ui JSON is fetched directly, "tags" holds the raw attribute tags
+    # and the page is only a fallback.
+    vt_render_tags: bool = False
+    vt_direct_retry_interval: float = 60.0
+    # Requests aborted while loading VirusTotal GUI pages. URLs matching an
+    # allow pattern (fnmatch syntax) are always loaded.
+    vt_block_requests: bool = True
+    vt_block_resource_types: list[str] = field(
+        default_factory=lambda: ["image", "media", "font", "stylesheet"]
+    )
+    vt_block_patterns: list[str] = field(
+        default_factory=lambda: [
+            "*google-analytics.com/*",
+            "*googletagmanager.com/*",
+            "*doubleclick.net/*",
+        ]
+    )
+    vt_allow_patterns: list[str] = field(
+        default_factory=lambda: [
+            "https://www.virustotal.com/ui/*",
+            "https://www.virustotal.com/gui/*.js",
+        ]
+    )
     providers: list[str] = field(default_factory=lambda: ["kaspersky"])
     database_url: str = "sqlite+aiosqlite:///./cache.db"
+    parser_processes: int = 2
+    max_parse_size: int = 10 * 1024 * 1024
+    parse_chunk_size: int = 1024 * 1024
+    parse_chunk_overlap: int = 4096
+    http_max_connections: int = 100
+    http_max_keepalive: int = 20
+    http_keepalive_expiry: float = 30.0
+    http2: bool = False
+    http_client_idle_timeout: float = 300.0
+    cache_ttl: int = 7 * 24 * 3600
+    cache_negative_ttl: int = 24 * 3600
+    # Per provider overrides keyed by status code or "default".
+    provider_cache_ttl: dict[str, dict[str, int]] = field(default_factory=dict)
+    cache_purge_interval: float = 3600.0
+    cache_purge_batch: int = 1000
+    memory_cache_size: int = 10000
+    memory_cache_ttl: float = 3600.0
+    cache_flush_size: int = 200
+    cache_flush_interval: float = 1.0
+    task_retention: float = 3600.0
+    max_finished_tasks: int = 100000
+    max_jobs: int = 10000
+    # Per provider pacing, e.g. {"kaspersky": {"rate": 2, "burst": 5,
+    # "daily_quota": 2000}}; rate is in requests per second.
+    rate_limits: dict[str, dict[str, float]] = field(default_factory=dict)
+    rate_limit_max_wait: float = 5.0
+    backoff_base: float = 1.0
+    backoff_max: float = 300.0
+    max_retries: int = 5
+    # "memory" keeps queued tasks in process; "sqlite" stores them in the
+    # database so they survive restarts.
+    queue_backend: Literal["memory", "sqlite"] = "memory"
+    # Start the worker pools inside the API process. Disable when running
+    # ``python -m ioc_checker.worker`` processes against a shared queue.
+    run_workers: bool = True
+    # Scans of at most this many IOCs without an explicit priority are
+    # queued ahead of larger ones.
+    interactive_max_iocs: int = 10
+    queue_batch_size: int = 50
+    queue_visibility_timeout: float = 300.0
+    queue_poll_interval: float = 1.0
+    queue_flush_size: int = 200
+    queue_flush_interval: float = 0.2
+    queue_maintenance_interval: float = 30.0
+    # Uploaded file scans: largest accepted file, concurrent OpenTIP calls
+    # and report polling, which backs off from file_poll_interval to
+    # file_poll_max_interval and gives up after file_report_timeout.
+    file_scan_max_size: int = 256 * 1024 * 1024
+    file_scan_concurrency: int = 8
+    file_poll_interval: float = 5.0
+    file_poll_max_interval: float = 120.0
+    file_report_timeout: float = 1800.0
+    # Write a sampled profile for tasks slower than this many seconds
+    # (0 disables the profiler).
+    profile_slow_tasks: float = 0.0
+    profile_interval: float = 0.01
+    profile_dir: str = "profiles"
 
 
 def load_settings() -> Settings:
@@ -24,6 +111,8 @@ def load_settings() -> Settings:
     valid = {"commit", "domcontentloaded", "load", "networkidle"}
     if data.get("wait_until") not in valid:
         data.pop("wait_until", None)
+    if data.get("queue_backend") not in {"memory", "sqlite"}:
+        data.pop("queue_backend", None)
     if not isinstance(data.get("providers"), list):
         data.pop("providers", None)
     return Settings(**data)
@@ -1,13 +1,55 @@
 from __future__ import annotations
 
+import asyncio
+import logging
+import time
+
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy import Column, Integer, String, JSON, UniqueConstraint, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy import (
+    Column,
+    Float,
+    Index,
+    Integer,
+    String,
+    JSON,
+    UniqueConstraint,
+    delete,
+    desc,
+    event,
+    select,
+    text,
+)
 
 from .config import settings
+from .lru import LRUCache
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+BULK_CHUNK_SIZE = 500
+
+CACHE_LOOKUPS = registry.counter(
+    "ioc_cache_lookups_total",
+    "Result cache lookups by the tier that answered (memory, pending, database) or miss.",
+    ("provider", "result"),
+)
+CACHE_LOOKUP_SECONDS = registry.histogram(
+    "ioc_cache_lookup_seconds", "Latency of single result cache lookups.", ("provider",)
+)
+
+
+def _hit_ratio() -> float:
+    total = sum(CACHE_LOOKUPS.values.values())
+    misses = sum(v for (_, result), v in CACHE_LOOKUPS.values.items() if result == "miss")
+    return (total - misses) / total if total else 0.0
+
+
+registry.gauge("ioc_cache_hit_ratio", "Share of result cache lookups that hit.", _hit_ratio)
+
 
 class Cache(Base):
     __tablename__ = "cache"
@@ -16,40 +58,310 @@ class Cache(Base):
     ioc = Column(String, nullable=False)
     provider = Column(String, nullable=False)
     response = Column(JSON, nullable=False)
+    # Unix timestamps; rows are ignored once ``expires_at`` has passed.
+    fetched_at = Column(Float)
+    expires_at = Column(Float)
+
+    __table_args__ = (
+        UniqueConstraint("ioc", "provider", name="uix_ioc_provider"),
+        Index("ix_cache_expires_at", "expires_at"),
+    )
 
-    __table_args__ = (UniqueConstraint("ioc", "provider", name="uix_ioc_provider"),)
+
+class TaskRecord(Base):
+    """Persistent copy of a queued task used by the durable queue backend."""
+
+    __tablename__ = "tasks"
+
+    id = Column(String, primary_key=True)
+    ioc = Column(String, nullable=False)
+    service = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    result = Column(JSON)
+    error = Column(String)
+    token = Column(String)
+    job_id = Column(String)
+    attempts = Column(Integer, nullable=False, default=0)
+    # Unix timestamps. Queued tasks are not delivered before ``available_at``
+    # and processing tasks are delivered again once ``lease_until`` passes.
+    available_at = Column(Float, nullable=False, default=0.0)
+    # Claim order: highest priority first, then the fair share tag.
+    priority = Column(Integer, nullable=False, default=0)
+    fair_key = Column(Float, nullable=False, default=0.0)
+    # Span timings of the last processing attempt, see ``tracing``.
+    trace = Column(JSON)
+    lease_until = Column(Float)
+    created_at = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_tasks_dispatch", "service", "status", desc("priority"), "fair_key"),
+        Index("ix_tasks_updated_at", "updated_at"),
+    )
 
 
 engine = create_async_engine(settings.database_url, echo=False)
 SessionLocal = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
+if engine.dialect.name == "sqlite":
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+        # WAL lets readers proceed while the cache writer commits.
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+# Hot results served without touching SQLite, keyed by (ioc, provider).
+memory_cache = LRUCache(settings.memory_cache_size, settings.memory_cache_ttl)
+
+# Results waiting for the cache writer, keyed by (ioc, provider).
+_pending: dict[tuple[str, str], dict] = {}
+_wakeup: asyncio.Event | None = None
+
+
+def cache_ttl(provider: str, status: int | None) -> int:
+    """Return how many seconds a response with ``status`` stays fresh."""
+    overrides = settings.provider_cache_ttl.get(provider, {})
+    ttl = overrides.get(str(status), overrides.get("default"))
+    if ttl is not None:
+        return ttl
+    if status == 404:
+        return settings.cache_negative_ttl
+    return settings.cache_ttl
+
 
 async def init_db() -> None:
     async with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            # Only takes effect for new databases; allows freeing pages
+            # after purges without a blocking VACUUM.
+            await conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
         await conn.run_sync(Base.metadata.create_all)
+        if engine.dialect.name == "sqlite":
+            await _migrate_sqlite(conn)
+
+
+async def _migrate_sqlite(conn) -> None:
+    """Bring tables created by older versions up to date."""
+    await _migrate_tasks(conn)
+    res = await conn.execute(text("PRAGMA table_info(cache)"))
+    columns = {row[1] for row in res}
+    if "expires_at" in columns:
+        return
+    logger.info("Adding expiry columns to the cache table")
+    await conn.execute(text("ALTER TABLE cache ADD COLUMN fetched_at FLOAT"))
+    await conn.execute(text("ALTER TABLE cache ADD COLUMN expires_at FLOAT"))
+    await conn.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_cache_expires_at ON cache (expires_at)")
+    )
+    # Spread the expiry of existing rows over one TTL so they are not all
+    # refetched at the same moment.
+    await conn.execute(
+        text(
+            "UPDATE cache SET fetched_at = :now, "
+            "expires_at = :now + abs(random() % :ttl)"
+        ),
+        {"now": time.time(), "ttl": max(settings.cache_ttl, 1)},
+    )
+
+
+async def _migrate_tasks(conn) -> None:
+    res = await conn.execute(text("PRAGMA table_info(tasks)"))
+    columns = {row[1] for row in res}
+    if "trace" not in columns:
+        logger.info("Adding the trace column to the tasks table")
+        await conn.execute(text("ALTER TABLE tasks ADD COLUMN trace JSON"))
+    if "fair_key" in columns:
+        return
+    logger.info("Adding scheduling columns to the tasks table")
+    await conn.execute(
+        text("ALTER TABLE tasks ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+    )
+    # Existing tasks keep their order: tags follow insertion order.
+    await conn.execute(
+        text("ALTER TABLE tasks ADD COLUMN fair_key FLOAT NOT NULL DEFAULT 0")
+    )
+    await conn.execute(text("UPDATE tasks SET fair_key = rowid"))
+    await conn.execute(text("DROP INDEX IF EXISTS ix_tasks_claim"))
+    await conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_tasks_dispatch "
+            "ON tasks (service, status, priority DESC, fair_key)"
+        )
+    )
 
 
 async def get_cached_result(ioc: str, provider: str) -> dict | None:
+    started = time.perf_counter()
+    response, tier = await _lookup(ioc, provider)
+    CACHE_LOOKUP_SECONDS.observe(time.perf_counter() - started, provider)
+    CACHE_LOOKUPS.inc(provider, tier)
+    return response
+
+
+async def _lookup(ioc: str, provider: str) -> tuple[dict | None, str]:
+    cached = memory_cache.get((ioc, provider))
+    if cached is not None:
+        return cached, "memory"
+    now = time.time()
+    pending = _pending.get((ioc, provider))
+    if pending is not None and pending["expires_at"] > now:
+        return pending["response"], "pending"
     async with SessionLocal() as session:
-        stmt = select(Cache).where(Cache.ioc == ioc, Cache.provider == provider)
+        stmt = select(Cache).where(
+            Cache.ioc == ioc,
+            Cache.provider == provider,
+            Cache.expires_at > now,
+        )
         res = await session.execute(stmt)
         cache = res.scalars().first()
         if cache:
-            return cache.response
-    return None
+            memory_cache.set((ioc, provider), cache.response, cache.expires_at - now)
+            return cache.response, "database"
+    return None, "miss"
+
+
+async def get_cached_results(iocs: list[str], provider: str) -> dict[str, dict]:
+    """Return cached responses for many IOCs keyed by IOC."""
+    found: dict[str, dict] = {}
+    unique = []
+    now = time.time()
+    for ioc in dict.fromkeys(iocs):
+        cached = memory_cache.get((ioc, provider))
+        pending = _pending.get((ioc, provider))
+        if cached is None and pending is not None and pending["expires_at"] > now:
+            cached = pending["response"]
+        if cached is not None:
+            found[ioc] = cached
+        else:
+            unique.append(ioc)
+    from_memory = len(found)
+    CACHE_LOOKUPS.inc(provider, "memory", amount=from_memory)
+    if not unique:
+        return found
+    async with SessionLocal() as session:
+        # Stay well below SQLite's bound parameter limit.
+        for start in range(0, len(unique), BULK_CHUNK_SIZE):
+            chunk = unique[start : start + BULK_CHUNK_SIZE]
+            stmt = select(Cache.ioc, Cache.response, Cache.expires_at).where(
+                Cache.provider == provider,
+                Cache.ioc.in_(chunk),
+                Cache.expires_at > now,
+            )
+            res = await session.execute(stmt)
+            for ioc, response, expires_at in res:
+                memory_cache.set((ioc, provider), response, expires_at - now)
+                found[ioc] = response
+    hits = len(found) - from_memory
+    CACHE_LOOKUPS.inc(provider, "database", amount=hits)
+    CACHE_LOOKUPS.inc(provider, "miss", amount=len(unique) - hits)
+    return found
 
 
 async def cache_result(ioc: str, provider: str, response: dict) -> None:
+    """Store a response in the memory tier and queue it for the cache writer."""
     status = response.get("status_code")
     if status not in {200, 404}:
         return
-    async with SessionLocal() as session:
-        stmt = select(Cache).where(Cache.ioc == ioc, Cache.provider == provider)
-        res = await session.execute(stmt)
-        cache = res.scalars().first()
-        if cache:
-            cache.response = response
+    ttl = cache_ttl(provider, status)
+    if ttl <= 0:
+        return
+    now = time.time()
+    memory_cache.set((ioc, provider), response, ttl)
+    _pending[(ioc, provider)] = {
+        "ioc": ioc,
+        "provider": provider,
+        "response": response,
+        "fetched_at": now,
+        "expires_at": now + ttl,
+    }
+    if len(_pending) >= settings.cache_flush_size and _wakeup is not None:
+        _wakeup.set()
+
+
+async def flush_cache() -> int:
+    """Upsert all pending results in batches and return how many were written."""
+    global _pending
+    if not _pending:
+        return 0
+    rows, _pending = list(_pending.values()), {}
+    # Five bound parameters per row.
+    batch = max(BULK_CHUNK_SIZE // 5, 1)
+    try:
+        async with engine.begin() as conn:
+            for start in range(0, len(rows), batch):
+                stmt = sqlite_insert(Cache).values(rows[start : start + batch])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[Cache.ioc, Cache.provider],
+                    set_={
+                        "response": stmt.excluded.response,
+                        "fetched_at": stmt.excluded.fetched_at,
+                        "expires_at": stmt.excluded.expires_at,
+                    },
+                )
+                await conn.execute(stmt)
+    except BaseException:
+        # Keep the results for the next attempt unless newer ones arrived.
+        for row in rows:
+            _pending.setdefault((row["ioc"], row["provider"]), row)
+        raise
+    return len(rows)
+
+
+async def cache_writer() -> None:
+    """Flush pending results when enough accumulate or the interval passes."""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), settings.cache_flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            _wakeup.clear()
+            try:
+                await flush_cache()
+            except Exception as exc:  # noqa: BLE001
+                logger.exception("Cache flush failed: %s", exc)
+    finally:
+        _wakeup = None
+
+
+async def purge_expired(batch_size: int | None = None) -> int:
+    """Delete expired rows in batches and return how many were removed."""
+    batch_size = batch_size or settings.cache_purge_batch
+    removed = 0
+    while True:
+        async with SessionLocal() as session:
+            expired = (
+                select(Cache.id)
+                .where(Cache.expires_at <= time.time())
+                .limit(batch_size)
+                .scalar_subquery()
+            )
+            res = await session.execute(delete(Cache).where(Cache.id.in_(expired)))
+            await session.commit()
+        removed += res.rowcount
+        if res.rowcount < batch_size:
+            break
+        # Give lookups a chance to use the database between batches.
+        await asyncio.sleep(0)
+    if removed and engine.dialect.name == "sqlite":
+        async with engine.begin() as conn:
+            await conn.execute(text("PRAGMA incremental_vacuum"))
+    return removed
+
+
+async def cache_maintenance() -> None:
+    """Periodically purge expired cache rows."""
+    while True:
+        await asyncio.sleep(settings.cache_purge_interval)
+        try:
+            removed = await purge_expired()
+        except Exception as exc:  # noqa: BLE001
+            logger.exception("Cache purge failed: %s", exc)
         else:
-            cache = Cache(ioc=ioc, provider=provider, response=response)
-            session.add(cache)
-        await session.commit()
+            if removed:
+                logger.info("Purged %d expired cache row(s)", removed)
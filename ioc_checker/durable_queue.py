@@ -0,0 +1,288 @@
+"""Database storage for the durable task queue backend.
+
+Task state changes are buffered and upserted in batches. Workers claim
+queued tasks in batches with a lease; tasks whose lease runs out without a
+final status are delivered again.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING, Any, Dict, List
+import logging
+import time
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from . import database
+from .config import settings
+
+if TYPE_CHECKING:
+    from .queue import Task
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ("done", "error", "cancelled")
+COLUMNS = (
+    "id",
+    "ioc",
+    "service",
+    "status",
+    "result",
+    "error",
+    "token",
+    "job_id",
+    "attempts",
+    "available_at",
+    "priority",
+    "fair_key",
+    "trace",
+    "lease_until",
+    "created_at",
+    "updated_at",
+)
+
+# Task rows waiting for the writer, keyed by task id.
+_pending: Dict[str, Dict[str, Any]] = {}
+_wakeup: asyncio.Event | None = None
+
+
+def task_row(task: "Task") -> Dict[str, Any]:
+    now = time.time()
+    processing = task.status == "processing"
+    finished = task.status in FINISHED_STATUSES
+    return {
+        "id": task.id,
+        "ioc": task.ioc,
+        "service": task.service,
+        "status": task.status,
+        "result": task.result,
+        "error": task.error,
+        # The token is only needed until the lookup is done; the store
+        # clears it too, but only after journaling the final status.
+        "token": None if finished else task.token,
+        "job_id": task.job_id,
+        "attempts": task.attempts,
+        "available_at": task.available_at,
+        "priority": task.priority,
+        "fair_key": task.fair_key,
+        "trace": task.trace,
+        "lease_until": now + settings.queue_visibility_timeout if processing else None,
+        "created_at": task.created_at,
+        "updated_at": now,
+    }
+
+
+def save(task: "Task") -> None:
+    """Queue the current state of ``task`` for the next batched write."""
+    _pending[task.id] = task_row(task)
+    if len(_pending) >= settings.queue_flush_size and _wakeup is not None:
+        _wakeup.set()
+
+
+async def flush_tasks() -> int:
+    """Upsert all buffered task rows and return how many were written.
+
+    Rows that already have a final status are left alone, so a task
+    cancelled by another process stays cancelled even if a worker that
+    had claimed it reports progress afterwards.
+    """
+    global _pending
+    if not _pending:
+        return 0
+    rows, _pending = list(_pending.values()), {}
+    table = database.TaskRecord
+    batch = max(database.BULK_CHUNK_SIZE // len(COLUMNS), 1)
+    try:
+        async with database.engine.begin() as conn:
+            for start in range(0, len(rows), batch):
+                stmt = sqlite_insert(table).values(rows[start : start + batch])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[table.id],
+                    set_={
+                        name: stmt.excluded[name]
+                        for name in COLUMNS
+                        if name not in {"id", "created_at"}
+                    },
+                    where=table.status.not_in(FINISHED_STATUSES),
+                )
+                await conn.execute(stmt)
+    except BaseException:
+        # Keep the rows for the next attempt unless newer ones arrived.
+        for row in rows:
+            _pending.setdefault(row["id"], row)
+        raise
+    return len(rows)
+
+
+async def task_writer() -> None:
+    """Flush buffered task rows when enough accumulate or the interval passes."""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), settings.queue_flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            _wakeup.clear()
+            try:
+                await flush_tasks()
+            except Exception as exc:  # noqa: BLE001
+                logger.exception("Task flush failed: %s", exc)
+    finally:
+        _wakeup = None
+
+
+async def claim(service: str, limit: int) -> List[Dict[str, Any]]:
+    """Lease up to ``limit`` queued tasks of ``service`` and return their rows.
+
+    Tasks are taken by priority and fair share tag, in the order the
+    in-memory queue would serve them. The selection and the lease happen in
+    one statement, so concurrent claimers never receive the same task.
+    """
+    await flush_tasks()
+    table = database.TaskRecord
+    now = time.time()
+    ready = (
+        select(table.id)
+        .where(
+            table.service == service,
+            table.status == "queued",
+            table.available_at <= now,
+        )
+        .order_by(table.priority.desc(), table.fair_key, table.created_at)
+        .limit(limit)
+        .scalar_subquery()
+    )
+    stmt = (
+        update(table)
+        .where(table.id.in_(ready))
+        .values(
+            status="processing",
+            lease_until=now + settings.queue_visibility_timeout,
+            updated_at=now,
+        )
+        .returning(*(getattr(table, name) for name in COLUMNS))
+    )
+    async with database.engine.begin() as conn:
+        res = await conn.execute(stmt)
+        rows = [dict(row._mapping) for row in res]
+    rows.sort(key=lambda row: (-row["priority"], row["fair_key"], row["created_at"]))
+    return rows
+
+
+async def renew_leases(ids: List[str], until: float) -> List[str]:
+    """Extend unexpired leases of the given tasks and return their ids."""
+    table = database.TaskRecord
+    now = time.time()
+    stmt = (
+        update(table)
+        .where(
+            table.id.in_(ids),
+            table.status == "processing",
+            table.lease_until > now,
+        )
+        .values(lease_until=until, updated_at=now)
+        .returning(table.id)
+    )
+    async with database.engine.begin() as conn:
+        res = await conn.execute(stmt)
+        return [row[0] for row in res]
+
+
+async def backlog(service: str) -> int:
+    """Return how many tasks of ``service`` are waiting to be claimed."""
+    table = database.TaskRecord
+    stmt = select(func.count()).where(table.service == service, table.status == "queued")
+    async with database.engine.connect() as conn:
+        return (await conn.execute(stmt)).scalar_one()
+
+
+async def release_leases(expired_only: bool = True) -> int:
+    """Make leased tasks claimable again and return how many were released.
+
+    With ``expired_only`` false every lease is dropped, which is only safe
+    when no other process is working on the queue.
+    """
+    await flush_tasks()
+    table = database.TaskRecord
+    now = time.time()
+    stmt = update(table).where(table.status == "processing")
+    if expired_only:
+        stmt = stmt.where(table.lease_until <= now)
+    stmt = stmt.values(status="queued", lease_until=None, updated_at=now)
+    async with database.engine.begin() as conn:
+        res = await conn.execute(stmt)
+    if res.rowcount:
+        logger.info("Released %d leased task(s) for redelivery", res.rowcount)
+    return res.rowcount
+
+
+async def load_tasks() -> List[Dict[str, Any]]:
+    """Return unfinished tasks and recently finished ones, oldest first."""
+    table = database.TaskRecord
+    cutoff = time.time() - settings.task_retention
+    columns = [getattr(table, name) for name in COLUMNS]
+    unfinished = select(*columns).where(table.status.not_in(FINISHED_STATUSES))
+    finished = (
+        select(*columns)
+        .where(table.status.in_(FINISHED_STATUSES), table.updated_at > cutoff)
+        .order_by(table.updated_at.desc())
+        .limit(settings.max_finished_tasks)
+    )
+    async with database.engine.connect() as conn:
+        rows = [dict(row._mapping) for row in await conn.execute(unfinished)]
+        rows += [dict(row._mapping) for row in await conn.execute(finished)]
+    rows.sort(key=lambda row: row["created_at"])
+    return rows
+
+
+async def changed_since(since: float) -> List[Dict[str, Any]]:
+    """Return tasks updated after ``since``, oldest change first."""
+    table = database.TaskRecord
+    stmt = (
+        select(*(getattr(table, name) for name in COLUMNS))
+        .where(table.updated_at > since)
+        .order_by(table.updated_at)
+    )
+    async with database.engine.connect() as conn:
+        return [dict(row._mapping) for row in await conn.execute(stmt)]
+
+
+async def purge_finished(batch_size: int | None = None) -> int:
+    """Delete finished tasks older than ``task_retention`` in batches."""
+    batch_size = batch_size or settings.cache_purge_batch
+    table = database.TaskRecord
+    removed = 0
+    while True:
+        old = (
+            select(table.id)
+            .where(
+                table.status.in_(FINISHED_STATUSES),
+                table.updated_at <= time.time() - settings.task_retention,
+            )
+            .limit(batch_size)
+            .scalar_subquery()
+        )
+        async with database.engine.begin() as conn:
+            res = await conn.execute(delete(table).where(table.id.in_(old)))
+        removed += res.rowcount
+        if res.rowcount < batch_size:
+            return removed
+        await asyncio.sleep(0)
+
+
+async def queue_maintenance() -> None:
+    """Periodically redeliver tasks with expired leases and drop old ones."""
+    while True:
+        await asyncio.sleep(settings.queue_maintenance_interval)
+        try:
+            await release_leases()
+            removed = await purge_finished()
+        except Exception as exc:  # noqa: BLE001
+            logger.exception("Queue maintenance failed: %s", exc)
+        else:
+            if removed:
+                logger.info("Purged %d finished task(s)", removed)
@@ -0,0 +1,70 @@
+"""Server-Sent Events stream of task status changes."""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import AsyncIterator
+import json
+import logging
+
+from .queue import FINISHED_STATUSES, get_queue_size, get_task, subscribe, unsubscribe
+
+logger = logging.getLogger(__name__)
+
+# How often the queue depth is checked while no task changes arrive.
+QUEUE_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 15.0
+
+
+def format_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _status_event(task_id: str) -> tuple[str, bool]:
+    task = get_task(task_id)
+    if task is None:
+        return format_event("status", {"id": task_id, "error": "unknown task"}), True
+    return format_event("status", task.to_dict()), task.status in FINISHED_STATUSES
+
+
+async def task_events(ids: list[str]) -> AsyncIterator[str]:
+    """Yield the current state of ``ids`` and then every status change.
+
+    Queue depth updates are interleaved whenever it changes. The stream ends
+    with an ``end`` event once every watched task has finished.
+    """
+    sub = subscribe(ids)
+    try:
+        pending = set()
+        for task_id in sub.ids:
+            event, finished = _status_event(task_id)
+            yield event
+            if not finished:
+                pending.add(task_id)
+        last_queue = None
+        idle = 0.0
+        while pending:
+            queue_size = get_queue_size()
+            if queue_size != last_queue:
+                last_queue = queue_size
+                yield format_event("queue", {"queue": queue_size})
+            try:
+                changed = {await asyncio.wait_for(sub.changes.get(), QUEUE_INTERVAL)}
+            except asyncio.TimeoutError:
+                idle += QUEUE_INTERVAL
+                if idle >= HEARTBEAT_INTERVAL:
+                    idle = 0.0
+                    yield ": keep-alive\n\n"
+                continue
+            idle = 0.0
+            while not sub.changes.empty():
+                changed.add(sub.changes.get_nowait())
+            for task_id in changed:
+                event, finished = _status_event(task_id)
+                yield event
+                if finished:
+                    pending.discard(task_id)
+        yield format_event("queue", {"queue": get_queue_size()})
+        yield format_event("end", {})
+    finally:
+        unsubscribe(sub)
@@ -0,0 +1,162 @@
+"""IOC extraction executed outside the event loop.
+
+Scanning large pastes or documents with iocsearcher is CPU bound, so the work
+is shipped to a pool of worker processes that each keep a warm ``Searcher``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import codecs
+from collections.abc import AsyncIterator, Awaitable, Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import logging
+
+from iocsearcher.document import open_document
+from iocsearcher.searcher import Searcher
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Normalize pattern names returned by iocsearcher so the API exposes
+# consistent keys. Anything not listed here will use the original pattern
+# name as-is so new IOC types automatically appear in responses.
+NORMALIZE_KIND = {
+    "ip4": "ipv4",
+    "ip6": "ipv6",
+    "url": "uri",
+}
+
+# Searcher owned by the current pool process.
+_searcher: Searcher | None = None
+_pool: Executor | None = None
+
+
+def _init_process() -> None:
+    global _searcher
+    _searcher = Searcher()
+
+
+def _get_searcher() -> Searcher:
+    if _searcher is None:
+        _init_process()
+    return _searcher
+
+
+def group_iocs(parsed) -> dict[str, list[str]]:
+    """Group iocsearcher results by their normalized kind."""
+    result: dict[str, list[str]] = {}
+    for item in parsed:
+        key = NORMALIZE_KIND.get(item.name.lower(), item.name.lower())
+        result.setdefault(key, []).append(item.value)
+    return result
+
+
+def extract_text(text: str) -> dict[str, list[str]]:
+    """Return IOCs found in ``text`` grouped by kind."""
+    return group_iocs(_get_searcher().search_data(text))
+
+
+def extract_document(path: str) -> dict[str, list[str]] | None:
+    """Return IOCs found in the document at ``path``.
+
+    ``None`` is returned when iocsearcher cannot open the document type.
+    """
+    doc = open_document(path)
+    if doc is None:
+        return None
+    try:
+        text, _ = doc.get_text(options={})
+    finally:
+        # Ensure any file handles opened by the document parser are
+        # released before the caller removes the file.
+        del doc
+    return extract_text(text)
+
+
+def get_pool() -> Executor:
+    """Return the extraction pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        if settings.parser_processes > 0:
+            logger.info("Starting %d parser process(es)", settings.parser_processes)
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.parser_processes, initializer=_init_process
+            )
+        else:
+            # A single thread keeps the event loop responsive on platforms
+            # where spawning processes is undesirable.
+            _pool = ThreadPoolExecutor(max_workers=1, initializer=_init_process)
+    return _pool
+
+
+async def parse_text(text: str) -> dict[str, list[str]]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(), extract_text, text)
+
+
+async def parse_document(path: str) -> dict[str, list[str]] | None:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(), extract_document, path)
+
+
+def split_window(window: str, overlap: int) -> tuple[str, str]:
+    """Split ``window`` into text safe to scan now and a carried-over tail.
+
+    The cut is placed on the last whitespace so the unfinished token at the
+    end, which may be an IOC spanning two chunks, is only scanned once the
+    next chunk completes it. A window without whitespace after its first
+    character is a single token longer than a chunk: it is scanned whole and
+    its last ``overlap`` characters are scanned again with the next chunk.
+    """
+    if len(window) <= overlap:
+        return "", window
+    cut = max(window.rfind(ws) for ws in (" ", "\n", "\t", "\r"))
+    if cut <= 0:
+        return window, window[len(window) - overlap :]
+    return window[:cut], window[cut:]
+
+
+async def iter_stream_iocs(
+    read: Callable[[int], Awaitable[bytes]],
+    chunk_size: int | None = None,
+    overlap: int | None = None,
+) -> AsyncIterator[dict[str, list[str]]]:
+    """Scan a text stream chunk by chunk and yield newly seen IOCs.
+
+    ``read`` is an awaitable reader such as ``UploadFile.read``. Every yielded
+    mapping only contains IOCs that have not been reported before, so memory
+    is bounded by the chunk size and the number of distinct IOCs.
+    """
+    chunk_size = chunk_size or settings.parse_chunk_size
+    overlap = overlap if overlap is not None else settings.parse_chunk_overlap
+    decoder = codecs.getincrementaldecoder("utf-8")("ignore")
+    seen: set[tuple[str, str]] = set()
+    carry = ""
+    while True:
+        data = await read(chunk_size)
+        final = not data
+        window = carry + decoder.decode(data, final=final)
+        if final:
+            text, carry = window, ""
+        else:
+            text, carry = split_window(window, overlap)
+        if text:
+            found: dict[str, list[str]] = {}
+            for kind, values in (await parse_text(text)).items():
+                for value in values:
+                    if (kind, value) not in seen:
+                        seen.add((kind, value))
+                        found.setdefault(kind, []).append(value)
+            if found:
+                yield found
+        if final:
+            break
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
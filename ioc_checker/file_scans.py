@@ -0,0 +1,308 @@
+"""Scanning uploaded files with Kaspersky OpenTIP.
+
+Uploads are hashed while they are spooled to disk. Files whose sha256 is
+cached or already known to OpenTIP are never uploaded, and a file is
+submitted once however many uploads carry it. One scheduler drives every
+pending file through lookup, submission and report polling, waiting
+longer between polls the longer a report takes.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+from dataclasses import dataclass, field
+import hashlib
+import heapq
+import itertools
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from fastapi import UploadFile
+
+from . import kaspersky
+from .clients import client_pool
+from .config import settings
+from .database import cache_result, get_cached_results
+from .metrics import registry
+from .queue import Task, add_task, track_task, touch_task
+from .ratelimit import RETRY_STATUSES, RateLimited, limiter
+
+logger = logging.getLogger(__name__)
+
+SERVICE = "kaspersky"
+# Report responses meaning the analysis has not finished yet.
+PENDING_STATUSES = {204, 404}
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+@dataclass
+class Upload:
+    filename: str
+    sha256: str
+    size: int
+    path: str | None
+
+
+@dataclass
+class FileScan:
+    """One distinct file on its way through OpenTIP."""
+
+    sha256: str
+    filename: str
+    token: str
+    # Spooled upload, removed once submitted or no longer needed.
+    path: str | None
+    tasks: List[Task] = field(default_factory=list)
+    step: str = "lookup"  # lookup, submit, report
+    interval: float = 0.0
+    deadline: float = 0.0
+    # Basic scan result returned by the submission.
+    submitted: Dict[str, Any] | None = None
+    # Identifier the report is requested with.
+    report_id: str | None = None
+
+
+async def spool(file: UploadFile) -> Upload:
+    """Copy an upload to a temporary file, hashing it on the way."""
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(prefix="ioc-upload-", delete=False) as tmp:
+        try:
+            while data := await file.read(settings.parse_chunk_size):
+                size += len(data)
+                if size > settings.file_scan_max_size:
+                    raise UploadTooLarge(f"{file.filename} exceeds the size limit")
+                digest.update(data)
+                tmp.write(data)
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+    return Upload(file.filename or digest.hexdigest(), digest.hexdigest(), size, tmp.name)
+
+
+def _discard(path: str | None) -> None:
+    if path is None:
+        return
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+class FileScanner:
+    """Schedule OpenTIP calls for pending files.
+
+    Pending files sit in a heap ordered by when they are due, so thousands
+    of them cost one timer; up to ``file_scan_concurrency`` calls run at a
+    time and all of them go through the provider's rate limiter.
+    """
+
+    def __init__(self) -> None:
+        self._due: list[tuple[float, int, FileScan]] = []
+        self._seq = itertools.count()
+        # Files in progress by sha256.
+        self._scans: Dict[str, FileScan] = {}
+        self._wakeup = asyncio.Event()
+        self._slots: asyncio.Semaphore | None = None
+        self._running: set[asyncio.Task] = set()
+        self.stats: Counter[str] = Counter()
+
+    def __len__(self) -> int:
+        return len(self._scans)
+
+    def add(
+        self,
+        upload: Upload,
+        token: str,
+        job_id: str | None = None,
+        lookup: bool = True,
+    ) -> Task:
+        """Start scanning ``upload`` unless the same file is already pending.
+
+        The spooled file is taken over by the scanner. Without ``lookup``
+        the file is submitted straight away.
+        """
+        scan = self._scans.get(upload.sha256)
+        if scan is not None:
+            _discard(upload.path)
+            self.stats["deduplicated"] += 1
+        else:
+            scan = self._scans[upload.sha256] = FileScan(
+                upload.sha256,
+                upload.filename,
+                token,
+                upload.path,
+                step="lookup" if lookup else "submit",
+            )
+            self.schedule(scan)
+        task = track_task(upload.sha256, SERVICE, job_id=job_id)
+        scan.tasks.append(task)
+        return task
+
+    def schedule(self, scan: FileScan, delay: float = 0.0) -> None:
+        heapq.heappush(self._due, (time.monotonic() + delay, next(self._seq), scan))
+        self._wakeup.set()
+
+    async def run(self) -> None:
+        """Start due calls until cancelled."""
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(settings.file_scan_concurrency)
+        try:
+            while True:
+                self._wakeup.clear()
+                while self._due and self._due[0][0] <= time.monotonic():
+                    _, _, scan = heapq.heappop(self._due)
+                    await self._slots.acquire()
+                    call = asyncio.create_task(self._step(scan))
+                    self._running.add(call)
+                    call.add_done_callback(self._running.discard)
+                timeout = self._due[0][0] - time.monotonic() if self._due else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for call in list(self._running):
+                call.cancel()
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def _step(self, scan: FileScan) -> None:
+        try:
+            await self._advance(scan)
+        except RateLimited as exc:
+            logger.info("Delaying %s of %s: %s", scan.step, scan.sha256, exc)
+            self.schedule(scan, exc.retry_after)
+        except Exception as exc:  # noqa: BLE001
+            logger.exception("File scan of %s failed: %s", scan.sha256, exc)
+            self._fail(scan, str(exc))
+        else:
+            for task in scan.tasks:
+                touch_task(task)
+        finally:
+            self._slots.release()
+
+    async def _call(self, scan: FileScan) -> Dict[str, Any]:
+        bucket = limiter.bucket(SERVICE, scan.token)
+        await bucket.acquire()
+        async with client_pool.client(SERVICE, scan.token, kaspersky.create_client) as client:
+            if scan.step == "lookup":
+                result = await kaspersky.lookup_hash(scan.sha256, client)
+            elif scan.step == "submit":
+                self.stats["uploaded"] += 1
+                # Streamed from disk so concurrent uploads of large samples
+                # do not each hold a copy in memory.
+                with open(scan.path, "rb") as fh:
+                    result = await kaspersky.submit_file(fh, scan.filename, client)
+            else:
+                self.stats["polls"] += 1
+                result = await kaspersky.get_file_report(scan.report_id, client)
+        status = result.get("status_code")
+        if status in RETRY_STATUSES:
+            delay = bucket.backoff(result.get("retry_after"), quota_exhausted=status == 403)
+            raise RateLimited(delay, result.get("error") or f"status {status}")
+        bucket.success()
+        return result
+
+    async def _advance(self, scan: FileScan) -> None:
+        result = await self._call(scan)
+        status = result.get("status_code")
+        if scan.step == "lookup":
+            if status == 404:
+                scan.step = "submit"
+                self.schedule(scan)
+            else:
+                self.stats["known"] += 1
+                await self._finish(scan, result)
+        elif scan.step == "submit":
+            _discard(scan.path)
+            scan.path = None
+            if status != 200:
+                await self._finish(scan, result)
+                return
+            scan.submitted = result
+            # OpenTIP keys analyses by file hash and the submission answers
+            # with the file's attributes rather than a separate job id, so
+            # the report is requested by the hash it returned.
+            scan.report_id = (result.get("data") or {}).get("sha256") or scan.sha256
+            scan.step = "report"
+            scan.interval = settings.file_poll_interval
+            scan.deadline = time.monotonic() + settings.file_report_timeout
+            self.schedule(scan, scan.interval)
+        elif status == 200 and result.get("data"):
+            await self._finish(scan, result)
+        elif status in PENDING_STATUSES:
+            if time.monotonic() >= scan.deadline:
+                logger.warning("No report for %s in time; keeping the basic scan", scan.sha256)
+                # Not cached, so later uploads of the file can get the report.
+                await self._finish(scan, scan.submitted, cache=False)
+                return
+            scan.interval = min(scan.interval * 2, settings.file_poll_max_interval)
+            self.schedule(scan, scan.interval)
+        else:
+            await self._finish(scan, result)
+
+    async def _finish(
+        self, scan: FileScan, result: Dict[str, Any], cache: bool = True
+    ) -> None:
+        result = {**result, "ioc": scan.sha256, "type": "hash"}
+        if cache:
+            await cache_result(scan.sha256, SERVICE, result)
+        self._scans.pop(scan.sha256, None)
+        _discard(scan.path)
+        for task in scan.tasks:
+            task.result = result
+            task.status = "done"
+
+    def _fail(self, scan: FileScan, error: str) -> None:
+        self._scans.pop(scan.sha256, None)
+        _discard(scan.path)
+        for task in scan.tasks:
+            # Set first: the journal saves the task when its status changes.
+            task.error = error
+            task.status = "error"
+
+    def close(self) -> None:
+        """Forget pending files and remove their spooled uploads."""
+        for scan in self._scans.values():
+            _discard(scan.path)
+        self._scans.clear()
+        self._due.clear()
+
+
+file_scanner = FileScanner()
+registry.gauge(
+    "ioc_file_scans_pending", "Uploaded files awaiting a verdict.", lambda: len(file_scanner)
+)
+
+
+async def scan_uploads(
+    uploads: List[Upload], token: str, job_id: str | None = None
+) -> List[Dict[str, Any]]:
+    """Create one task per upload and return their entries.
+
+    Cached verdicts are returned inline. A cached "not found" does not
+    count, as the file itself can now be submitted.
+    """
+    cached = await get_cached_results([upload.sha256 for upload in uploads], SERVICE)
+    entries = []
+    for upload in uploads:
+        entry = {"filename": upload.filename, "sha256": upload.sha256, "size": upload.size}
+        result = cached.get(upload.sha256)
+        if result is not None and result.get("status_code") != 404:
+            _discard(upload.path)
+            file_scanner.stats["cached"] += 1
+            task_id = await add_task(upload.sha256, SERVICE, result=result, job_id=job_id)
+            entry.update(id=task_id, status="done", result=result)
+        else:
+            task = file_scanner.add(upload, token, job_id, lookup=result is None)
+            entry.update(id=task.id, status=task.status)
+        entries.append(entry)
+    return entries
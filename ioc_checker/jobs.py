@@ -0,0 +1,63 @@
+"""Aggregated views of scan jobs."""
+
+from __future__ import annotations
+
+from typing import Any, Dict
+
+from .queue import Job, get_task
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def job_state(job: Job) -> str:
+    if not job.finished:
+        return "running"
+    return "cancelled" if job.cancelled else "done"
+
+
+def job_summary(job: Job) -> Dict[str, Any]:
+    """Return progress counts and a verdict breakdown for ``job``.
+
+    Both are kept up to date by the task store as tasks change status.
+    """
+    counts = {
+        status: job.counts.get(status, 0)
+        for status in ("queued", "processing", "done", "error", "cancelled")
+    }
+    return {
+        "id": job.id,
+        "service": job.service,
+        "status": job_state(job),
+        "total": len(job.task_ids),
+        "counts": counts,
+        "verdicts": {verdict: count for verdict, count in job.verdicts.items() if count},
+    }
+
+
+def job_page(job: Job, cursor: str | None = None, limit: int | None = None) -> Dict[str, Any]:
+    """Return ``job_summary`` plus one page of task results.
+
+    ``cursor`` is the opaque ``next_cursor`` value of the previous page.
+    """
+    try:
+        start = max(int(cursor or 0), 0)
+    except ValueError:
+        raise ValueError("invalid cursor") from None
+    limit = min(max(limit or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+    page = job.task_ids[start : start + limit]
+    end = start + len(page)
+    results = []
+    for task_id in page:
+        task = get_task(task_id)
+        if task is None:
+            # Evicted from the task store before the job.
+            results.append({"id": task_id, "error": "unknown task"})
+            continue
+        item = task.to_dict()
+        item["verdict"] = task.verdict
+        results.append(item)
+    summary = job_summary(job)
+    summary["results"] = results
+    summary["next_cursor"] = str(end) if end < len(job.task_ids) else None
+    return summary
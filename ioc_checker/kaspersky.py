@@ -1,9 +1,14 @@
 from contextlib import asynccontextmanager
-from typing import Any, Dict, AsyncIterator, Optional
+from email.utils import parsedate_to_datetime
+from typing import IO, Any, Dict, AsyncIterator, Optional
 import logging
+import time
 
 import httpx
-from iocsearcher.searcher import Searcher
+
+from .classifier import classify_ioc
+from .clients import client_options
+from .tracing import span
 
 logger = logging.getLogger(__name__)
 
@@ -19,27 +24,18 @@ ERROR_MAP = {
     429: "too many requests",
 }
 
-searcher = Searcher()
-
-
-def classify_ioc(ioc: str) -> str:
-    parsed = searcher.search_data(ioc)
-    kinds = {item.name.lower() for item in parsed}
-    if {"ip4", "ip6"} & kinds:
-        return "ip"
-    if {"md5", "sha1", "sha256", "sha512"} & kinds:
-        return "hash"
-    if "url" in kinds:
-        return "url"
-    return "domain"
+def create_client(token: str | None = None) -> httpx.AsyncClient:
+    headers = {}
+    if token:
+        headers["x-api-key"] = token
+    return httpx.AsyncClient(
+        base_url=API_BASE, headers=headers, timeout=10, **client_options()
+    )
 
 
 @asynccontextmanager
 async def get_context(token: str | None = None) -> AsyncIterator[httpx.AsyncClient]:
-    headers = {}
-    if token:
-        headers["x-api-key"] = token
-    async with httpx.AsyncClient(base_url=API_BASE, headers=headers, timeout=10) as client:
+    async with create_client(token) as client:
         yield client
 
 def _parse_body(resp: httpx.Response) -> Optional[Any]:
@@ -51,6 +47,21 @@ def _parse_body(resp: httpx.Response) -> Optional[Any]:
         return text or None
 
 
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    """Return the Retry-After header in seconds if the server sent one."""
+    value = resp.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
 def _handle_response(resp: httpx.Response) -> Dict[str, Any]:
     body = _parse_body(resp)
     if resp.status_code == 200:
@@ -61,7 +72,11 @@ def _handle_response(resp: httpx.Response) -> Dict[str, Any]:
     logger.error(
         "Kaspersky API error %s: %s - %s", resp.status_code, message, body
     )
-    return {"status_code": resp.status_code, "error": message, "details": body}
+    result = {"status_code": resp.status_code, "error": message, "details": body}
+    retry_after = _retry_after(resp)
+    if retry_after is not None:
+        result["retry_after"] = retry_after
+    return result
 
 
 def _parse_hash(data: Dict[str, Any]) -> Dict[str, Any]:
@@ -165,7 +180,10 @@ async def lookup_url(value: str, client: httpx.AsyncClient) -> Dict[str, Any]:
     return result
 
 
-async def submit_file(data: bytes, filename: str, client: httpx.AsyncClient) -> Dict[str, Any]:
+async def submit_file(
+    data: bytes | IO[bytes], filename: str, client: httpx.AsyncClient
+) -> Dict[str, Any]:
+    """Upload a file; an open binary file is streamed instead of read whole."""
     files = {"file": (filename, data)}
     resp = await client.post("/scan/file", files=files)
     result = _handle_response(resp)
@@ -182,8 +200,28 @@ async def get_file_report(task_id: str, client: httpx.AsyncClient) -> Dict[str,
     return result
 
 
+ZONE_VERDICTS = {
+    "red": "malicious",
+    "yellow": "suspicious",
+    "green": "clean",
+    "grey": "unknown",
+}
+
+
+def verdict(result: Dict[str, Any]) -> str:
+    """Summarise a lookup result as malicious/suspicious/clean/unknown/error."""
+    status = result.get("status_code")
+    if status == 404:
+        return "unknown"
+    if status != 200:
+        return "error"
+    zone = ((result.get("data") or {}).get("zone") or "").lower()
+    return ZONE_VERDICTS.get(zone, "unknown")
+
+
 async def fetch_ioc_info(ioc: str, client: httpx.AsyncClient) -> Dict[str, Any]:
-    ioc_type = classify_ioc(ioc)
+    with span("classify"):
+        ioc_type = classify_ioc(ioc)
     logger.info("Fetching %s from Kaspersky", ioc)
     if ioc_type == "hash":
         result = await lookup_hash(ioc, client)
@@ -1,6 +1,8 @@
 from pathlib import Path
 from contextlib import asynccontextmanager
 from collections.abc import AsyncIterator
+import asyncio
+import json
 import logging
 import os
 import tempfile
@@ -10,50 +12,105 @@ from fastapi import (
     Request,
     UploadFile,
     File,
+    Form,
     HTTPException,
 )
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
-from iocsearcher.searcher import Searcher
-from iocsearcher.document import open_document
-
-from .queue import add_task, get_task, get_queue_size
-from .worker import start_workers
+from .queue import (
+    add_task,
+    get_task,
+    get_queue_size,
+    create_job,
+    close_job,
+    get_job,
+    cancel_job,
+    queues,
+    recover_tasks,
+    release_claimed,
+    sync_tasks,
+)
+from .jobs import job_page
+from .worker import start_workers, lookups
 from .config import settings
-from .database import init_db
-from .providers import requires_token
+from .database import (
+    init_db,
+    get_cached_results,
+    cache_maintenance,
+    cache_writer,
+    flush_cache,
+    memory_cache,
+)
+from .providers import get_provider, requires_token
+from .clients import client_pool
+from .browser import browser_manager
+from .ratelimit import limiter
+from .metrics import registry
+from .scheduling import PRIORITY_BULK, PRIORITY_INTERACTIVE
+from . import durable_queue, extraction, virustotal
+from .file_scans import UploadTooLarge, file_scanner, scan_uploads, spool
+from .events import task_events
+from .extraction import NORMALIZE_KIND  # noqa: F401 - re-exported
 
 logger = logging.getLogger(__name__)
 
-# Normalize pattern names returned by iocsearcher so the API exposes
-# consistent keys. Anything not listed here will use the original pattern
-# name as-is so new IOC types automatically appear in responses.
-NORMALIZE_KIND = {
-    "ip4": "ipv4",
-    "ip6": "ipv6",
-    "url": "uri",
-}
-
 
 class ScanRequest(BaseModel):
     iocs: list[str]
     service: str = settings.providers[0]
     token: str | None = None
+    # Higher runs first; by default small scans are interactive.
+    priority: int | None = Field(None, ge=0, le=9)
+    # Workers are shared fairly between submitters, or between jobs when
+    # no submitter is given.
+    submitter: str | None = None
 
 
 class ParseRequest(BaseModel):
     text: str
 
 
+class TaskIdsRequest(BaseModel):
+    ids: list[str]
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncIterator[None]:
     await init_db()
-    logger.info("Starting %s worker(s)", settings.worker_count)
-    start_workers(settings.worker_count)
+    background = []
+    if settings.queue_backend == "sqlite":
+        # Without in-process workers, lookups run in standalone worker
+        # processes whose leases must be left alone.
+        await recover_tasks(release_all=settings.run_workers)
+        background += [
+            asyncio.create_task(durable_queue.task_writer()),
+            asyncio.create_task(durable_queue.queue_maintenance()),
+            asyncio.create_task(sync_tasks()),
+        ]
+    pools = start_workers(settings.worker_count) if settings.run_workers else []
+    background += [
+        asyncio.create_task(cache_maintenance()),
+        asyncio.create_task(cache_writer()),
+        asyncio.create_task(file_scanner.run()),
+    ]
     yield
     logger.info("Application shutdown")
+    for task in background:
+        task.cancel()
+    for pool in pools:
+        pool.cancel()
+    await asyncio.gather(*pools, return_exceptions=True)
+    await asyncio.gather(*background, return_exceptions=True)
+    file_scanner.close()
+    if settings.queue_backend == "sqlite" and settings.run_workers:
+        release_claimed()
+    await flush_cache()
+    await durable_queue.flush_tasks()
+    await client_pool.aclose()
+    await browser_manager.close()
+    extraction.shutdown()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -69,13 +126,10 @@ async def index(request: Request) -> HTMLResponse:
 @app.post("/parse")
 async def parse_iocs(req: ParseRequest) -> dict[str, list[str]]:
     logger.info("Parsing IOC text of length %d", len(req.text))
-    searcher = Searcher()
-    parsed = searcher.search_data(req.text)
-    logger.info("Found %d IOC(s)", len(parsed))
-    result: dict[str, list[str]] = {}
-    for item in parsed:
-        key = NORMALIZE_KIND.get(item.name.lower(), item.name.lower())
-        result.setdefault(key, []).append(item.value)
+    if len(req.text) > settings.max_parse_size:
+        raise HTTPException(status_code=413, detail="Payload too large")
+    result = await extraction.parse_text(req.text)
+    logger.info("Found %d IOC(s)", sum(len(v) for v in result.values()))
     return result
 
 
@@ -83,72 +137,218 @@ TEXT_FILE_TYPES = {".txt", ".log", ".csv", ".json"}
 ALLOWED_FILE_TYPES = TEXT_FILE_TYPES | {".pdf", ".html", ".htm", ".docx"}
 
 
-@app.post("/parse-file")
-async def parse_file(file: UploadFile = File(...)) -> dict[str, list[str]]:
+@app.post("/parse-file", response_model=None)
+async def parse_file(
+    file: UploadFile = File(...), stream: bool = False
+) -> dict[str, list[str]] | StreamingResponse:
+    """Extract IOCs from an uploaded file.
+
+    Text files are scanned chunk by chunk so memory use does not depend on
+    the upload size. With ``stream=true`` newly found IOCs are returned as
+    NDJSON lines while the file is still being processed.
+    """
     logger.info("Parsing uploaded file %s", file.filename)
     ext = Path(file.filename).suffix.lower()
     if ext not in ALLOWED_FILE_TYPES:
         raise HTTPException(status_code=400, detail="Unsupported file type")
-    data = await file.read()
     if ext in TEXT_FILE_TYPES:
-        text = data.decode("utf-8", "ignore")
+        chunks = extraction.iter_stream_iocs(file.read)
     else:
-        with tempfile.NamedTemporaryFile(delete=False) as tmp:
-            tmp.write(data)
-            tmp_path = tmp.name
-        try:
-            doc = open_document(tmp_path)
-            if doc is None:
-                raise HTTPException(status_code=400, detail="Unsupported file type")
-            text, _ = doc.get_text(options={})
-        finally:
-            # Ensure any file handles opened by the document parser are
-            # released before attempting to remove the temporary file.
-            try:
-                del doc  # triggers object destructor and closes handles
-            except UnboundLocalError:
-                pass
-            os.unlink(tmp_path)
-    searcher = Searcher()
-    parsed = searcher.search_data(text)
-    logger.info("Found %d IOC(s)", len(parsed))
-    result: dict[str, list[str]] = {}
-    for item in parsed:
-        key = NORMALIZE_KIND.get(item.name.lower(), item.name.lower())
-        result.setdefault(key, []).append(item.value)
+        if file.size is not None and file.size > settings.max_parse_size:
+            raise HTTPException(status_code=413, detail="Payload too large")
+        result = await _parse_document_upload(file)
+        if result is None:
+            raise HTTPException(status_code=400, detail="Unsupported file type")
+        chunks = _single(result)
+    if stream:
+        return StreamingResponse(
+            (json.dumps(found) + "\n" async for found in chunks),
+            media_type="application/x-ndjson",
+        )
+    result = {}
+    async for found in chunks:
+        for kind, values in found.items():
+            result.setdefault(kind, []).extend(values)
+    logger.info("Found %d IOC(s)", sum(len(v) for v in result.values()))
     return result
 
 
+async def _single(result: dict[str, list[str]]) -> AsyncIterator[dict[str, list[str]]]:
+    if result:
+        yield result
+
+
+async def _parse_document_upload(file: UploadFile) -> dict[str, list[str]] | None:
+    # Document parsers need a real path, so the upload is copied over in
+    # chunks rather than being read into memory first.
+    with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        while data := await file.read(settings.parse_chunk_size):
+            tmp.write(data)
+        tmp_path = tmp.name
+    try:
+        return await extraction.parse_document(tmp_path)
+    finally:
+        os.unlink(tmp_path)
+
+
 @app.post("/scan")
 async def scan(req: ScanRequest) -> dict:
+    if req.service not in settings.providers or get_provider(req.service) is None:
+        raise HTTPException(status_code=400, detail=f"Unknown service {req.service}")
     if requires_token(req.service) and not req.token:
         raise HTTPException(status_code=400, detail="API token required")
-    logger.info("Queueing %d IOC(s) for service %s", len(req.iocs), req.service)
+    iocs = [ioc for ioc in req.iocs if ioc]
+    cached = await get_cached_results(iocs, req.service)
+    logger.info(
+        "Queueing %d IOC(s) for service %s (%d cached)",
+        len(iocs),
+        req.service,
+        sum(1 for ioc in iocs if ioc in cached),
+    )
+    priority = req.priority
+    if priority is None:
+        interactive = len(iocs) <= settings.interactive_max_iocs
+        priority = PRIORITY_INTERACTIVE if interactive else PRIORITY_BULK
+    job = create_job(req.service)
     task_ids = []
-    for ioc in req.iocs:
-        if not ioc:
-            continue
-        task_id = await add_task(ioc, req.service, req.token)
-        task_ids.append({"id": task_id, "ioc": ioc, "service": req.service})
+    for ioc in iocs:
+        result = cached.get(ioc)
+        task_id = await add_task(
+            ioc,
+            req.service,
+            req.token,
+            result=result,
+            job_id=job.id,
+            priority=priority,
+            group=req.submitter,
+        )
+        entry = {"id": task_id, "ioc": ioc, "service": req.service}
+        if result is not None:
+            entry.update(status="done", result=result)
+        task_ids.append(entry)
+    close_job(job)
+    # With the durable backend the job is on disk before it is acknowledged.
+    await durable_queue.flush_tasks()
     queue_size = get_queue_size()
-    return {"tasks": task_ids, "queue": queue_size}
+    return {"job": job.id, "tasks": task_ids, "queue": queue_size}
+
+
+@app.post("/scan-files")
+async def scan_files(
+    files: list[UploadFile] = File(...), token: str | None = Form(None)
+) -> dict:
+    """Check uploaded samples with Kaspersky OpenTIP by file hash.
+
+    Each file becomes a task whose IOC is its sha256. Known hashes are
+    answered from the cache or a hash lookup; only unknown files are
+    uploaded, once each, and their reports are polled in the background.
+    """
+    if not token:
+        raise HTTPException(status_code=400, detail="API token required")
+    uploads = []
+    try:
+        for file in files:
+            uploads.append(await spool(file))
+    except UploadTooLarge as exc:
+        for upload in uploads:
+            os.unlink(upload.path)
+        raise HTTPException(status_code=413, detail=str(exc)) from None
+    logger.info("Scanning %d uploaded file(s)", len(uploads))
+    job = create_job("kaspersky")
+    entries = await scan_uploads(uploads, token, job.id)
+    close_job(job)
+    await durable_queue.flush_tasks()
+    return {"job": job.id, "files": entries, "queue": get_queue_size()}
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(
+    job_id: str, cursor: str | None = None, limit: int | None = None
+) -> dict:
+    """Return job progress, a verdict summary and one page of results."""
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="unknown job")
+    try:
+        return job_page(job, cursor, limit)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from None
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def job_cancel(job_id: str) -> dict:
+    """Drop every task of the job that is still waiting in the queue."""
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="unknown job")
+    return {"id": job.id, "cancelled": cancel_job(job), "queue": get_queue_size()}
 
 
 @app.get("/queue")
 async def queue_status() -> dict:
-    """Return current global queue size."""
-    return {"queue": get_queue_size()}
+    """Return current global queue size and the backlog of each provider."""
+    return {
+        "queue": get_queue_size(),
+        "providers": {name: q.qsize() for name, q in queues.items()},
+    }
+
+
+@app.get("/stats")
+async def stats() -> dict:
+    """Return internal counters useful for tuning."""
+    return {
+        "lookups": lookups.stats(),
+        "memory_cache": memory_cache.stats(),
+        "rate_limits": limiter.stats(),
+        "virustotal_pages": virustotal.page_stats.stats(),
+        "virustotal_modes": dict(virustotal.direct_stats),
+        "browser": browser_manager.stats(),
+        "file_scans": {"pending": len(file_scanner), **file_scanner.stats},
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """Expose counters, histograms and gauges in Prometheus text format."""
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
 
 @app.get("/status/{task_id}")
-async def status(task_id: str) -> dict:
+async def status(task_id: str, trace: bool = False) -> dict:
     logger.debug("Status requested for task %s", task_id)
     task = get_task(task_id)
     if task is None:
         return {"error": "unknown task"}
-    return {
-        "status": task.status,
-        "result": task.result,
-        "error": task.error,
-        "ioc": task.ioc,
-        "service": task.service,
-    }
+    return task.to_dict(trace)
+
+
+@app.post("/status")
+async def batch_status(req: TaskIdsRequest, trace: bool = False) -> dict:
+    """Return the state of many tasks at once for clients that cannot stream."""
+    tasks = {}
+    for task_id in req.ids:
+        task = get_task(task_id)
+        tasks[task_id] = task.to_dict(trace) if task else {"error": "unknown task"}
+    return {"tasks": tasks, "queue": get_queue_size()}
+
+
+@app.post("/events")
+async def events(req: TaskIdsRequest) -> StreamingResponse:
+    """Stream status changes of the given tasks as Server-Sent Events."""
+    return _event_stream(req.ids)
+
+
+@app.get("/events")
+async def events_get(ids: str) -> StreamingResponse:
+    """EventSource friendly variant taking comma separated task ids."""
+    return _event_stream([task_id for task_id in ids.split(",") if task_id])
+
+
+def _event_stream(ids: list[str]) -> StreamingResponse:
+    return StreamingResponse(
+        task_events(ids),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
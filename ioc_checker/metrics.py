@@ -0,0 +1,167 @@
+"""Minimal Prometheus text-format metrics without external dependencies.
+
+Counters and histograms only bump numbers in place; gauges are callbacks
+evaluated when ``/metrics`` is scraped, so instrumentation costs next to
+nothing while nobody is looking.
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+
+LabelValues = Tuple[str, ...]
+GaugeValue = Union[float, Dict[LabelValues, float]]
+
+# Latency buckets in seconds, from cache hits to slow page loads.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Iterable[str], values: Iterable[object], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: object, amount: float = 1) -> None:
+        key = tuple(str(label) for label in labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class _Series:
+    __slots__ = ("counts", "total")
+
+    def __init__(self, buckets: int) -> None:
+        # One count per bucket plus the +Inf bucket.
+        self.counts = [0] * (buckets + 1)
+        self.total = 0.0
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self.values: Dict[LabelValues, _Series] = {}
+
+    def observe(self, value: float, *labels: object) -> None:
+        key = tuple(str(label) for label in labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = _Series(len(self.buckets))
+        series.counts[bisect_left(self.buckets, value)] += 1
+        series.total += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series.counts):
+                cumulative += count
+                le = _labels(self.labelnames, key, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_number(series.total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Tuple[str, ...],
+        callback: Callable[[], GaugeValue],
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        value = self.callback()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for key, number in items:
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(number)}")
+        return lines
+
+
+class Registry:
+    """Metrics by name.
+
+    Registering an existing counter or histogram returns it and a gauge
+    replaces its predecessor, so reloaded modules do not duplicate series.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Counter | Histogram | Gauge] = {}
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        metric = self._metrics.get(name)
+        if not isinstance(metric, Counter):
+            metric = self._metrics[name] = Counter(name, help, labelnames)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        metric = self._metrics.get(name)
+        if not isinstance(metric, Histogram):
+            metric = self._metrics[name] = Histogram(name, help, labelnames, buckets)
+        return metric
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        callback: Callable[[], GaugeValue],
+        labelnames: Tuple[str, ...] = (),
+    ) -> Gauge:
+        metric = self._metrics[name] = Gauge(name, help, labelnames, callback)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
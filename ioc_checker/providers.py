@@ -6,11 +6,25 @@ from contextlib import AsyncExitStack, asynccontextmanager
 from dataclasses import dataclass
 from typing import Any, Awaitable, Callable, Dict, AsyncIterator
 import logging
+import time
 
 from . import virustotal, kaspersky
+from .clients import client_pool
+from .metrics import registry
+from .ratelimit import RETRY_STATUSES, RateLimited, limiter
+from .tracing import span
 
 logger = logging.getLogger(__name__)
 
+FETCH_SECONDS = registry.histogram(
+    "ioc_provider_fetch_seconds", "Latency of provider lookups.", ("provider",)
+)
+RESPONSES = registry.counter(
+    "ioc_provider_responses_total",
+    "Provider responses by status code; lookups that raised count as \"exception\".",
+    ("provider", "status"),
+)
+
 
 @dataclass
 class Provider:
@@ -20,6 +34,10 @@ class Provider:
     requires_token: bool
     context_factory: Callable[..., AsyncIterator[Any]]
     fetcher: Callable[[str, Any], Awaitable[Dict[str, Any]]]
+    # Factory for clients kept alive in the client pool between lookups.
+    client_factory: Callable[[str | None], Any] | None = None
+    # Maps a result to malicious/suspicious/clean/unknown/error.
+    verdict: Callable[[Dict[str, Any]], str] | None = None
 
 
 PROVIDERS: Dict[str, Provider] = {
@@ -28,12 +46,15 @@ PROVIDERS: Dict[str, Provider] = {
         requires_token=False,
         context_factory=virustotal.playwright_browser,
         fetcher=virustotal.fetch_ioc_info,
+        verdict=virustotal.verdict,
     ),
     "kaspersky": Provider(
         name="kaspersky",
         requires_token=True,
         context_factory=kaspersky.get_context,
         fetcher=kaspersky.fetch_ioc_info,
+        client_factory=kaspersky.create_client,
+        verdict=kaspersky.verdict,
     ),
 }
 
@@ -49,6 +70,14 @@ def requires_token(name: str) -> bool:
     return bool(provider and provider.requires_token)
 
 
+def get_verdict(name: str, result: Dict[str, Any]) -> str:
+    """Return the provider's verdict for a lookup result."""
+    provider = get_provider(name)
+    if not provider or not provider.verdict:
+        return "unknown"
+    return provider.verdict(result)
+
+
 async def init_contexts(names: list[str]) -> tuple[Dict[str, Any], AsyncExitStack]:
     """Initialise contexts for all non-token providers.
 
@@ -74,16 +103,53 @@ async def fetch_ioc(
     token: str | None,
     contexts: Dict[str, Any],
 ) -> Dict[str, Any]:
-    """Fetch IOC information using the appropriate provider."""
+    """Fetch IOC information using the appropriate provider.
+
+    Requests are paced by the provider's rate limiter. Throttling responses
+    raise ``RateLimited`` so the caller can retry the lookup later.
+    """
     provider = get_provider(service)
     if not provider:
         raise ValueError(f"unsupported service {service}")
+    if provider.requires_token and not token:
+        raise ValueError("API token required")
+    bucket = limiter.bucket(service, token)
+    with span("rate_limit"):
+        await bucket.acquire()
+    started = time.monotonic()
+    try:
+        with span("fetch"):
+            result = await _fetch(provider, ioc, token, contexts)
+    except Exception:
+        RESPONSES.inc(service, "exception")
+        raise
+    finally:
+        FETCH_SECONDS.observe(time.monotonic() - started, service)
+    status = result.get("status_code")
+    RESPONSES.inc(service, status or "ok")
+    if status in RETRY_STATUSES:
+        delay = bucket.backoff(result.get("retry_after"), quota_exhausted=status == 403)
+        logger.warning("%s throttled (%s); backing off %.1fs", service, status, delay)
+        raise RateLimited(delay, result.get("error") or f"status {status}")
+    bucket.success()
+    return result
+
+
+async def _fetch(
+    provider: Provider,
+    ioc: str,
+    token: str | None,
+    contexts: Dict[str, Any],
+) -> Dict[str, Any]:
     if provider.requires_token:
-        if not token:
-            raise ValueError("API token required")
+        if provider.client_factory is not None:
+            async with client_pool.client(
+                provider.name, token, provider.client_factory
+            ) as client:
+                return await provider.fetcher(ioc, client)
         async with provider.context_factory(token) as ctx:
             return await provider.fetcher(ioc, ctx)
-    context = contexts.get(service)
+    context = contexts.get(provider.name)
     if context is None:
-        raise ValueError(f"no context for service {service}")
+        raise ValueError(f"no context for service {provider.name}")
     return await provider.fetcher(ioc, context)
@@ -1,10 +1,20 @@
 import asyncio
 import uuid
-from dataclasses import dataclass
-from typing import Dict, Optional
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional
 import logging
+import time
 
+from . import durable_queue
 from .config import settings
+from .metrics import registry
+from .providers import get_verdict
+from .scheduling import FairQueue, FairShare
+
+FINISHED_STATUSES = {"done", "error", "cancelled"}
+# Seconds by which consecutive polls for task changes overlap.
+SYNC_OVERLAP = 5.0
 
 
 @dataclass
@@ -12,15 +22,390 @@ class Task:
     id: str
     ioc: str
     service: str = settings.providers[0]
-    status: str = "queued"  # queued, processing, done, error
+    status: str = "queued"  # queued, processing, done, error, cancelled
     result: Optional[dict] = None
     error: Optional[str] = None
     token: Optional[str] = None
+    job_id: Optional[str] = None
+    attempts: int = 0
+    # Unix time before which a requeued task is not delivered again.
+    available_at: float = 0.0
+    created_at: float = field(default_factory=time.time)
+    # Higher priorities are served first; within one the fair share tag
+    # decides (see ``scheduling``).
+    priority: int = 0
+    fair_key: float = 0.0
+    # Verdict counted in the job summary while the task is done or failed.
+    verdict: Optional[str] = None
+    # Milliseconds per span of the last processing attempt.
+    trace: Optional[Dict[str, float]] = None
+
+    def __setattr__(self, name: str, value) -> None:
+        old = self.__dict__.get(name)
+        object.__setattr__(self, name, value)
+        # Keep the store's counters in step with status changes.
+        if name == "status" and old is not None and old != value:
+            _tasks.status_changed(self, old)
+
+    def to_dict(self, trace: bool = False) -> dict:
+        data = {
+            "id": self.id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "ioc": self.ioc,
+            "service": self.service,
+        }
+        if trace:
+            data["trace"] = self.trace
+        return data
+
+
+@dataclass
+class Job:
+    """A group of tasks submitted together by one scan request."""
+
+    id: str
+    service: str
+    # Ids rather than tasks, so finished tasks can be evicted from the store.
+    task_ids: List[str] = field(default_factory=list)
+    counts: Counter = field(default_factory=Counter)
+    verdicts: Counter = field(default_factory=Counter)
+    cancelled: bool = False
+    created_at: float = field(default_factory=time.time)
+
+    @property
+    def finished(self) -> bool:
+        return all(
+            not count
+            for status, count in self.counts.items()
+            if status not in FINISHED_STATUSES
+        )
+
+
+def task_verdict(task: Task) -> Optional[str]:
+    if task.status == "error":
+        return "error"
+    if task.status != "done":
+        return None
+    return get_verdict(task.service, task.result or {})
+
+
+class Subscription:
+    """Receives the ids of watched tasks whenever their status changes."""
+
+    def __init__(self, ids: Iterable[str]) -> None:
+        self.ids = set(ids)
+        self.changes: asyncio.Queue[str] = asyncio.Queue()
+
+
+class TaskStore:
+    """Task registry with running status counts and bounded history.
+
+    Finished tasks are forgotten once they are older than ``retention``
+    seconds or when more than ``max_finished`` of them are kept. Jobs are
+    forgotten with the same retention once finished, and the oldest go
+    first when more than ``max_jobs`` are kept.
+    """
+
+    def __init__(
+        self,
+        retention: float | None = None,
+        max_finished: int | None = None,
+        max_jobs: int | None = None,
+    ) -> None:
+        self.retention = settings.task_retention if retention is None else retention
+        self.max_finished = (
+            settings.max_finished_tasks if max_finished is None else max_finished
+        )
+        self.max_jobs = settings.max_jobs if max_jobs is None else max_jobs
+        self._tasks: Dict[str, Task] = {}
+        # Finished task ids in completion order with their completion time.
+        self._finished: OrderedDict[str, float] = OrderedDict()
+        self.counts: Counter[str] = Counter()
+        self._watchers: Dict[str, List[Subscription]] = {}
+        self._jobs: Dict[str, Job] = {}
+        self._finished_jobs: OrderedDict[str, float] = OrderedDict()
+        # Ids of tasks being processed by workers of this process.
+        self.started: set[str] = set()
+        # Called with every new task and status change when tasks are persisted.
+        self.journal: Callable[[Task], None] | None = None
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self._tasks
+
+    def get(self, task_id: str) -> Optional[Task]:
+        return self._tasks.get(task_id)
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def add_job(self, job: Job) -> None:
+        self._jobs[job.id] = job
+        self.evict()
+
+    def add(self, task: Task, persist: bool = True) -> None:
+        if persist and self.journal is not None:
+            self.journal(task)
+        self._tasks[task.id] = task
+        self.counts[task.status] += 1
+        job = self._jobs.get(task.job_id) if task.job_id else None
+        if job is not None:
+            job.task_ids.append(task.id)
+            job.counts[task.status] += 1
+            self._count_verdict(job, task)
+            self._finished_jobs.pop(job.id, None)
+        if task.status in FINISHED_STATUSES:
+            self._finish(task)
+        self.evict()
+
+    def close_job(self, job: Job) -> None:
+        """Mark a job as fully submitted so it can expire once finished."""
+        if job.finished:
+            self._finished_jobs[job.id] = time.monotonic()
+
+    @property
+    def outstanding(self) -> int:
+        return sum(
+            count
+            for status, count in self.counts.items()
+            if status not in FINISHED_STATUSES
+        )
+
+    def status_changed(self, task: Task, old: str) -> None:
+        if self._tasks.get(task.id) is not task:
+            return
+        if self.journal is not None:
+            self.journal(task)
+        self.counts[old] -= 1
+        self.counts[task.status] += 1
+        if old == "processing":
+            self.started.discard(task.id)
+        job = self._jobs.get(task.job_id) if task.job_id else None
+        if job is not None:
+            job.counts[old] -= 1
+            job.counts[task.status] += 1
+            self._count_verdict(job, task)
+            if job.finished:
+                self._finished_jobs[job.id] = time.monotonic()
+        if task.status in FINISHED_STATUSES:
+            if old not in FINISHED_STATUSES:
+                self._finish(task)
+                self.evict()
+        elif old in FINISHED_STATUSES:
+            self._finished.pop(task.id, None)
+        for sub in self._watchers.get(task.id, ()):
+            sub.changes.put_nowait(task.id)
+
+    @staticmethod
+    def _count_verdict(job: Job, task: Task) -> None:
+        """Keep ``job.verdicts`` in step, like ``job.counts``."""
+        if task.verdict is not None:
+            job.verdicts[task.verdict] -= 1
+        task.verdict = task_verdict(task)
+        if task.verdict is not None:
+            job.verdicts[task.verdict] += 1
+
+    def subscribe(self, ids: Iterable[str]) -> Subscription:
+        sub = Subscription(ids)
+        for task_id in sub.ids:
+            self._watchers.setdefault(task_id, []).append(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        for task_id in sub.ids:
+            watchers = self._watchers.get(task_id)
+            if watchers is None:
+                continue
+            watchers.remove(sub)
+            if not watchers:
+                del self._watchers[task_id]
+
+    def _finish(self, task: Task) -> None:
+        self._finished[task.id] = time.monotonic()
+        # The token is only needed while the lookup is pending.
+        task.token = None
+
+    def evict(self) -> int:
+        """Drop finished tasks beyond the retention limits."""
+        cutoff = time.monotonic() - self.retention
+        evicted = 0
+        while self._finished:
+            task_id, finished_at = next(iter(self._finished.items()))
+            if len(self._finished) <= self.max_finished and finished_at > cutoff:
+                break
+            self._finished.popitem(last=False)
+            task = self._tasks.pop(task_id)
+            self.counts[task.status] -= 1
+            evicted += 1
+        while self._finished_jobs:
+            job_id, finished_at = next(iter(self._finished_jobs.items()))
+            if finished_at > cutoff:
+                break
+            self._finished_jobs.popitem(last=False)
+            del self._jobs[job_id]
+        while len(self._jobs) > self.max_jobs:
+            # Finished jobs go first, then the oldest running ones.
+            job_id = next(iter(self._finished_jobs), None) or next(iter(self._jobs))
+            self._finished_jobs.pop(job_id, None)
+            del self._jobs[job_id]
+        return evicted
+
+
+class DurableQueue:
+    """Queue of one provider's tasks kept in the database.
+
+    Offers the subset of ``asyncio.Queue`` used by the workers. Tasks are
+    claimed under a lease, only as many as workers are waiting for so that
+    urgent tasks queued later still overtake the rest, and restored into
+    the task store when this process did not create them. Leases of claimed
+    tasks are renewed while they wait for a worker, and tasks whose lease
+    ran out anyway are not delivered, as another process may have claimed
+    them since.
+    """
+
+    def __init__(self, service: str) -> None:
+        self.service = service
+        # Claimed task ids not yet handed to a worker, oldest first, with
+        # the time their lease runs out.
+        self._claimed: OrderedDict[str, float] = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._backlog = 0
+        # Workers waiting in get().
+        self._waiting = 0
+
+    def qsize(self) -> int:
+        return self._backlog + len(self._claimed)
+
+    def empty(self) -> bool:
+        return not self.qsize()
+
+    def put_nowait(self, task_id: str) -> None:
+        # The task row is written by the journal; only wake the consumers.
+        self._backlog += 1
+        self._wakeup.set()
+
+    async def put(self, task_id: str) -> None:
+        self.put_nowait(task_id)
+
+    def task_done(self) -> None:
+        pass
+
+    async def get(self) -> str:
+        self._waiting += 1
+        try:
+            task_id = await self._next()
+        finally:
+            self._waiting -= 1
+        _dispatched(task_id)
+        return task_id
+
+    async def _next(self) -> str:
+        while True:
+            while not self._claimed:
+                async with self._lock:
+                    if self._claimed:
+                        break
+                    self._wakeup.clear()
+                    await self.claim(min(self._waiting, settings.queue_batch_size))
+                if self._claimed:
+                    break
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), settings.queue_poll_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            await self._renew()
+            if not self._claimed:
+                continue
+            task_id, lease_until = self._claimed.popitem(last=False)
+            if lease_until > time.time():
+                return task_id
+            logger.warning("Lease of task %s ran out before a worker took it", task_id)
+
+    async def claim(self, limit: int) -> int:
+        """Claim up to ``limit`` tasks for the workers of this process."""
+        rows = await durable_queue.claim(self.service, limit)
+        self._backlog = await durable_queue.backlog(self.service)
+        for row in rows:
+            task = _tasks.get(row["id"]) or restore_task(row, status="queued")
+            self._claimed[task.id] = row["lease_until"]
+        return len(rows)
+
+    async def _renew(self) -> None:
+        """Extend the leases of waiting tasks past half the visibility timeout."""
+        if not self._claimed:
+            return
+        timeout = settings.queue_visibility_timeout
+        now = time.time()
+        if min(self._claimed.values()) - now > timeout / 2:
+            return
+        until = now + timeout
+        for task_id in await durable_queue.renew_leases(list(self._claimed), until):
+            if task_id in self._claimed:
+                self._claimed[task_id] = until
+
+    def holds(self, task_id: str) -> bool:
+        """Whether ``task_id`` was claimed here and waits for a worker."""
+        return task_id in self._claimed
 
 
 # In-memory storage
-_tasks: Dict[str, Task] = {}
-queue: asyncio.Queue[str] = asyncio.Queue()
+_tasks = TaskStore()
+if settings.queue_backend == "sqlite":
+    _tasks.journal = durable_queue.save
+# One queue per provider so slow providers do not hold up fast ones.
+queues: Dict[str, FairQueue | DurableQueue] = {}
+fair_share = FairShare()
+
+
+def _schedule_key(task_id: str) -> tuple[int, float]:
+    task = _tasks.get(task_id)
+    if task is None:
+        return 0, 0.0
+    return task.priority, task.fair_key
+
+
+def _dispatched(task_id: str) -> None:
+    task = _tasks.get(task_id)
+    if task is not None:
+        fair_share.advance((task.service, task.priority), task.fair_key)
+
+
+def get_queue(service: str) -> FairQueue | DurableQueue:
+    """Return the queue feeding the worker pool of ``service``.
+
+    Only enabled providers have worker pools, so other services are
+    rejected with ``ValueError`` rather than queued forever.
+    """
+    q = queues.get(service)
+    if q is None:
+        if service not in settings.providers:
+            raise ValueError(f"{service} is not an enabled provider")
+        if settings.queue_backend == "sqlite":
+            q = queues[service] = DurableQueue(service)
+        else:
+            q = queues[service] = FairQueue(_schedule_key, _dispatched)
+    return q
+
+
+# Queue of the default provider.
+queue = get_queue(settings.providers[0])
+
+registry.gauge(
+    "ioc_queue_depth",
+    "Tasks waiting in each provider queue.",
+    lambda: {(name,): q.qsize() for name, q in queues.items()},
+    ("provider",),
+)
+registry.gauge(
+    "ioc_tasks_outstanding", "Queued and processing tasks.", lambda: _tasks.outstanding
+)
 
 logger = logging.getLogger(__name__)
 
@@ -29,19 +414,259 @@ async def add_task(
     ioc: str,
     service: str = settings.providers[0],
     token: Optional[str] = None,
+    result: Optional[dict] = None,
+    job_id: Optional[str] = None,
+    priority: int = 0,
+    group: Optional[str] = None,
 ) -> str:
+    """Create a task and queue it.
+
+    Passing an already known ``result`` records the task as done without
+    queueing it. Tasks of one ``group``, by default the job, share the
+    workers fairly with other groups of the same ``priority``.
+    """
     task_id = str(uuid.uuid4())
-    task = Task(id=task_id, ioc=ioc, service=service, token=token)
-    _tasks[task_id] = task
-    await queue.put(task_id)
+    if result is not None:
+        _tasks.add(
+            Task(
+                id=task_id,
+                ioc=ioc,
+                service=service,
+                status="done",
+                result=result,
+                job_id=job_id,
+            )
+        )
+        return task_id
+    task = Task(
+        id=task_id,
+        ioc=ioc,
+        service=service,
+        token=token,
+        job_id=job_id,
+        priority=priority,
+        fair_key=fair_share.stamp((service, priority), group or job_id),
+    )
+    _tasks.add(task)
+    await get_queue(service).put(task_id)
     logger.info("Queued task %s for %s (%d total)", task_id, service, get_queue_size())
     return task_id
 
 
+def track_task(
+    ioc: str, service: str, job_id: Optional[str] = None
+) -> Task:
+    """Register a task that is processed outside the worker queues."""
+    task = Task(
+        id=str(uuid.uuid4()),
+        ioc=ioc,
+        service=service,
+        status="processing",
+        job_id=job_id,
+    )
+    _tasks.add(task)
+    return task
+
+
+def touch_task(task: Task) -> None:
+    """Persist a task still in progress so its lease does not run out."""
+    if _tasks.journal is not None and task.status == "processing":
+        _tasks.journal(task)
+
+
 def get_task(task_id: str) -> Optional[Task]:
     return _tasks.get(task_id)
 
 
+def start_task(task: Task) -> None:
+    """Mark a task taken off the queue as being processed here."""
+    task.status = "processing"
+    _tasks.started.add(task.id)
+
+
+def requeue_task(task: Task, delay: float, attempted: bool = True) -> None:
+    """Put a task back on the queue after ``delay`` seconds.
+
+    ``attempted`` is false when the provider was never called, which does
+    not count against ``max_retries``.
+    """
+    if attempted:
+        task.attempts += 1
+    task.available_at = time.time() + delay
+    task.status = "queued"
+    asyncio.get_running_loop().call_later(
+        delay, get_queue(task.service).put_nowait, task.id
+    )
+
+
+def restore_task(row: Dict[str, Any], status: str | None = None) -> Task:
+    """Add a task loaded from the database without writing it back.
+
+    Jobs referenced by the task are recreated as needed.
+    """
+    if row["job_id"] and _tasks.get_job(row["job_id"]) is None:
+        _tasks.add_job(Job(id=row["job_id"], service=row["service"]))
+    task = Task(
+        id=row["id"],
+        ioc=row["ioc"],
+        service=row["service"],
+        status=status or row["status"],
+        result=row["result"],
+        error=row["error"],
+        token=row["token"],
+        job_id=row["job_id"],
+        attempts=row["attempts"],
+        available_at=row["available_at"],
+        created_at=row["created_at"],
+        priority=row["priority"],
+        fair_key=row["fair_key"],
+        trace=row["trace"],
+    )
+    _tasks.add(task, persist=False)
+    return task
+
+
+async def recover_tasks(release_all: bool = True) -> int:
+    """Reload persisted tasks after a restart and requeue interrupted ones.
+
+    ``release_all`` drops every lease at once, which is only correct while
+    no other process works on the queue; otherwise only expired leases are
+    released.
+    """
+    await durable_queue.release_leases(expired_only=not release_all)
+    rows = await durable_queue.load_tasks()
+    jobs = set()
+    oldest: Dict[tuple[str, int], float] = {}
+    for row in rows:
+        if row["id"] not in _tasks:
+            restore_task(row)
+            jobs.add(row["job_id"])
+        if row["status"] == "queued":
+            level = (row["service"], row["priority"])
+            oldest[level] = min(oldest.get(level, row["fair_key"]), row["fair_key"])
+    # New work queues up with the recovered tasks instead of ahead of them.
+    for level, tag in oldest.items():
+        fair_share.advance(level, tag - 1)
+    for job_id in jobs - {None}:
+        close_job(_tasks.get_job(job_id))
+    logger.info("Recovered %d task(s) from the database", len(rows))
+    return len(rows)
+
+
+def apply_row(row: Dict[str, Any]) -> None:
+    """Update the local copy of a task changed by another process."""
+    if row["id"] in durable_queue._pending:
+        # This process has a newer state that is about to be written.
+        return
+    held = any(
+        isinstance(q, DurableQueue) and q.holds(row["id"]) for q in queues.values()
+    )
+    if held and row["status"] != "cancelled":
+        # Our own claim; the task stays queued until a worker picks it up,
+        # unless it was cancelled meanwhile and the worker should skip it.
+        return
+    if row["status"] != "queued":
+        # Claimed elsewhere; keeps fair share tags of new tasks current.
+        fair_share.advance((row["service"], row["priority"]), row["fair_key"])
+    task = _tasks.get(row["id"])
+    if task is None:
+        restore_task(row)
+        return
+    journal, _tasks.journal = _tasks.journal, None
+    try:
+        task.result = row["result"]
+        task.error = row["error"]
+        task.attempts = row["attempts"]
+        task.trace = row["trace"]
+        task.status = row["status"]
+    finally:
+        _tasks.journal = journal
+
+
+async def sync_tasks() -> None:
+    """Follow task changes made by other processes sharing the database.
+
+    API processes that do not run the workers themselves learn about
+    progress this way, so ``/status``, ``/jobs`` and the event streams work
+    whichever process serves them.
+    """
+    since = time.time()
+    while True:
+        await asyncio.sleep(settings.queue_poll_interval)
+        try:
+            await durable_queue.flush_tasks()
+            # Overlap polls a little to tolerate clock differences between hosts.
+            rows = await durable_queue.changed_since(since - SYNC_OVERLAP)
+            for row in rows:
+                apply_row(row)
+                since = max(since, row["updated_at"])
+            for name, q in queues.items():
+                if isinstance(q, DurableQueue):
+                    q._backlog = await durable_queue.backlog(name)
+        except Exception as exc:  # noqa: BLE001
+            logger.exception("Task sync failed: %s", exc)
+
+
+def release_claimed() -> int:
+    """Hand tasks claimed by this process back to the queue on shutdown.
+
+    Tasks that are only known from other processes, through ``sync_tasks``,
+    are left alone as their workers may still be running them.
+    """
+    released = 0
+    for q in queues.values():
+        if isinstance(q, DurableQueue):
+            while q._claimed:
+                task = _tasks.get(q._claimed.popitem(last=False)[0])
+                if task is not None and task.status == "queued":
+                    durable_queue.save(task)
+                    released += 1
+    for task_id in list(_tasks.started):
+        task = _tasks.get(task_id)
+        if task is not None and task.status == "processing":
+            task.status = "queued"
+            released += 1
+    if released:
+        logger.info("Released %d claimed task(s)", released)
+    return released
+
+
+def create_job(service: str) -> Job:
+    job = Job(id=str(uuid.uuid4()), service=service)
+    _tasks.add_job(job)
+    return job
+
+
+def close_job(job: Job) -> None:
+    _tasks.close_job(job)
+
+
+def get_job(job_id: str) -> Optional[Job]:
+    return _tasks.get_job(job_id)
+
+
+def cancel_job(job: Job) -> int:
+    """Cancel every task of ``job`` that has not started yet."""
+    job.cancelled = True
+    cancelled = 0
+    for task_id in job.task_ids:
+        task = _tasks.get(task_id)
+        if task is not None and task.status == "queued":
+            task.status = "cancelled"
+            cancelled += 1
+    logger.info("Cancelled %d queued task(s) of job %s", cancelled, job.id)
+    return cancelled
+
+
+def subscribe(ids: Iterable[str]) -> Subscription:
+    """Start watching status changes of the given tasks."""
+    return _tasks.subscribe(ids)
+
+
+def unsubscribe(sub: Subscription) -> None:
+    _tasks.unsubscribe(sub)
+
+
 def get_queue_size() -> int:
     """Return the total number of outstanding tasks."""
-    return sum(1 for task in _tasks.values() if task.status not in {"done", "error"})
+    return _tasks.outstanding
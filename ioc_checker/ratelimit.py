@@ -0,0 +1,158 @@
+"""Per provider and per token request pacing."""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Dict, Tuple
+import logging
+import random
+import time
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Provider responses that mean "slow down" rather than a failed lookup.
+RETRY_STATUSES = {403, 429}
+QUOTA_WINDOW = 24 * 3600
+
+
+class RateLimited(Exception):
+    """Raised when a lookup has to be retried after ``retry_after`` seconds.
+
+    ``called`` is false when the provider was never called because no token
+    became available in time.
+    """
+
+    def __init__(
+        self, retry_after: float, reason: str = "rate limited", called: bool = True
+    ) -> None:
+        super().__init__(f"{reason}; retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+        self.reason = reason
+        self.called = called
+
+
+class TokenBucket:
+    """Token bucket with backoff and an optional daily quota estimate.
+
+    ``rate`` tokens per second are added up to ``burst``; a ``rate`` of
+    ``None`` disables pacing but keeps backoff after throttling responses.
+    """
+
+    def __init__(
+        self,
+        rate: float | None = None,
+        burst: float = 1,
+        daily_quota: int | None = None,
+    ) -> None:
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.daily_quota = daily_quota
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.failures = 0
+        self.used = 0
+        self.window_start = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now - self.window_start >= QUOTA_WINDOW:
+            self.window_start = now
+            self.used = 0
+
+    def wait_time(self, now: float | None = None) -> float:
+        """Seconds until a request may be sent."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        wait = max(self.blocked_until - now, 0.0)
+        if self.daily_quota is not None and self.used >= self.daily_quota:
+            wait = max(wait, self.window_start + QUOTA_WINDOW - now)
+        if self.rate and self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    async def acquire(self, max_wait: float | None = None) -> None:
+        """Wait for a token, raising ``RateLimited`` if that takes too long."""
+        max_wait = settings.rate_limit_max_wait if max_wait is None else max_wait
+        while True:
+            wait = self.wait_time()
+            if wait <= 0:
+                break
+            if wait > max_wait:
+                raise RateLimited(wait, called=False)
+            await asyncio.sleep(wait)
+        if self.rate:
+            self.tokens -= 1
+        self.used += 1
+
+    def backoff(
+        self, retry_after: float | None = None, quota_exhausted: bool = False
+    ) -> float:
+        """Block the bucket after a throttling response and return the delay.
+
+        ``Retry-After`` is honoured when present, otherwise the delay grows
+        exponentially with the number of consecutive failures. Jitter keeps
+        requeued tasks from retrying in lockstep.
+        """
+        self.failures += 1
+        if quota_exhausted and self.daily_quota is not None:
+            self.used = max(self.used, self.daily_quota)
+        if retry_after is None:
+            retry_after = min(
+                settings.backoff_base * 2 ** (self.failures - 1), settings.backoff_max
+            )
+        delay = retry_after * random.uniform(1.0, 1.25)
+        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        return delay
+
+    def success(self) -> None:
+        self.failures = 0
+
+    def remaining_quota(self) -> int | None:
+        if self.daily_quota is None:
+            return None
+        return max(self.daily_quota - self.used, 0)
+
+    def stats(self) -> Dict[str, float | int | None]:
+        now = time.monotonic()
+        self._refill(now)
+        return {
+            "tokens": round(self.tokens, 2),
+            "blocked_for": round(max(self.blocked_until - now, 0.0), 1),
+            "failures": self.failures,
+            "used": self.used,
+            "remaining_quota": self.remaining_quota(),
+        }
+
+
+class RateLimiter:
+    """Registry of token buckets keyed by ``(provider, token)``."""
+
+    def __init__(self) -> None:
+        self._buckets: Dict[Tuple[str, str | None], TokenBucket] = {}
+
+    def bucket(self, provider: str, token: str | None = None) -> TokenBucket:
+        key = (provider, token)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            config = settings.rate_limits.get(provider, {})
+            bucket = self._buckets[key] = TokenBucket(
+                rate=config.get("rate"),
+                burst=config.get("burst", 1),
+                daily_quota=config.get("daily_quota"),
+            )
+        return bucket
+
+    def stats(self) -> Dict[str, Dict[str, float | int | None]]:
+        # Only the last characters of a token are shown.
+        return {
+            f"{provider}:{token[-4:]}" if token else provider: bucket.stats()
+            for (provider, token), bucket in self._buckets.items()
+        }
+
+
+limiter = RateLimiter()
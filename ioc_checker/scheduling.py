@@ -0,0 +1,101 @@
+"""Priority and fair-share ordering of queued tasks.
+
+Tasks are served by priority, highest first. Within a priority level they
+are ordered by start-time fair queuing tags: each group (a submitter or a
+job) gets consecutive tags that start no earlier than the level's virtual
+clock, the tag of the task dispatched last. Serving tasks in tag order
+therefore takes turns between the groups with waiting tasks however many
+each of them queued, and a group arriving late starts at the clock instead
+of behind everything queued before it. Tags are computed once per task, so
+the queues only need a heap or an index.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from heapq import heappop, heappush
+import itertools
+from typing import Callable, Dict, Hashable, Tuple
+
+# Levels used when a scan request does not ask for one.
+PRIORITY_BULK = 0
+PRIORITY_INTERACTIVE = 1
+
+Level = Tuple[str, int]
+
+
+class FairShare:
+    """Virtual clocks and the last tag of every group per level."""
+
+    # Stamps between sweeps of groups that fell behind the clock.
+    PRUNE_EVERY = 4096
+
+    def __init__(self) -> None:
+        self._clock: Dict[Level, float] = {}
+        self._last: Dict[Tuple[Level, Hashable], float] = {}
+        self._stamps = 0
+
+    def stamp(self, level: Level, group: Hashable | None = None) -> float:
+        """Return the tag of a new task of ``group`` at ``level``.
+
+        Tasks without a group are treated as groups of their own.
+        """
+        tag = self._clock.get(level, 0.0)
+        if group is not None:
+            tag = max(tag, self._last.get((level, group), 0.0))
+        tag += 1
+        if group is not None:
+            self._last[(level, group)] = tag
+        self._stamps += 1
+        if self._stamps % self.PRUNE_EVERY == 0:
+            self.prune()
+        return tag
+
+    def advance(self, level: Level, tag: float) -> None:
+        """Move the clock of ``level`` to a dispatched task's tag."""
+        if tag > self._clock.get(level, 0.0):
+            self._clock[level] = tag
+
+    def prune(self) -> int:
+        """Forget groups whose last tag the clock has passed."""
+        stale = [
+            key for key, tag in self._last.items() if tag <= self._clock.get(key[0], 0.0)
+        ]
+        for key in stale:
+            del self._last[key]
+        return len(stale)
+
+    def clock(self, level: Level) -> float:
+        return self._clock.get(level, 0.0)
+
+
+class FairQueue(asyncio.Queue):
+    """``asyncio.Queue`` handing out items by priority and fair share tag.
+
+    ``key`` returns ``(priority, tag)`` for an item when it is put;
+    ``dispatched`` is called with every item taken off the queue. Both
+    operations are O(log n).
+    """
+
+    def __init__(
+        self,
+        key: Callable[[str], Tuple[int, float]],
+        dispatched: Callable[[str], None] | None = None,
+    ) -> None:
+        self._key = key
+        self._dispatched = dispatched
+        super().__init__()
+
+    def _init(self, maxsize: int) -> None:
+        self._queue: list[tuple[int, float, int, str]] = []
+        self._seq = itertools.count()
+
+    def _put(self, item: str) -> None:
+        priority, tag = self._key(item)
+        heappush(self._queue, (-priority, tag, next(self._seq), item))
+
+    def _get(self) -> str:
+        item = heappop(self._queue)[-1]
+        if self._dispatched is not None:
+            self._dispatched(item)
+        return item
@@ -0,0 +1,208 @@
+"""Per-task span timings and an opt-in sampling profiler for slow tasks.
+
+Workers open a trace for every task; code on the lookup path wraps its
+phases in ``span()``, which costs two clock reads when a trace is active
+and nothing otherwise. With ``profile_slow_tasks`` set, a background thread
+also samples the stack of every traced task and tasks slower than the
+threshold leave a profile in ``profile_dir``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from pathlib import Path
+import logging
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, List
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    """Accumulated seconds per span name for one task."""
+
+    def __init__(self, task_id: str) -> None:
+        self.task_id = task_id
+        self.started = time.perf_counter()
+        self.spans: Dict[str, float] = {}
+        # Folded stacks seen by the profiler and how often.
+        self.samples: Counter[str] = Counter()
+        self.task: asyncio.Task | None = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.thread_id = 0
+        self._token: Token | None = None
+
+    def add(self, name: str, seconds: float) -> None:
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def to_dict(self) -> Dict[str, float]:
+        """Return the spans in milliseconds."""
+        return {name: round(seconds * 1000, 1) for name, seconds in self.spans.items()}
+
+
+_current: ContextVar[Trace | None] = ContextVar("ioc_trace", default=None)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Add the time spent in the block to the current task's trace."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - started)
+
+
+def begin(task_id: str) -> Trace:
+    """Start tracing the task handled by the calling asyncio task."""
+    trace = Trace(task_id)
+    trace._token = _current.set(trace)
+    if settings.profile_slow_tasks > 0:
+        trace.task = asyncio.current_task()
+        trace.loop = asyncio.get_running_loop()
+        trace.thread_id = threading.get_ident()
+        profiler.watch(trace)
+    return trace
+
+
+def end(trace: Trace) -> Dict[str, float]:
+    """Finish ``trace`` and return its spans in milliseconds.
+
+    A profile is written when the task ran longer than ``profile_slow_tasks``.
+    """
+    if trace._token is not None:
+        _current.reset(trace._token)
+        trace._token = None
+    total = time.perf_counter() - trace.started
+    trace.add("total", total)
+    if trace.task is not None:
+        profiler.unwatch(trace)
+        if total >= settings.profile_slow_tasks and trace.samples:
+            dump(trace)
+    return trace.to_dict()
+
+
+def dump(trace: Trace) -> Path | None:
+    """Write the samples of ``trace`` in folded stack format.
+
+    Each line is ``frame;frame;... count``, as read by flamegraph.pl and
+    speedscope.
+    """
+    directory = Path(settings.profile_dir)
+    path = directory / f"{trace.task_id}.folded"
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        with path.open("w") as fh:
+            for stack, count in trace.samples.most_common():
+                fh.write(f"{stack} {count}\n")
+    except OSError as exc:
+        logger.warning("Could not write profile for task %s: %s", trace.task_id, exc)
+        return None
+    logger.warning(
+        "Task %s took %.0f ms; profile written to %s",
+        trace.task_id,
+        trace.spans.get("total", 0.0) * 1000,
+        path,
+    )
+    return path
+
+
+def _label(frame: Any) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})"
+
+
+def _await_stack(coro: Any) -> List[str]:
+    """Frames of a suspended coroutine chain, outermost first."""
+    stack = []
+    while coro is not None:
+        frame = (
+            getattr(coro, "cr_frame", None)
+            or getattr(coro, "ag_frame", None)
+            or getattr(coro, "gi_frame", None)
+        )
+        if frame is None:
+            break
+        stack.append(_label(frame))
+        coro = (
+            getattr(coro, "cr_await", None)
+            or getattr(coro, "ag_await", None)
+            or getattr(coro, "gi_yieldfrom", None)
+        )
+    return stack
+
+
+def _thread_stack(frame: Any, root: Any) -> List[str]:
+    """Frames of a running task from its coroutine down, outermost first."""
+    stack = []
+    while frame is not None:
+        stack.append(_label(frame))
+        if frame is root:
+            break
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class Profiler:
+    """Sample the stacks of traced tasks from a background thread.
+
+    A running task contributes the interpreter stack of its thread; a
+    suspended one the chain of awaits it is waiting in, so time spent on
+    network I/O shows up as well as CPU time. The thread only runs while
+    traces are being watched.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._traces: set[Trace] = set()
+        self._thread: threading.Thread | None = None
+
+    def watch(self, trace: Trace) -> None:
+        with self._lock:
+            self._traces.add(trace)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="ioc-profiler", daemon=True
+                )
+                self._thread.start()
+
+    def unwatch(self, trace: Trace) -> None:
+        with self._lock:
+            self._traces.discard(trace)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(settings.profile_interval)
+            with self._lock:
+                if not self._traces:
+                    self._thread = None
+                    return
+                self.sample()
+
+    def sample(self) -> None:
+        frames = sys._current_frames()
+        for trace in self._traces:
+            coro = trace.task.get_coro()
+            if asyncio.current_task(trace.loop) is trace.task:
+                stack = _thread_stack(
+                    frames.get(trace.thread_id), getattr(coro, "cr_frame", None)
+                )
+            else:
+                stack = _await_stack(coro)
+            if stack:
+                trace.samples[";".join(stack)] += 1
+
+
+profiler = Profiler()
@@ -1,12 +1,20 @@
+import asyncio
+from collections import Counter
 from contextlib import asynccontextmanager
-from typing import Any, Dict
+from fnmatch import fnmatch
+from typing import Any, Awaitable, Callable, Dict
 from collections.abc import AsyncIterator
 import logging
+import time
+import weakref
 
-from playwright.async_api import async_playwright, BrowserContext
-from iocsearcher.searcher import Searcher
+from playwright.async_api import BrowserContext, Page, Request, Route
 
+from . import classifier
+from .browser import browser_manager
+from .metrics import registry
 from .config import settings
+from .tracing import span
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +24,9 @@ URL_MAP = {
     "hash": ("file", "files"),
 }
 
+# Headers the GUI sends with its own /ui API calls.
+UI_HEADERS = {"accept": "application/json", "x-tool": "vt-ui-main"}
+
 TAG_PATHS = {
     "ip": ("ip-address-view", "vt-ui-ip-card"),
     "domain": ("domain-view", "vt-ui-domain-card"),
@@ -23,71 +34,388 @@ TAG_PATHS = {
 }
 
 
-searcher = Searcher()
+def classify_ioc(ioc: str) -> str:
+    kind = classifier.classify_ioc(ioc)
+    return kind if kind in {"ip", "hash"} else "domain"
 
 
-def classify_ioc(ioc: str) -> str:
-    parsed = searcher.search_data(ioc)
-    for item in parsed:
-        kind = item.name.lower()
-        if kind in {"ip4", "ip6"}:
-            return "ip"
-        if kind in {"md5", "sha1", "sha256", "sha512"}:
-            return "hash"
-    return "domain"
+def verdict(result: Dict[str, Any]) -> str:
+    """Summarise a lookup result as malicious/suspicious/clean/unknown."""
+    stats = result.get("last_analysis_stats") or {}
+    if stats.get("malicious"):
+        return "malicious"
+    if stats.get("suspicious"):
+        return "suspicious"
+    if stats.get("harmless") or stats.get("undetected"):
+        return "clean"
+    return "unknown"
 
 
-@asynccontextmanager
-async def playwright_browser() -> AsyncIterator[BrowserContext]:
-    logger.info("Launching browser (headless=%s)", settings.headless)
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=settings.headless)
-        context = await browser.new_context(ignore_https_errors=True)
+def should_block(url: str, resource_type: str) -> bool:
+    """Whether a request made while loading a GUI page can be aborted.
+
+    URLs matching ``vt_allow_patterns`` are always loaded; everything else
+    is blocked by resource type or by ``vt_block_patterns``.
+    """
+    if any(fnmatch(url, pattern) for pattern in settings.vt_allow_patterns):
+        return False
+    if resource_type in settings.vt_block_resource_types:
+        return True
+    return any(fnmatch(url, pattern) for pattern in settings.vt_block_patterns)
+
+
+class PageMeter:
+    """Request, byte and block counters of one page."""
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.requests = 0
+        self.blocked = 0
+        self.bytes = 0
+
+    async def route(self, route: Route) -> None:
+        request = route.request
+        if should_block(request.url, request.resource_type):
+            self.blocked += 1
+            await route.abort("blockedbyclient")
+        else:
+            # Let context level handlers see the request before it is sent.
+            await route.fallback()
+
+    async def finished(self, request: Request) -> None:
+        self.requests += 1
+        try:
+            sizes = await request.sizes()
+        except Exception:  # noqa: BLE001
+            return
+        self.bytes += sizes["responseHeadersSize"] + max(sizes["responseBodySize"], 0)
+
+
+class PageStats:
+    """Aggregated cost of GUI page loads."""
+
+    def __init__(self) -> None:
+        self.pages = 0
+        self.requests = 0
+        self.blocked = 0
+        self.bytes = 0
+        self.latency = 0.0
+
+    def record(self, meter: PageMeter | None, latency: float) -> None:
+        self.pages += 1
+        self.latency += latency
+        if meter is not None:
+            self.requests += meter.requests
+            self.blocked += meter.blocked
+            self.bytes += meter.bytes
+
+    def stats(self) -> Dict[str, float | int]:
+        pages = self.pages or 1
+        return {
+            "pages": self.pages,
+            "requests": self.requests,
+            "blocked": self.blocked,
+            "bytes": self.bytes,
+            "avg_bytes": round(self.bytes / pages),
+            "avg_latency_ms": round(self.latency / pages * 1000, 1),
+        }
+
+
+page_stats = PageStats()
+LOAD_SECONDS = registry.histogram(
+    "ioc_virustotal_load_seconds",
+    "VirusTotal lookup load time by path (direct /ui call or GUI page).",
+    ("mode",),
+)
+registry.gauge(
+    "ioc_virustotal_page_bytes",
+    "Bytes transferred by GUI page loads.",
+    lambda: page_stats.bytes,
+)
+registry.gauge(
+    "ioc_virustotal_blocked_requests",
+    "Requests aborted while loading GUI pages.",
+    lambda: page_stats.blocked,
+)
+# Lookups answered by the direct /ui call, rejected direct calls and GUI loads.
+direct_stats: Counter[str] = Counter()
+_direct_paused_until = 0.0
+# Direct call responses that mean VirusTotal wants a real browser.
+REJECT_STATUSES = {401, 403, 429}
+
+
+class IOCNotFound(Exception):
+    """VirusTotal has no report for the IOC."""
+
+
+_meters: "weakref.WeakKeyDictionary[Page, PageMeter]" = weakref.WeakKeyDictionary()
+
+
+async def setup_page(page: Page) -> None:
+    """Attach request blocking and byte accounting to a new page."""
+    meter = _meters[page] = PageMeter()
+    if settings.vt_block_requests:
+        await page.route("**/*", meter.route)
+    page.on("requestfinished", meter.finished)
+
+
+class PagePool:
+    """Bounded set of reusable pages of one browser context.
+
+    At most ``size`` pages are open at once. Pages are reset to
+    ``about:blank`` between lookups and replaced after ``max_uses`` lookups
+    or when a lookup using them fails. The context is created by
+    ``new_context`` on first use and again after it was closed, e.g. because
+    the browser crashed.
+    """
+
+    def __init__(
+        self,
+        new_context: Callable[[], Awaitable[BrowserContext]],
+        size: int | None = None,
+        max_uses: int | None = None,
+        setup: Callable[[Page], Awaitable[None]] | None = None,
+    ) -> None:
+        self.new_context = new_context
+        self.context: BrowserContext | None = None
+        self._context_lock = asyncio.Lock()
+        self.setup = setup
+        self.size = max(size or settings.vt_page_pool_size, 1)
+        self.max_uses = max(max_uses or settings.vt_page_max_uses, 1)
+        self._slots = asyncio.Semaphore(self.size)
+        self._idle: list[Page] = []
+        self._uses: Dict[Page, int] = {}
+        self.created = 0
+        self.recycled = 0
+
+    async def get_context(self) -> BrowserContext:
+        async with self._context_lock:
+            if self.context is None:
+                context = await self.new_context()
+                context.on("close", self._context_closed)
+                self.context = context
+            return self.context
+
+    def _context_closed(self, context: BrowserContext) -> None:
+        if context is not self.context:
+            return
+        logger.warning("Browser context closed; dropping %d page(s)", len(self._uses))
+        self.context = None
+        # Pages of a closed context are dead; in-use ones fail and are discarded.
+        idle, self._idle = self._idle, []
+        for page in idle:
+            self._uses.pop(page, None)
+
+    async def _new_page(self) -> Page:
+        context = await self.get_context()
+        page = await context.new_page()
+        page.set_default_navigation_timeout(10_000)
+        page.set_default_timeout(10_000)
+        if self.setup is not None:
+            await self.setup(page)
+        self._uses[page] = 0
+        self.created += 1
+        return page
+
+    async def _discard(self, page: Page) -> None:
+        self._uses.pop(page, None)
+        self.recycled += 1
         try:
-            logger.info("Browser context ready")
-            yield context
-        finally:
-            logger.info("Closing browser")
-            await context.close()
-            await browser.close()
+            await page.close()
+        except Exception as exc:  # noqa: BLE001
+            logger.debug("Closing page failed: %s", exc)
+
+    async def _release(self, page: Page, healthy: bool) -> None:
+        self._uses[page] += 1
+        if healthy and self._uses[page] < self.max_uses and not page.is_closed():
+            try:
+                await page.goto("about:blank")
+            except Exception as exc:  # noqa: BLE001
+                logger.debug("Resetting page failed: %s", exc)
+            else:
+                self._idle.append(page)
+                return
+        await self._discard(page)
+
+    @asynccontextmanager
+    async def page(self) -> AsyncIterator[Page]:
+        """Borrow a page, waiting while all pages are in use."""
+        async with self._slots:
+            page = self._idle.pop() if self._idle else await self._new_page()
+            healthy = False
+            try:
+                yield page
+                healthy = True
+            finally:
+                await self._release(page, healthy)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": self.size,
+            "idle": len(self._idle),
+            "open": len(self._uses),
+            "created": self.created,
+            "recycled": self.recycled,
+        }
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        for page in idle:
+            await self._discard(page)
+        context, self.context = self.context, None
+        if context is not None:
+            try:
+                await context.close()
+            except Exception as exc:  # noqa: BLE001
+                logger.debug("Closing context failed: %s", exc)
+
 
+async def _new_context() -> BrowserContext:
+    return await browser_manager.new_context(ignore_https_errors=True)
 
-async def fetch_ioc_info(ioc: str, context: BrowserContext) -> Dict[str, Any]:
+
+@asynccontextmanager
+async def playwright_browser() -> AsyncIterator[PagePool]:
+    """Yield a page pool on its own context of the shared browser.
+
+    Nothing is launched until the first lookup needs a page.
+    """
+    pool = PagePool(_new_context, setup=setup_page)
+    try:
+        yield pool
+    finally:
+        await pool.close()
+
+
+async def fetch_direct(pool: PagePool, api_url: str, gui_url: str) -> Dict[str, Any] | None:
+    """Fetch the ``/ui`` JSON without rendering the GUI page.
+
+    The request shares cookies with the browser context. ``None`` means
+    the GUI page has to be loaded instead; after a rejection or a failed
+    request direct calls also pause for ``vt_direct_retry_interval``.
+    Raises ``IOCNotFound`` for unknown IOCs.
+    """
+    global _direct_paused_until
+    if time.monotonic() < _direct_paused_until:
+        return None
+    context = await pool.get_context()
+    started = time.monotonic()
+    try:
+        response = await context.request.get(
+            api_url, headers={**UI_HEADERS, "referer": gui_url}, timeout=10_000
+        )
+        if response.status == 404:
+            direct_stats["direct"] += 1
+            LOAD_SECONDS.observe(time.monotonic() - started, "direct")
+            raise IOCNotFound(api_url)
+        if response.ok:
+            data = (await response.json())["data"]["attributes"]
+            direct_stats["direct"] += 1
+            LOAD_SECONDS.observe(time.monotonic() - started, "direct")
+            return data
+        logger.debug("Direct lookup rejected with %s: %s", response.status, api_url)
+        if response.status not in REJECT_STATUSES:
+            direct_stats["failed"] += 1
+            return None
+    except IOCNotFound:
+        raise
+    except Exception as exc:  # noqa: BLE001
+        logger.debug("Direct lookup failed for %s: %s", api_url, exc)
+    direct_stats["rejected"] += 1
+    # Give the API a rest instead of paying for a failed call per lookup.
+    _direct_paused_until = time.monotonic() + settings.vt_direct_retry_interval
+    return None
+
+
+async def fetch_gui(
+    ioc_type: str, gui_url: str, api_url: str, pool: PagePool
+) -> tuple[Dict[str, Any], list[str]]:
+    """Load the GUI page, returning the ``/ui`` attributes and rendered tags."""
+    async with pool.page() as page:
+        meter = _meters.get(page)
+        if meter is not None:
+            meter.reset()
+        started = time.monotonic()
+        with span("page_load"):
+            async with page.expect_response(
+                lambda r: r.url.startswith(api_url)
+            ) as resp_info:
+                await page.goto(gui_url, wait_until=settings.wait_until)
+            response = await resp_info.value
+            if response.status == 404:
+                raise IOCNotFound(api_url)
+            data = (await response.json())["data"]["attributes"]
+        latency = time.monotonic() - started
+        page_stats.record(meter, latency)
+        LOAD_SECONDS.observe(latency, "gui")
+        if meter is not None:
+            logger.debug(
+                "Loaded %s in %.0f ms: %d requests, %d blocked, %d bytes",
+                gui_url,
+                latency * 1000,
+                meter.requests,
+                meter.blocked,
+                meter.bytes,
+            )
+
+        tags: list[str] = []
+        view_tag, card_tag = TAG_PATHS.get(ioc_type, (None, None))
+        if view_tag and card_tag:
+            js = f"""
+            () => {{
+                const view = document.querySelector('#view-container > {view_tag}');
+                if (!view) return [];
+                const card = view.shadowRoot.querySelector('div > div > div.col-12.col-md > {card_tag}');
+                if (!card) return [];
+                return Array.from(card.shadowRoot.querySelectorAll('div > div.card-body.d-flex > div > div.hstack.gap-2 > a')).map(e => e.textContent.trim());
+            }}
+            """
+            try:
+                with span("tag_scrape"):
+                    tags = await page.evaluate(js)
+            except Exception as exc:  # noqa: BLE001
+                logger.debug("Tag extraction failed for %s: %s", gui_url, exc)
+    return data, tags
+
+
+async def fetch_ioc_info(ioc: str, pool: PagePool) -> Dict[str, Any]:
     logger.info("Fetching %s from VirusTotal", ioc)
-    ioc_type = classify_ioc(ioc)
+    with span("classify"):
+        ioc_type = classify_ioc(ioc)
     gui_seg, api_seg = URL_MAP[ioc_type]
     gui_url = f"https://www.virustotal.com/gui/{gui_seg}/{ioc}"
     api_url = f"https://www.virustotal.com/ui/{api_seg}/{ioc}?relationships=*"
 
-    page = await context.new_page()
-    page.set_default_navigation_timeout(10_000)
-    page.set_default_timeout(10_000)
-    async with page.expect_response(lambda r: r.url.startswith(api_url)) as resp_info:
-        await page.goto(gui_url, wait_until=settings.wait_until)
-    response = await resp_info.value
-    data = (await response.json())["data"]["attributes"]
-
-    tags: list[str] = []
-    view_tag, card_tag = TAG_PATHS.get(ioc_type, (None, None))
-    if view_tag and card_tag:
-        js = f"""
-        () => {{
-            const view = document.querySelector('#view-container > {view_tag}');
-            if (!view) return [];
-            const card = view.shadowRoot.querySelector('div > div > div.col-12.col-md > {card_tag}');
-            if (!card) return [];
-            return Array.from(card.shadowRoot.querySelectorAll('div > div.card-body.d-flex > div > div.hstack.gap-2 > a')).map(e => e.textContent.trim());
-        }}
-        """
-        try:
-            tags = await page.evaluate(js)
-        except Exception as exc:  # noqa: BLE001
-            logger.debug("Tag extraction failed for %s: %s", ioc, exc)
-    await page.close()
+    data = None
+    try:
+        if not settings.vt_render_tags:
+            with span("direct_fetch"):
+                data = await fetch_direct(pool, api_url, gui_url)
+        if data is not None:
+            # Without the rendered card the raw attribute tags are reported.
+            tags = list(data.get("tags") or [])
+        else:
+            direct_stats["gui"] += 1
+            data, tags = await fetch_gui(ioc_type, gui_url, api_url, pool)
+    except IOCNotFound:
+        logger.info("VirusTotal has no report for %s", ioc)
+        return {
+            "ioc": ioc,
+            "type": ioc_type,
+            "status_code": 404,
+            "error": "not found",
+            "reputation": None,
+            "last_analysis_stats": {},
+            "tags": [],
+        }
 
+    # Reported like "not found" so both are cached, each with its own TTL.
     result: Dict[str, Any] = {
         "ioc": ioc,
         "type": ioc_type,
+        "status_code": 200,
         "reputation": data.get("reputation"),
         "last_analysis_stats": data.get("last_analysis_stats", {}),
         "tags": tags,
@@ -1,50 +1,252 @@
+import argparse
 import asyncio
+from collections import Counter
 import logging
+import signal
+import time
 from typing import Dict, Any
 
-from .queue import queue, get_task
+from . import durable_queue, tracing
+from .browser import browser_manager
+from .clients import client_pool
+from .queue import (
+    Task,
+    get_queue,
+    get_task,
+    release_claimed,
+    requeue_task,
+    start_task,
+)
 from .config import settings
-from .database import get_cached_result, cache_result
-from .providers import init_contexts, fetch_ioc
+from .database import (
+    cache_maintenance,
+    cache_result,
+    cache_writer,
+    flush_cache,
+    get_cached_result,
+    init_db,
+)
+from .metrics import registry
+from .providers import get_provider, init_contexts, fetch_ioc, requires_token
+from .ratelimit import RateLimited
+from .singleflight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
+# Concurrent tasks for the same lookup share one provider call.
+lookups = SingleFlight()
 
-async def worker() -> None:
-    logger.info("Worker started")
-    contexts, stack = await init_contexts(settings.providers)
-    try:
-        while True:
-            task_id = await queue.get()
-            logger.info("Processing task %s", task_id)
-            task = get_task(task_id)
-            if task is None:
-                logger.warning("Task %s not found", task_id)
-                queue.task_done()
-                continue
-            task.status = "processing"
-            try:
-                cached = await get_cached_result(task.ioc, task.service)
-                if cached is not None:
-                    task.result = cached
-                    task.status = "done"
-                    logger.info("Cache hit for task %s", task_id)
-                else:
-                    task.result = await fetch_ioc(
-                        task.service, task.ioc, task.token, contexts
-                    )
-                    await cache_result(task.ioc, task.service, task.result)
-                    task.status = "done"
-                    logger.info("Task %s completed", task_id)
-            except Exception as exc:  # noqa: BLE001
-                task.status = "error"
-                task.error = str(exc)
-                logger.exception("Task %s failed: %s", task_id, exc)
+# Running and busy workers per provider.
+workers: Counter[str] = Counter()
+busy: Counter[str] = Counter()
+
+TASK_WAIT = registry.histogram(
+    "ioc_task_wait_seconds", "Time tasks waited in the queue.", ("provider",)
+)
+TASK_DURATION = registry.histogram(
+    "ioc_task_duration_seconds", "Time workers spent on a task.", ("provider",)
+)
+TASKS = registry.counter(
+    "ioc_tasks_total", "Tasks handled by workers by outcome.", ("provider", "outcome")
+)
+BUSY_SECONDS = registry.counter(
+    "ioc_worker_busy_seconds_total", "Time workers spent on tasks.", ("provider",)
+)
+
+
+def _by_provider(counts: Counter[str]) -> Dict[tuple, float]:
+    return {(name,): value for name, value in counts.items()}
+
+
+registry.gauge(
+    "ioc_workers", "Running workers.", lambda: _by_provider(workers), ("provider",)
+)
+registry.gauge(
+    "ioc_workers_busy",
+    "Workers currently handling a task.",
+    lambda: _by_provider(busy),
+    ("provider",),
+)
+
+
+async def lookup(task: Task, contexts: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the cached result for a task or fetch and cache it."""
+    with tracing.span("cache_read"):
+        cached = await get_cached_result(task.ioc, task.service)
+    if cached is not None:
+        logger.info("Cache hit for task %s", task.id)
+        return cached
+    result = await fetch_ioc(task.service, task.ioc, task.token, contexts)
+    with tracing.span("cache_write"):
+        await cache_result(task.ioc, task.service, result)
+    return result
+
+
+def lookup_key(task: Task) -> tuple:
+    """Key under which concurrent lookups of ``task`` share a call.
+
+    Token based providers answer with errors and rate limits of the token
+    used, so their calls are only shared between tasks with the same token.
+    """
+    token = task.token if requires_token(task.service) else None
+    return task.ioc, task.service, token
+
+
+async def worker(
+    service: str = settings.providers[0], contexts: Dict[str, Any] | None = None
+) -> None:
+    """Process tasks from the queue of ``service`` one at a time."""
+    logger.info("%s worker started", service)
+    contexts = contexts or {}
+    queue = get_queue(service)
+    while True:
+        task_id = await queue.get()
+        logger.info("Processing task %s", task_id)
+        task = get_task(task_id)
+        if task is None:
+            logger.warning("Task %s not found", task_id)
             queue.task_done()
+            continue
+        if task.status != "queued":
+            # Cancelled while waiting in the queue.
+            logger.info("Skipping %s task %s", task.status, task_id)
+            queue.task_done()
+            continue
+        start_task(task)
+        trace = tracing.begin(task_id)
+        waited = time.time() - max(task.created_at, task.available_at)
+        trace.add("queue_wait", waited)
+        TASK_WAIT.observe(waited, service)
+        busy[service] += 1
+        started = time.monotonic()
+        status, retry_after, called = "error", None, True
+        try:
+            task.result = await lookups.do(lookup_key(task), lambda: lookup(task, contexts))
+            status = "done"
+            logger.info("Task %s completed", task_id)
+        except RateLimited as exc:
+            # Waiting for a token is not an attempt; only provider calls are.
+            if not exc.called or task.attempts < settings.max_retries:
+                logger.info("Requeueing task %s: %s", task_id, exc)
+                retry_after, called = exc.retry_after, exc.called
+            else:
+                task.error = exc.reason
+                logger.warning("Task %s gave up after %d retries", task_id, task.attempts)
+        except Exception as exc:  # noqa: BLE001
+            task.error = str(exc)
+            logger.exception("Task %s failed: %s", task_id, exc)
+        finally:
+            elapsed = time.monotonic() - started
+            busy[service] -= 1
+            BUSY_SECONDS.inc(service, amount=elapsed)
+            TASK_DURATION.observe(elapsed, service)
+            task.trace = tracing.end(trace)
+        # The status changes last: the journal saves the task when it does,
+        # and the error and trace must already be part of that row.
+        if retry_after is not None:
+            requeue_task(task, retry_after, attempted=called)
+        else:
+            task.status = status
+        TASKS.inc(service, task.status)
+        queue.task_done()
+
+
+async def provider_pool(service: str, count: int) -> None:
+    """Run ``count`` workers for one provider.
+
+    Browser backed providers get their context from this pool only, and all
+    of its workers share it.
+    """
+    contexts, stack = await init_contexts([service])
+    workers[service] += count
+    try:
+        logger.info("Starting %d %s worker(s)", count, service)
+        await asyncio.gather(*(worker(service, contexts) for _ in range(count)))
     finally:
+        workers[service] -= count
         await stack.aclose()
 
 
-def start_workers(count: int = 1) -> None:
-    for _ in range(count):
-        asyncio.create_task(worker())
+# Running pools; kept referenced so they are not garbage collected.
+_pools: list[asyncio.Task] = []
+
+
+def start_workers(
+    count: int = 1, providers: list[str] | None = None
+) -> list[asyncio.Task]:
+    """Start one worker pool per provider, by default every enabled one.
+
+    Pool sizes come from ``worker_pools`` with ``count`` as the fallback.
+    """
+    for name in providers or settings.providers:
+        if get_provider(name) is None:
+            logger.warning("Unknown provider %s configured", name)
+            continue
+        size = settings.worker_pools.get(name, count)
+        _pools.append(asyncio.create_task(provider_pool(name, size)))
+    return _pools
+
+
+async def run(count: int | None = None, providers: list[str] | None = None) -> None:
+    """Run worker pools without the web API until cancelled.
+
+    Tasks are taken from the shared database queue, so any number of these
+    processes can run next to the API processes.
+    """
+    if settings.queue_backend != "sqlite":
+        raise RuntimeError('standalone workers require queue_backend = "sqlite"')
+    await init_db()
+    # Other processes may hold valid leases, so only expired ones are released.
+    await durable_queue.release_leases()
+    background = [
+        asyncio.create_task(durable_queue.task_writer()),
+        asyncio.create_task(durable_queue.queue_maintenance()),
+        asyncio.create_task(cache_writer()),
+        asyncio.create_task(cache_maintenance()),
+    ]
+    pools = start_workers(count or settings.worker_count, providers)
+    try:
+        await asyncio.gather(*pools)
+    finally:
+        logger.info("Worker shutdown")
+        for task in pools + background:
+            task.cancel()
+        await asyncio.gather(*pools, return_exceptions=True)
+        release_claimed()
+        await durable_queue.flush_tasks()
+        await flush_cache()
+        await client_pool.aclose()
+        await browser_manager.close()
+
+
+async def _main(count: int | None, providers: list[str] | None) -> None:
+    runner = asyncio.create_task(run(count, providers))
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, runner.cancel)
+        except NotImplementedError:  # Windows
+            pass
+    try:
+        await runner
+    except asyncio.CancelledError:
+        pass
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Run IOC lookup workers.")
+    parser.add_argument(
+        "--workers", type=int, help="workers per provider without a worker_pools entry"
+    )
+    parser.add_argument(
+        "--provider",
+        action="append",
+        dest="providers",
+        help="provider to serve (repeatable, default: all enabled providers)",
+    )
+    args = parser.parse_args(argv)
+    asyncio.run(_main(args.workers, args.providers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import asyncio
+from types import SimpleNamespace
+
+from ioc_checker import browser
+from ioc_checker.browser import BrowserManager
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.connected = True
+        self.listeners = {}
+        self.contexts = 0
+
+    def is_connected(self):
+        return self.connected
+
+    def on(self, event, handler):
+        self.listeners[event] = handler
+
+    async def new_context(self, **kwargs):
+        self.contexts += 1
+        return object()
+
+    async def close(self):
+        self.connected = False
+
+    def crash(self):
+        self.connected = False
+        self.listeners["disconnected"](self)
+
+
+def _fake_playwright(monkeypatch):
+    launched = []
+
+    async def launch(**kwargs):
+        launched.append(FakeBrowser())
+        return launched[-1]
+
+    driver = SimpleNamespace(chromium=SimpleNamespace(launch=launch))
+
+    async def stop():
+        driver.stopped = True
+
+    driver.stop = stop
+
+    async def start():
+        return driver
+
+    monkeypatch.setattr(browser, "async_playwright", lambda: SimpleNamespace(start=start))
+    return launched
+
+
+def test_browser_is_launched_once_and_shared(monkeypatch):
+    launched = _fake_playwright(monkeypatch)
+    manager = BrowserManager()
+
+    async def run():
+        assert launched == []
+        await asyncio.gather(*(manager.new_context() for _ in range(4)))
+        assert len(launched) == 1
+        assert launched[0].contexts == 4
+        await manager.close()
+        assert not launched[0].connected
+
+    asyncio.run(run())
+
+
+def test_crashed_browser_is_relaunched(monkeypatch):
+    launched = _fake_playwright(monkeypatch)
+    manager = BrowserManager()
+
+    async def run():
+        await manager.new_context()
+        launched[0].crash()
+        assert not manager.running
+        await manager.new_context()
+        assert len(launched) == 2
+        assert manager.stats() == {"running": True, "launches": 2}
+
+    asyncio.run(run())
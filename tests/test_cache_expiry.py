@@ -0,0 +1,67 @@
+import asyncio
+import importlib
+import sqlite3
+
+from ioc_checker.config import settings
+
+
+def _reload_database(tmp_path, name):
+    settings.database_url = f"sqlite+aiosqlite:///{tmp_path/name}"
+    import ioc_checker.database as database
+    importlib.reload(database)
+    return database
+
+
+def test_ttl_per_status_and_provider(monkeypatch):
+    import ioc_checker.database as database
+
+    monkeypatch.setattr(settings, "cache_ttl", 100)
+    monkeypatch.setattr(settings, "cache_negative_ttl", 10)
+    monkeypatch.setattr(settings, "provider_cache_ttl", {"virustotal": {"default": 50, "404": 5}})
+    assert database.cache_ttl("kaspersky", 200) == 100
+    assert database.cache_ttl("kaspersky", 404) == 10
+    assert database.cache_ttl("virustotal", 200) == 50
+    assert database.cache_ttl("virustotal", 404) == 5
+
+
+def test_expired_rows_are_ignored_and_purged(tmp_path, monkeypatch):
+    database = _reload_database(tmp_path, "expiry.db")
+    monkeypatch.setattr(settings, "cache_negative_ttl", 0.05)
+
+    async def run():
+        await database.init_db()
+        await database.cache_result("fresh", "svc", {"status_code": 200})
+        for i in range(5):
+            await database.cache_result(f"gone{i}", "svc", {"status_code": 404})
+        assert await database.flush_cache() == 6
+        await asyncio.sleep(0.1)
+        assert await database.get_cached_result("gone0", "svc") is None
+        assert await database.get_cached_results(["fresh", "gone1"], "svc") == {
+            "fresh": {"status_code": 200}
+        }
+        assert await database.purge_expired(batch_size=2) == 5
+        assert await database.get_cached_result("fresh", "svc") == {"status_code": 200}
+
+    asyncio.run(run())
+
+
+def test_legacy_cache_table_is_migrated(tmp_path):
+    path = tmp_path / "legacy.db"
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE cache (id INTEGER PRIMARY KEY, ioc VARCHAR NOT NULL, "
+        "provider VARCHAR NOT NULL, response JSON NOT NULL, "
+        "CONSTRAINT uix_ioc_provider UNIQUE (ioc, provider))"
+    )
+    conn.execute(
+        "INSERT INTO cache (ioc, provider, response) VALUES ('old', 'svc', '{\"status_code\": 200}')"
+    )
+    conn.commit()
+    conn.close()
+    database = _reload_database(tmp_path, "legacy.db")
+
+    async def run():
+        await database.init_db()
+        assert await database.get_cached_result("old", "svc") == {"status_code": 200}
+
+    asyncio.run(run())
@@ -0,0 +1,48 @@
+import asyncio
+import importlib
+import sqlite3
+
+from sqlalchemy import text
+
+from ioc_checker.config import settings
+
+
+def test_writer_batches_upserts(tmp_path, monkeypatch):
+    path = tmp_path / "writer.db"
+    settings.database_url = f"sqlite+aiosqlite:///{path}"
+    import ioc_checker.database as database
+    importlib.reload(database)
+    monkeypatch.setattr(settings, "cache_flush_size", 3)
+    monkeypatch.setattr(settings, "cache_flush_interval", 60)
+
+    async def run():
+        await database.init_db()
+        writer = asyncio.create_task(database.cache_writer())
+        await asyncio.sleep(0)
+        await database.cache_result("ioc1", "svc", {"status_code": 200, "data": 1})
+        await database.cache_result("ioc1", "svc", {"status_code": 200, "data": 2})
+        await database.cache_result("ioc2", "svc", {"status_code": 404})
+        # Two distinct keys are below the flush size, so nothing is written yet.
+        await asyncio.sleep(0.05)
+        assert len(database._pending) == 2
+        await database.cache_result("ioc3", "svc", {"status_code": 200})
+        # The writer takes the rows before committing them, so wait for the
+        # table rather than for the pending rows to go.
+        for _ in range(50):
+            async with database.engine.connect() as conn:
+                res = await conn.execute(text("SELECT count(*) FROM cache"))
+                written = res.scalar()
+            if written == 3:
+                break
+            await asyncio.sleep(0.01)
+        assert written == 3 and not database._pending
+        await database.cache_result("ioc1", "svc", {"status_code": 200, "data": 3})
+        writer.cancel()
+        assert await database.flush_cache() == 1
+
+    asyncio.run(run())
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    rows = dict(conn.execute("SELECT ioc, json_extract(response, '$.data') FROM cache"))
+    conn.close()
+    assert rows == {"ioc1": 3, "ioc2": None, "ioc3": None}
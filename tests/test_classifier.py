@@ -0,0 +1,78 @@
+import hashlib
+
+from iocsearcher.searcher import Searcher
+
+from ioc_checker import classifier, kaspersky, virustotal
+
+
+SAMPLES = [
+    "8.8.8.8",
+    "10.0.0.1",
+    "2a00:1450:4001:80b::200e",
+    "2001:db8::1",
+    hashlib.md5(b"x").hexdigest(),
+    hashlib.sha1(b"x").hexdigest().upper(),
+    hashlib.sha256(b"x").hexdigest(),
+    hashlib.sha512(b"x").hexdigest(),
+    "example.com",
+    "EXAMPLE.COM.",
+    "evil.example.co.uk",
+    "d41d8cd98f00b204e9800998ecf8427e.com",
+    "8.8.8.8.example.com",
+    "http://example.com/a?b",
+    "https://8.8.8.8:443/a",
+    "http://10.0.0.1/x",
+    "http://evil.com/?q=8.8.8.8",
+    "http://x.com/d41d8cd98f00b204e9800998ecf8427e",
+    "https://x.com/download/" + hashlib.sha256(b"x").hexdigest() + "/file.exe",
+    "http://x.com/redirect?to=http://1.1.1.1/a",
+    "http://x.com/v6/2a00:1450:4001:80b::200e",
+    "http://x.com:8080/v1.2.3/release",
+    "http://foo.notarealtld/x",
+    "http://example.onion/",
+    "http://example.Com/x",
+    "HTTP://EXAMPLE.COM./X",
+    "foo.notarealtld",
+    "hxxp://evil[.]com",
+    "example.com/path",
+    "1.2.3.4:80",
+    "test@example.com",
+    "foo",
+]
+
+
+def _searcher_classify(ioc: str) -> str:
+    kinds = {item.name.lower() for item in Searcher().search_data(ioc)}
+    if {"ip4", "ip6"} & kinds:
+        return "ip"
+    if {"md5", "sha1", "sha256", "sha512"} & kinds:
+        return "hash"
+    if "url" in kinds:
+        return "url"
+    return "domain"
+
+
+def test_classify_matches_searcher():
+    for ioc in SAMPLES:
+        assert classifier.classify_ioc(ioc) == _searcher_classify(ioc), ioc
+
+
+def test_provider_classification():
+    assert kaspersky.classify_ioc("http://example.com/x") == "url"
+    assert virustotal.classify_ioc("http://example.com/x") == "domain"
+    assert virustotal.classify_ioc("8.8.8.8") == "ip"
+    assert virustotal.classify_ioc("a" * 64) == "hash"
+
+
+def test_fast_path_skips_searcher(monkeypatch):
+    classifier.classify_ioc.cache_clear()
+
+    def fail(ioc):
+        raise AssertionError(f"searcher used for {ioc}")
+
+    monkeypatch.setattr(classifier, "_search_kinds", fail)
+    assert classifier.classify_ioc("1.1.1.1") == "ip"
+    assert classifier.classify_ioc("a" * 32) == "hash"
+    assert classifier.classify_ioc("https://example.org/x") == "url"
+    assert classifier.classify_ioc("https://example.org:8443/a/b?c=d#e") == "url"
+    assert classifier.classify_ioc("example.org") == "domain"
@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import httpx
+
+from ioc_checker import providers
+from ioc_checker.clients import ClientPool
+
+
+def _factory(created):
+    def factory(token):
+        client = httpx.AsyncClient(
+            transport=httpx.MockTransport(lambda r: httpx.Response(200, json={})),
+            base_url="https://example.com",
+            headers={"x-api-key": token},
+        )
+        created.append(client)
+        return client
+
+    return factory
+
+
+def test_pool_reuses_client_per_token():
+    created = []
+    pool = ClientPool(idle_timeout=60)
+
+    async def run():
+        for token in ("a", "a", "b"):
+            async with pool.client("kaspersky", token, _factory(created)) as client:
+                await client.get("/")
+        assert len(created) == 2
+        assert len(pool) == 2
+        await pool.aclose()
+        assert all(client.is_closed for client in created)
+
+    asyncio.run(run())
+
+
+def test_pool_evicts_idle_clients():
+    created = []
+    pool = ClientPool(idle_timeout=0)
+
+    async def run():
+        async with pool.client("kaspersky", "a", _factory(created)):
+            # Clients in use are never evicted.
+            assert await pool.evict_idle() == 0
+        assert await pool.evict_idle() == 1
+        assert created[0].is_closed
+        assert len(pool) == 0
+
+    asyncio.run(run())
+
+
+def test_fetch_ioc_uses_pooled_client(monkeypatch):
+    created = []
+    pool = ClientPool(idle_timeout=60)
+    monkeypatch.setattr(providers, "client_pool", pool)
+    monkeypatch.setattr(providers.PROVIDERS["kaspersky"], "client_factory", _factory(created))
+
+    async def run():
+        for ioc in ("8.8.8.8", "example.com"):
+            result = await providers.fetch_ioc("kaspersky", ioc, "token", {})
+            assert result["status_code"] == 200
+        await pool.aclose()
+
+    asyncio.run(run())
+    assert len(created) == 1
+
+
+def test_evicting_does_not_close_a_client_borrowed_meanwhile():
+    created = []
+    pool = ClientPool(idle_timeout=60)
+
+    async def run():
+        for token in ("a", "b"):
+            async with pool.client("kaspersky", token, _factory(created)):
+                pass
+        close = created[0].aclose
+        borrowed = []
+
+        async def slow_close():
+            # Another request takes the "b" client while "a" is closing.
+            async with pool.client("kaspersky", "b", _factory(created)) as client:
+                borrowed.append(client)
+                await close()
+                assert not client.is_closed
+
+        created[0].aclose = slow_close
+        assert await pool.evict_idle(time.monotonic() + 60) == 2
+        assert borrowed[0] is created[2]
+        assert not borrowed[0].is_closed
+        assert created[1].is_closed
+
+    asyncio.run(run())
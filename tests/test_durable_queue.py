@@ -0,0 +1,393 @@
+import asyncio
+import importlib
+import json
+import time
+
+import pytest
+
+from ioc_checker.config import settings
+import ioc_checker.database as database
+import ioc_checker.durable_queue as durable_queue
+import ioc_checker.queue as queue
+
+
+@pytest.fixture(autouse=True)
+def sqlite_backend(tmp_path, monkeypatch):
+    old = settings.database_url
+    settings.database_url = f"sqlite+aiosqlite:///{tmp_path / 'queue.db'}"
+    settings.queue_backend = "sqlite"
+    monkeypatch.setattr(settings, "providers", ["kaspersky", "svc"])
+    importlib.reload(database)
+    importlib.reload(durable_queue)
+    importlib.reload(queue)
+    yield
+    settings.database_url = old
+    settings.queue_backend = "memory"
+    importlib.reload(database)
+    importlib.reload(queue)
+
+
+def test_claims_are_batched_and_leased(monkeypatch):
+
+    async def run():
+        await database.init_db()
+        ids = [await queue.add_task(f"ioc{i}", "svc", "token") for i in range(5)]
+        assert len(durable_queue._pending) == 5
+        claimed = await durable_queue.claim("svc", 3)
+        assert [row["id"] for row in claimed] == ids[:3]
+        assert all(row["status"] == "processing" for row in claimed)
+        assert await durable_queue.backlog("svc") == 2
+        # Leased tasks are not handed out twice.
+        again = await durable_queue.claim("svc", 10)
+        assert [row["id"] for row in again] == ids[3:]
+        assert await durable_queue.claim("svc", 10) == []
+        assert await durable_queue.release_leases() == 0
+        monkeypatch.setattr(settings, "queue_visibility_timeout", -1)
+        await durable_queue.claim("svc", 1)
+        await durable_queue.release_leases(expired_only=False)
+        assert await durable_queue.backlog("svc") == 5
+
+    asyncio.run(run())
+
+
+def test_tasks_survive_a_restart():
+
+    async def run():
+        await database.init_db()
+        job = queue.create_job("svc")
+        first = await queue.add_task("a.example", "svc", "token", job_id=job.id)
+        second = await queue.add_task("b.example", "svc", "token", job_id=job.id)
+        done = await queue.add_task("c.example", "svc", result={"status_code": 200}, job_id=job.id)
+        queue.close_job(job)
+        # The first task was being looked up when the process died.
+        task_id = await queue.get_queue("svc").get()
+        assert task_id == first
+        queue.get_task(first).status = "processing"
+        await durable_queue.flush_tasks()
+        return job.id, first, second, done
+
+    job_id, first, second, done = asyncio.run(run())
+    importlib.reload(queue)
+
+    async def restart():
+        assert queue.get_task(first) is None
+        await queue.recover_tasks()
+        assert queue.get_task(first).status == "queued"
+        assert queue.get_task(done).result == {"status_code": 200}
+        job = queue.get_job(job_id)
+        assert job.counts["queued"] == 2 and job.counts["done"] == 1
+        q = queue.get_queue("svc")
+        assert [await q.get(), await q.get()] == [first, second]
+        assert queue.get_queue_size() == 2
+
+    asyncio.run(restart())
+
+
+def test_requeued_tasks_wait_until_available():
+
+    async def run():
+        await database.init_db()
+        task_id = await queue.add_task("a.example", "svc", "token")
+        q = queue.get_queue("svc")
+        assert await q.get() == task_id
+        task = queue.get_task(task_id)
+        task.status = "processing"
+        queue.requeue_task(task, 60)
+        assert await durable_queue.claim("svc", 10) == []
+        assert task.attempts == 1
+
+    asyncio.run(run())
+
+
+def test_api_process_follows_changes_made_by_workers(monkeypatch):
+    monkeypatch.setattr(settings, "queue_poll_interval", 0.01)
+
+    async def run():
+        await database.init_db()
+        task_id = await queue.add_task("a.example", "svc", "token")
+        sub = queue.subscribe([task_id])
+        sync = asyncio.create_task(queue.sync_tasks())
+        # A worker process claims the task and stores its result.
+        [row] = await durable_queue.claim("svc", 10)
+        row.update(status="done", result={"status_code": 200}, token=None)
+        row["updated_at"] = time.time()
+        durable_queue._pending[task_id] = row
+        await durable_queue.flush_tasks()
+        for _ in range(100):
+            if queue.get_task(task_id).status == "done":
+                break
+            await asyncio.sleep(0.01)
+        sync.cancel()
+        task = queue.get_task(task_id)
+        assert task.status == "done"
+        assert task.result == {"status_code": 200}
+        assert not sub.changes.empty()
+        assert queue.get_queue_size() == 0
+
+    asyncio.run(run())
+
+
+def test_claimed_tasks_are_released_on_shutdown():
+
+    async def run():
+        await database.init_db()
+        first = await queue.add_task("a.example", "svc", "token")
+        second = await queue.add_task("b.example", "svc", "token")
+        q = queue.get_queue("svc")
+        # Both are claimed, as if a second worker had been waiting too.
+        assert await q.claim(10) == 2
+        assert await q.get() == first
+        queue.start_task(queue.get_task(first))
+        # The second task is claimed but still waiting in this process.
+        assert await durable_queue.backlog("svc") == 0
+        assert queue.release_claimed() == 2
+        await durable_queue.flush_tasks()
+        rows = await durable_queue.claim("svc", 10)
+        assert [row["id"] for row in rows] == [first, second]
+
+    asyncio.run(run())
+
+
+def test_shutdown_leaves_tasks_of_other_processes_alone():
+
+    async def run():
+        await database.init_db()
+        task_id = await queue.add_task("a.example", "svc", "token")
+        # A standalone worker claims the task and this process syncs it.
+        await durable_queue.claim("svc", 10)
+        for row in await durable_queue.changed_since(0):
+            queue.apply_row(row)
+        assert queue.get_task(task_id).status == "processing"
+        assert queue.release_claimed() == 0
+        await durable_queue.flush_tasks()
+        assert await durable_queue.claim("svc", 10) == []
+
+    asyncio.run(run())
+
+
+def test_standalone_workers_require_the_durable_queue(monkeypatch):
+    from ioc_checker import worker
+
+    monkeypatch.setattr(settings, "queue_backend", "memory")
+    try:
+        asyncio.run(worker.run())
+    except RuntimeError as exc:
+        assert "queue_backend" in str(exc)
+    else:
+        raise AssertionError("expected RuntimeError")
+
+
+def test_sync_ignores_tasks_claimed_by_this_process():
+
+    async def run():
+        await database.init_db()
+        first = await queue.add_task("a.example", "svc", "token")
+        second = await queue.add_task("b.example", "svc", "token")
+        q = queue.get_queue("svc")
+        # Both are claimed, as if a second worker had been waiting too.
+        assert await q.claim(10) == 2
+        assert await q.get() == first
+        # The claim marked both rows as processing in the database.
+        for row in await durable_queue.changed_since(0):
+            queue.apply_row(row)
+        assert queue.get_task(second).status == "queued"
+        assert await q.get() == second
+
+    asyncio.run(run())
+
+
+def test_claims_follow_priority_and_fair_share():
+
+    async def run():
+        await database.init_db()
+        bulk = [
+            await queue.add_task(f"bulk{i}", "svc", "token", job_id="big") for i in range(4)
+        ]
+        small = await queue.add_task("small", "svc", "token", job_id="small")
+        urgent = await queue.add_task("urgent", "svc", "token", priority=1)
+        claimed = [row["id"] for row in await durable_queue.claim("svc", 10)]
+        assert claimed == [urgent, bulk[0], small] + bulk[1:]
+
+    asyncio.run(run())
+
+
+def test_interactive_tasks_overtake_bulk_tasks_of_a_busy_worker():
+
+    async def run():
+        await database.init_db()
+        bulk = [
+            await queue.add_task(f"bulk{i}", "svc", "token", job_id="big") for i in range(5)
+        ]
+        q = queue.get_queue("svc")
+        # Only one worker is waiting, so only one task leaves the database.
+        assert await q.get() == bulk[0]
+        assert await durable_queue.backlog("svc") == 4
+        urgent = await queue.add_task("urgent", "svc", "token", priority=1)
+        assert await q.get() == urgent
+        assert await q.get() == bulk[1]
+
+    asyncio.run(run())
+
+
+def test_task_tables_of_older_versions_are_migrated(tmp_path):
+    from sqlalchemy import text
+
+    async def run():
+        async with database.engine.begin() as conn:
+            await conn.execute(text(
+                "CREATE TABLE tasks (id VARCHAR PRIMARY KEY, ioc VARCHAR NOT NULL, "
+                "service VARCHAR NOT NULL, status VARCHAR NOT NULL, result JSON, "
+                "error VARCHAR, token VARCHAR, job_id VARCHAR, attempts INTEGER NOT NULL, "
+                "available_at FLOAT NOT NULL, lease_until FLOAT, created_at FLOAT NOT NULL, "
+                "updated_at FLOAT NOT NULL)"
+            ))
+            await conn.execute(text(
+                "CREATE INDEX ix_tasks_claim ON tasks (service, status, available_at)"
+            ))
+            for name in ("first", "second"):
+                await conn.execute(text(
+                    "INSERT INTO tasks VALUES (:id, :id, 'svc', 'queued', NULL, NULL, "
+                    "NULL, NULL, 0, 0, NULL, 1, 1)"
+                ), {"id": name})
+        await database.init_db()
+        claimed = [row["id"] for row in await durable_queue.claim("svc", 10)]
+        assert claimed == ["first", "second"]
+        async with database.engine.connect() as conn:
+            indexes = {row[1] for row in await conn.execute(text("PRAGMA index_list(tasks)"))}
+        assert "ix_tasks_dispatch" in indexes and "ix_tasks_claim" not in indexes
+
+    asyncio.run(run())
+
+
+def test_finished_tasks_do_not_keep_their_token():
+    from sqlalchemy import text
+
+    async def run():
+        await database.init_db()
+        task_id = await queue.add_task("ioc", "svc", "SECRET-TOKEN")
+        await durable_queue.flush_tasks()
+        queue.get_task(task_id).status = "done"
+        await durable_queue.flush_tasks()
+        async with database.engine.connect() as conn:
+            res = await conn.execute(
+                text("SELECT status, token FROM tasks WHERE id = :id"), {"id": task_id}
+            )
+            return res.one()
+
+    assert tuple(asyncio.run(run())) == ("done", None)
+
+
+def test_cancellation_from_another_process_sticks():
+    from sqlalchemy import update
+
+    async def run():
+        await database.init_db()
+        first = await queue.add_task("a.example", "svc", "token")
+        second = await queue.add_task("b.example", "svc", "token")
+        q = queue.get_queue("svc")
+        # Both are claimed, as if a second worker had been waiting too.
+        assert await q.claim(10) == 2
+        assert await q.get() == first
+        # Another process cancels both after this one claimed them.
+        async with database.engine.begin() as conn:
+            await conn.execute(
+                update(database.TaskRecord).values(status="cancelled", updated_at=time.time())
+            )
+        # The worker already running the first task finishes it anyway.
+        task = queue.get_task(first)
+        task.status = "processing"
+        task.status = "done"
+        await durable_queue.flush_tasks()
+        for row in await durable_queue.changed_since(0):
+            queue.apply_row(row)
+        rows = {row["id"]: row["status"] for row in await durable_queue.changed_since(0)}
+        assert rows == {first: "cancelled", second: "cancelled"}
+        # The claimed but unstarted task is skipped by the worker.
+        assert queue.get_task(second).status == "cancelled"
+        assert await q.get() == second
+
+    asyncio.run(run())
+
+
+def test_failed_tasks_are_saved_with_their_error_and_trace(monkeypatch):
+    from sqlalchemy import text
+
+    from ioc_checker import worker
+
+    importlib.reload(worker)
+
+    async def get_cached_result(ioc, service):
+        return None
+
+    async def fetch_ioc(service, ioc, token, contexts):
+        raise RuntimeError("provider exploded")
+
+    monkeypatch.setattr(worker, "get_cached_result", get_cached_result)
+    monkeypatch.setattr(worker, "fetch_ioc", fetch_ioc)
+
+    async def run():
+        await database.init_db()
+        task_id = await queue.add_task("a.example", "svc", "token")
+        runner = asyncio.create_task(worker.worker("svc"))
+        for _ in range(100):
+            if queue.get_task(task_id).status == "error":
+                break
+            await asyncio.sleep(0.01)
+        runner.cancel()
+        # The worker may be cancelled halfway through a flush of its own.
+        await asyncio.gather(runner, return_exceptions=True)
+        await durable_queue.flush_tasks()
+        async with database.engine.connect() as conn:
+            res = await conn.execute(
+                text("SELECT status, error, trace FROM tasks WHERE id = :id"),
+                {"id": task_id},
+            )
+            return res.one()
+
+    status, error, trace = asyncio.run(run())
+    assert (status, error) == ("error", "provider exploded")
+    assert "total" in json.loads(trace)
+
+
+def test_leases_of_tasks_waiting_for_a_worker_are_renewed(monkeypatch):
+    monkeypatch.setattr(settings, "queue_visibility_timeout", 1.0)
+
+    async def run():
+        await database.init_db()
+        first = await queue.add_task("a.example", "svc", "token")
+        second = await queue.add_task("b.example", "svc", "token")
+        q = queue.get_queue("svc")
+        # Both are claimed, as if a second worker had been waiting too.
+        assert await q.claim(10) == 2
+        assert await q.get() == first
+        # The only worker is busy for more than half the lease.
+        await asyncio.sleep(0.6)
+        assert await q.get() == second
+        rows = {row["id"]: row for row in await durable_queue.changed_since(0)}
+        assert rows[second]["lease_until"] > time.time() + 0.5
+
+    asyncio.run(run())
+
+
+def test_tasks_whose_lease_ran_out_are_claimed_again(monkeypatch):
+    monkeypatch.setattr(settings, "queue_visibility_timeout", 0.1)
+
+    async def run():
+        await database.init_db()
+        first = await queue.add_task("a.example", "svc", "token")
+        second = await queue.add_task("b.example", "svc", "token")
+        q = queue.get_queue("svc")
+        # Both are claimed, as if a second worker had been waiting too.
+        assert await q.claim(10) == 2
+        assert await q.get() == first
+        queue.get_task(first).status = "done"
+        await asyncio.sleep(0.15)
+        assert await durable_queue.release_leases() == 1
+        # The stale claim is dropped and the task claimed afresh.
+        assert await q.get() == second
+        rows = {row["id"]: row for row in await durable_queue.changed_since(0)}
+        assert rows[second]["status"] == "processing"
+        assert rows[second]["lease_until"] > time.time()
+        assert not q.holds(second)
+
+    asyncio.run(run())
@@ -0,0 +1,86 @@
+import asyncio
+import importlib
+import json
+import sys
+import types
+
+from fastapi.testclient import TestClient
+
+
+def _parse(chunks):
+    events = []
+    for chunk in chunks:
+        if chunk.startswith(":"):
+            continue
+        lines = dict(line.split(": ", 1) for line in chunk.strip().split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_task_events_stream_status_changes():
+    import ioc_checker.queue as queue
+    importlib.reload(queue)
+    import ioc_checker.events as events
+    importlib.reload(events)
+
+    async def run():
+        first = await queue.add_task("ioc1")
+        second = await queue.add_task("ioc2")
+        stream = events.task_events([first, second, "missing"])
+        received = []
+
+        async def consume():
+            async for chunk in stream:
+                received.append(chunk)
+
+        consumer = asyncio.create_task(consume())
+        await asyncio.sleep(0.01)
+        queue.get_task(first).status = "processing"
+        await asyncio.sleep(0.01)
+        queue.get_task(first).result = {"status_code": 200}
+        queue.get_task(first).status = "done"
+        queue.get_task(second).status = "error"
+        await asyncio.wait_for(consumer, 1)
+        return first, second, _parse(received)
+
+    first, second, received = asyncio.run(run())
+    statuses = [(data.get("id"), data.get("status")) for event, data in received if event == "status"]
+    assert ("missing", None) in statuses
+    assert statuses.index((first, "queued")) < statuses.index((first, "processing"))
+    assert (first, "done") in statuses and (second, "error") in statuses
+    assert received[-1] == ("end", {})
+    assert ("queue", {"queue": 0}) in received
+    # Subscriptions are released once the stream ends.
+    assert not queue._tasks._watchers
+
+
+def test_batch_status_and_finished_stream():
+    import ioc_checker.queue as queue
+    importlib.reload(queue)
+
+    magic = types.ModuleType("magic")
+    magic.from_file = lambda path, mime=False: "text/plain"
+    magic.from_buffer = lambda buf, mime=False: "text/plain"
+    sys.modules.setdefault("magic", magic)
+
+    import ioc_checker.main as main
+    importlib.reload(main)
+    client = TestClient(main.app)
+
+    async def seed():
+        done = await queue.add_task("ioc1", result={"status_code": 200})
+        pending = await queue.add_task("ioc2")
+        return done, pending
+
+    done, pending = asyncio.run(seed())
+    data = client.post("/status", json={"ids": [done, pending, "missing"]}).json()
+    assert data["tasks"][done]["status"] == "done"
+    assert data["tasks"][pending]["status"] == "queued"
+    assert data["tasks"]["missing"] == {"error": "unknown task"}
+    assert data["queue"] == 1
+
+    resp = client.post("/events", json={"ids": [done]})
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    received = _parse(resp.text.split("\n\n")[:-1])
+    assert received[0] == ("status", queue.get_task(done).to_dict())
+    assert received[-1] == ("end", {})
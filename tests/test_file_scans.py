@@ -0,0 +1,195 @@
+import asyncio
+import hashlib
+import importlib
+import time
+from collections import Counter
+
+import httpx
+from fastapi.testclient import TestClient
+
+from ioc_checker import kaspersky
+from ioc_checker.config import settings
+
+
+def _setup(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "database_url", f"sqlite+aiosqlite:///{tmp_path/'files.db'}")
+    monkeypatch.setattr(settings, "file_poll_interval", 0.01)
+    monkeypatch.setattr(settings, "file_poll_max_interval", 0.02)
+    import ioc_checker.database as database
+    import ioc_checker.queue as queue
+    import ioc_checker.worker as worker
+    import ioc_checker.file_scans as file_scans
+    import ioc_checker.main as main
+    for module in (database, queue, worker, file_scans, main):
+        importlib.reload(module)
+    return database, queue, file_scans, main
+
+
+def _fake_opentip(monkeypatch, known, pending_polls=2):
+    calls = Counter()
+    polls = Counter()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        path = request.url.path.rsplit("/", 2)[-2:]
+        calls["/".join(path)] += 1
+        if path == ["search", "hash"]:
+            value = request.url.params["request"]
+            if value in known:
+                return httpx.Response(200, json={"Zone": "Red", "Sha256": value})
+            return httpx.Response(404, json={})
+        if path == ["scan", "file"]:
+            # The multipart body holds a single part: headers, blank line, file.
+            content = request.content.split(b"\r\n\r\n", 1)[1].rsplit(b"\r\n--", 1)[0]
+            sha256 = hashlib.sha256(content).hexdigest()
+            return httpx.Response(
+                200, json={"Zone": "Grey", "FileStatus": "NotCategorized", "Sha256": sha256}
+            )
+        value = request.url.params["task_id"]
+        polls[value] += 1
+        if polls[value] <= pending_polls:
+            return httpx.Response(404, json={})
+        return httpx.Response(200, json={"Zone": "Red", "Sha256": value, "Size": 5})
+
+    def create_client(token=None):
+        return httpx.AsyncClient(
+            base_url=kaspersky.API_BASE, transport=httpx.MockTransport(handler)
+        )
+
+    monkeypatch.setattr(kaspersky, "create_client", create_client)
+    return calls, polls
+
+
+def _wait_done(client, ids, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        tasks = client.post("/status", json={"ids": ids}).json()["tasks"]
+        if all(task["status"] == "done" for task in tasks.values()):
+            return tasks
+        time.sleep(0.01)
+    raise AssertionError(f"tasks not done: {tasks}")
+
+
+def test_unknown_files_are_uploaded_once_and_polled(tmp_path, monkeypatch):
+    database, queue, file_scans, main = _setup(tmp_path, monkeypatch)
+    known = hashlib.sha256(b"known").hexdigest()
+    unknown = hashlib.sha256(b"fresh").hexdigest()
+    calls, polls = _fake_opentip(monkeypatch, {known})
+    uploaded = []
+    submit_file = kaspersky.submit_file
+
+    async def record_submit(data, filename, client):
+        uploaded.append(type(data))
+        return await submit_file(data, filename, client)
+
+    monkeypatch.setattr(kaspersky, "submit_file", record_submit)
+
+    with TestClient(main.app) as client:
+        resp = client.post(
+            "/scan-files",
+            data={"token": "files-token-1"},
+            files=[
+                ("files", ("a.exe", b"fresh")),
+                ("files", ("copy-of-a.exe", b"fresh")),
+                ("files", ("b.dll", b"known")),
+            ],
+        )
+        assert resp.status_code == 200
+        body = resp.json()
+        assert [f["sha256"] for f in body["files"]] == [unknown, unknown, known]
+        assert all(f["status"] == "processing" for f in body["files"])
+        tasks = _wait_done(client, [f["id"] for f in body["files"]])
+
+        # A later upload of the same sample is answered from the cache.
+        again = client.post(
+            "/scan-files",
+            data={"token": "files-token-1"},
+            files=[("files", ("a.exe", b"fresh"))],
+        ).json()["files"][0]
+        stats = client.get("/stats").json()["file_scans"]
+
+    ids = [f["id"] for f in body["files"]]
+    assert tasks[ids[0]]["result"]["data"]["size"] == 5
+    assert tasks[ids[0]]["result"] == tasks[ids[1]]["result"]
+    assert tasks[ids[2]]["result"]["data"]["zone"] == "Red"
+    assert calls == {"search/hash": 2, "scan/file": 1, "getresult/file": 3}
+    # Reports are requested by the hash the submission returned.
+    assert polls == {unknown: 3}
+    # The sample is streamed from the spooled file, not read into memory.
+    assert uploaded and not issubclass(uploaded[0], bytes)
+    assert again["status"] == "done"
+    assert again["result"]["data"]["sha256"] == unknown
+    assert stats["uploaded"] == 1
+    assert stats["deduplicated"] == 1
+    assert stats["cached"] == 1
+    assert stats["pending"] == 0
+
+
+def test_cached_not_found_goes_straight_to_upload(tmp_path, monkeypatch):
+    database, queue, file_scans, main = _setup(tmp_path, monkeypatch)
+    sha256 = hashlib.sha256(b"sample").hexdigest()
+    calls, polls = _fake_opentip(monkeypatch, set(), pending_polls=0)
+    asyncio.run(database.init_db())
+    asyncio.run(database.cache_result(sha256, "kaspersky", {"status_code": 404}))
+
+    with TestClient(main.app) as client:
+        resp = client.post(
+            "/scan-files",
+            data={"token": "files-token-2"},
+            files=[("files", ("s.bin", b"sample"))],
+        )
+        _wait_done(client, [resp.json()["files"][0]["id"]])
+
+    assert calls == {"scan/file": 1, "getresult/file": 1}
+    assert polls == {sha256: 1}
+
+
+def test_oversized_uploads_are_rejected(tmp_path, monkeypatch):
+    database, queue, file_scans, main = _setup(tmp_path, monkeypatch)
+    monkeypatch.setattr(settings, "file_scan_max_size", 4)
+    monkeypatch.setattr(file_scans.tempfile, "tempdir", str(tmp_path))
+    calls, _ = _fake_opentip(monkeypatch, set())
+
+    with TestClient(main.app) as client:
+        resp = client.post(
+            "/scan-files",
+            data={"token": "files-token-3"},
+            files=[("files", ("ok.bin", b"tiny")), ("files", ("big.bin", b"too large"))],
+        )
+        missing = client.post("/scan-files", files=[("files", ("ok.bin", b"tiny"))])
+
+    assert resp.status_code == 413
+    assert missing.status_code == 400
+    assert not list(tmp_path.glob("ioc-upload-*"))
+    assert not calls
+
+
+def test_failed_scans_are_journaled_with_their_error(tmp_path, monkeypatch):
+    database, queue, file_scans, main = _setup(tmp_path, monkeypatch)
+    saved = []
+    monkeypatch.setattr(
+        queue._tasks, "journal", lambda task: saved.append((task.status, task.error))
+    )
+    scanner = file_scans.FileScanner()
+    upload = file_scans.Upload("a.exe", hashlib.sha256(b"a").hexdigest(), 1, None)
+    scanner.add(upload, "files-token-4")
+    scanner._fail(scanner._scans[upload.sha256], "upload rejected")
+
+    assert saved[-1] == ("error", "upload rejected")
+
+
+def test_basic_scan_kept_after_report_timeout_is_not_cached(tmp_path, monkeypatch):
+    database, queue, file_scans, main = _setup(tmp_path, monkeypatch)
+    monkeypatch.setattr(settings, "file_report_timeout", 0.05)
+    sha256 = hashlib.sha256(b"slow").hexdigest()
+    _fake_opentip(monkeypatch, set(), pending_polls=1000)
+
+    with TestClient(main.app) as client:
+        resp = client.post(
+            "/scan-files",
+            data={"token": "files-token-5"},
+            files=[("files", ("slow.bin", b"slow"))],
+        )
+        [task] = _wait_done(client, [resp.json()["files"][0]["id"]]).values()
+
+    assert task["result"]["data"]["status"] == "NotCategorized"
+    assert asyncio.run(database.get_cached_result(sha256, "kaspersky")) is None
@@ -0,0 +1,116 @@
+import asyncio
+import importlib
+import sys
+import types
+
+from fastapi.testclient import TestClient
+
+
+def _client(monkeypatch):
+    import ioc_checker.queue as queue
+    import ioc_checker.worker as worker
+    importlib.reload(queue)
+    importlib.reload(worker)
+
+    magic = types.ModuleType("magic")
+    magic.from_file = lambda path, mime=False: "text/plain"
+    magic.from_buffer = lambda buf, mime=False: "text/plain"
+    sys.modules.setdefault("magic", magic)
+
+    import ioc_checker.main as main
+    importlib.reload(main)
+
+    async def no_cache(iocs, provider):
+        return {"8.8.8.8": {"status_code": 200, "data": {"zone": "Red"}}}
+
+    monkeypatch.setattr(main, "get_cached_results", no_cache)
+    return queue, TestClient(main.app)
+
+
+def test_job_progress_verdicts_and_pagination(monkeypatch):
+    queue, client = _client(monkeypatch)
+    iocs = ["8.8.8.8"] + [f"host{i}.example.com" for i in range(4)]
+    data = client.post("/scan", json={"service": "kaspersky", "token": "t", "iocs": iocs}).json()
+    job_id = data["job"]
+
+    tasks = [queue.get_task(t["id"]) for t in data["tasks"]]
+    tasks[1].status = "processing"
+    tasks[1].result = {"status_code": 200, "data": {"zone": "Green"}}
+    tasks[1].status = "done"
+    tasks[2].status = "error"
+
+    page = client.get(f"/jobs/{job_id}", params={"limit": 2}).json()
+    assert page["status"] == "running"
+    assert page["total"] == 5
+    assert page["counts"] == {"queued": 2, "processing": 0, "done": 2, "error": 1, "cancelled": 0}
+    assert page["verdicts"] == {"malicious": 1, "clean": 1, "error": 1}
+    assert [r["ioc"] for r in page["results"]] == iocs[:2]
+    assert page["results"][0]["verdict"] == "malicious"
+
+    seen = [r["ioc"] for r in page["results"]]
+    while page["next_cursor"]:
+        page = client.get(f"/jobs/{job_id}", params={"limit": 2, "cursor": page["next_cursor"]}).json()
+        seen.extend(r["ioc"] for r in page["results"])
+    assert seen == iocs
+
+    assert client.get("/jobs/missing").status_code == 404
+    assert client.get(f"/jobs/{job_id}", params={"cursor": "x"}).status_code == 400
+
+
+def test_cancel_drops_queued_tasks(monkeypatch):
+    queue, client = _client(monkeypatch)
+    iocs = [f"host{i}.example.com" for i in range(3)]
+    data = client.post("/scan", json={"service": "kaspersky", "token": "t", "iocs": iocs}).json()
+    first = queue.get_task(data["tasks"][0]["id"])
+    first.status = "processing"
+
+    resp = client.post(f"/jobs/{data['job']}/cancel").json()
+    assert resp["cancelled"] == 2
+    assert resp["queue"] == 1
+    job = client.get(f"/jobs/{data['job']}").json()
+    assert job["counts"]["cancelled"] == 2
+    assert job["status"] == "running"
+    first.status = "done"
+    assert client.get(f"/jobs/{data['job']}").json()["status"] == "cancelled"
+
+    # Workers skip cancelled tasks left in the queue.
+    import ioc_checker.worker as worker
+
+    async def unexpected(task, contexts):
+        raise AssertionError(f"looked up {task.ioc}")
+
+    monkeypatch.setattr(worker, "lookup", unexpected)
+
+    async def drain():
+        runner = asyncio.create_task(worker.worker())
+        await asyncio.wait_for(queue.queue.join(), 1)
+        runner.cancel()
+
+    asyncio.run(drain())
+    assert [queue.get_task(t["id"]).status for t in data["tasks"]] == ["done", "cancelled", "cancelled"]
+
+
+def test_verdicts_are_counted_once_per_status_change(monkeypatch):
+    queue, client = _client(monkeypatch)
+    calls = []
+    get_verdict = queue.get_verdict
+
+    def counting(service, result):
+        calls.append(result)
+        return get_verdict(service, result)
+
+    monkeypatch.setattr(queue, "get_verdict", counting)
+    iocs = [f"host{i}.example.com" for i in range(3)]
+    data = client.post("/scan", json={"service": "kaspersky", "token": "t", "iocs": iocs}).json()
+    tasks = [queue.get_task(t["id"]) for t in data["tasks"]]
+    for task in tasks:
+        task.result = {"status_code": 200, "data": {"zone": "Red"}}
+        task.status = "done"
+    for _ in range(5):
+        summary = client.get(f"/jobs/{data['job']}").json()
+    assert summary["verdicts"] == {"malicious": 3}
+    assert len(calls) == 3
+
+    # A task leaving its final status no longer counts.
+    tasks[0].status = "queued"
+    assert client.get(f"/jobs/{data['job']}").json()["verdicts"] == {"malicious": 2}
@@ -0,0 +1,49 @@
+import asyncio
+import importlib
+import time
+
+from ioc_checker.config import settings
+from ioc_checker.lru import LRUCache
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats() == {"size": 2, "hits": 3, "misses": 1}
+
+
+def test_lru_entries_expire():
+    cache = LRUCache(maxsize=10, ttl=60)
+    cache.set("a", 1, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_memory_tier_serves_without_database(tmp_path, monkeypatch):
+    settings.database_url = f"sqlite+aiosqlite:///{tmp_path/'lru.db'}"
+    import ioc_checker.database as database
+    importlib.reload(database)
+
+    async def run():
+        await database.init_db()
+        await database.cache_result("ioc1", "svc", {"status_code": 200})
+        await database.flush_cache()
+        database.memory_cache.clear()
+        # The first read populates the memory tier from SQLite.
+        assert await database.get_cached_result("ioc1", "svc") == {"status_code": 200}
+
+        def no_db():
+            raise AssertionError("database used")
+
+        monkeypatch.setattr(database, "SessionLocal", no_db)
+        assert await database.get_cached_result("ioc1", "svc") == {"status_code": 200}
+        assert await database.get_cached_results(["ioc1"], "svc") == {"ioc1": {"status_code": 200}}
+
+    asyncio.run(run())
+    assert database.memory_cache.hits == 2
@@ -0,0 +1,67 @@
+import asyncio
+import importlib
+import sys
+import types
+
+from fastapi.testclient import TestClient
+
+from ioc_checker.metrics import Registry
+
+
+def test_render_counter_histogram_and_gauge():
+    registry = Registry()
+    errors = registry.counter("errors_total", "Errors.", ("provider", "status"))
+    latency = registry.histogram("latency_seconds", "Latency.", ("provider",), (0.1, 1))
+    registry.gauge("depth", "Depth.", lambda: {("kaspersky",): 3}, ("provider",))
+    errors.inc("kaspersky", 429)
+    errors.inc("kaspersky", 429)
+    latency.observe(0.1, "kaspersky")
+    latency.observe(0.5, "kaspersky")
+    latency.observe(5, "kaspersky")
+    text = registry.render()
+    assert 'errors_total{provider="kaspersky",status="429"} 2' in text
+    assert 'latency_seconds_bucket{provider="kaspersky",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{provider="kaspersky",le="1"} 2' in text
+    assert 'latency_seconds_bucket{provider="kaspersky",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{provider="kaspersky"} 3' in text
+    assert 'depth{provider="kaspersky"} 3' in text
+    assert "# TYPE latency_seconds histogram" in text
+    # Registering again returns the existing series.
+    assert registry.counter("errors_total", "Errors.") is errors
+
+
+def _stub_magic():
+    magic = types.ModuleType("magic")
+    magic.from_file = lambda path, mime=False: "text/plain"
+    magic.from_buffer = lambda buf, mime=False: "text/plain"
+    sys.modules["magic"] = magic
+
+
+def test_metrics_endpoint_reports_queue_and_cache(tmp_path, monkeypatch):
+    _stub_magic()
+    import ioc_checker.database as database
+    import ioc_checker.queue as queue
+    import ioc_checker.main as main
+
+    monkeypatch.setattr(database.settings, "database_url", f"sqlite+aiosqlite:///{tmp_path / 'm.db'}")
+    importlib.reload(database)
+    importlib.reload(queue)
+    importlib.reload(main)
+
+    async def run():
+        await database.init_db()
+        await database.cache_result("1.1.1.1", "kaspersky", {"status_code": 200})
+        assert await database.get_cached_result("1.1.1.1", "kaspersky")
+        assert await database.get_cached_result("2.2.2.2", "kaspersky") is None
+        await queue.add_task("3.3.3.3", "kaspersky", "token")
+
+    asyncio.run(run())
+    resp = TestClient(main.app).get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    text = resp.text
+    assert 'ioc_queue_depth{provider="kaspersky"} 1' in text
+    assert 'ioc_cache_lookups_total{provider="kaspersky",result="memory"}' in text
+    assert 'ioc_cache_lookups_total{provider="kaspersky",result="miss"}' in text
+    assert "ioc_cache_hit_ratio" in text
+    assert "ioc_browser_running 0" in text
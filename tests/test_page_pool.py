@@ -0,0 +1,132 @@
+import asyncio
+
+from ioc_checker.virustotal import PagePool
+
+
+class FakePage:
+    def __init__(self):
+        self.closed = False
+        self.urls = []
+
+    def set_default_navigation_timeout(self, timeout):
+        pass
+
+    def set_default_timeout(self, timeout):
+        pass
+
+    def is_closed(self):
+        return self.closed
+
+    async def goto(self, url, **kwargs):
+        self.urls.append(url)
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeContext:
+    def __init__(self):
+        self.pages = []
+        self.listeners = {}
+        self.closed = False
+
+    def on(self, event, handler):
+        self.listeners[event] = handler
+
+    async def close(self):
+        self.closed = True
+
+    async def new_page(self):
+        page = FakePage()
+        self.pages.append(page)
+        return page
+
+
+def _factory(*contexts):
+    remaining = list(contexts)
+
+    async def new_context():
+        return remaining.pop(0)
+
+    return new_context
+
+
+def test_pages_are_reused_and_reset():
+    context = FakeContext()
+    pool = PagePool(_factory(context), size=2, max_uses=10)
+
+    async def run():
+        for _ in range(3):
+            async with pool.page() as page:
+                await page.goto("https://example.com")
+        assert len(context.pages) == 1
+        assert context.pages[0].urls[-1] == "about:blank"
+        await pool.close()
+        assert context.pages[0].closed
+        assert context.closed
+
+    asyncio.run(run())
+
+
+def test_pages_are_recycled_after_max_uses_and_errors():
+    context = FakeContext()
+    pool = PagePool(_factory(context), size=1, max_uses=2)
+
+    async def run():
+        for _ in range(2):
+            async with pool.page():
+                pass
+        assert context.pages[0].closed
+        try:
+            async with pool.page():
+                raise RuntimeError("boom")
+        except RuntimeError:
+            pass
+        assert context.pages[1].closed
+        async with pool.page():
+            pass
+        assert len(context.pages) == 3
+        assert pool.stats()["recycled"] == 2
+
+    asyncio.run(run())
+
+
+def test_pool_bounds_concurrent_pages():
+    context = FakeContext()
+    pool = PagePool(_factory(context), size=2, max_uses=100)
+    active = 0
+    peak = 0
+
+    async def lookup():
+        nonlocal active, peak
+        async with pool.page():
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+    async def run():
+        await asyncio.gather(*(lookup() for _ in range(10)))
+
+    asyncio.run(run())
+    assert peak == 2
+    assert len(context.pages) == 2
+
+
+def test_context_is_created_lazily_and_replaced_when_closed():
+    first, second = FakeContext(), FakeContext()
+    pool = PagePool(_factory(first, second), size=1, max_uses=10)
+
+    async def run():
+        assert pool.context is None
+        async with pool.page():
+            pass
+        assert pool.context is first
+        # The browser crashed: the context reports itself closed.
+        first.listeners["close"](first)
+        async with pool.page():
+            pass
+        assert pool.context is second
+        assert len(second.pages) == 1
+
+    asyncio.run(run())
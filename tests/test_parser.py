@@ -100,3 +100,59 @@ def test_parse_file_docx():
     data = resp.json()
     assert "uri" in data and "http://example.com" in data["uri"]
 
+
+
+def test_parse_rejects_oversized_payload(monkeypatch):
+    from ioc_checker.config import settings
+
+    monkeypatch.setattr(settings, "max_parse_size", 10)
+    resp = client.post("/parse", json={"text": "x" * 11 + " example.org"})
+    assert resp.status_code == 413
+
+
+def test_parse_file_text_chunks_dedupe_and_boundaries(monkeypatch):
+    from ioc_checker.config import settings
+
+    monkeypatch.setattr(settings, "parse_chunk_size", 64)
+    monkeypatch.setattr(settings, "parse_chunk_overlap", 32)
+    lines = [f"{i} request to evil-{i % 5}.example.com from 8.8.4.4" for i in range(50)]
+    body = "\n".join(lines).encode()
+    resp = client.post(
+        "/parse-file",
+        files={"file": ("proxy.log", BytesIO(body), "text/plain")},
+    )
+    data = resp.json()
+    assert sorted(data["fqdn"]) == [f"evil-{i}.example.com" for i in range(5)]
+    assert data["ipv4"] == ["8.8.4.4"]
+
+
+def test_parse_file_does_not_report_urls_cut_at_a_chunk_boundary(monkeypatch):
+    from ioc_checker.config import settings
+
+    monkeypatch.setattr(settings, "parse_chunk_size", 64)
+    monkeypatch.setattr(settings, "parse_chunk_overlap", 8)
+    url = "http://evil.example.com/some/long/path/to/payload.exe"
+    body = f"{'x' * 40} {url} end\n".encode()
+    resp = client.post(
+        "/parse-file",
+        files={"file": ("proxy.log", BytesIO(body), "text/plain")},
+    )
+    assert resp.json()["uri"] == [url]
+
+
+def test_parse_file_streams_ndjson():
+    import json
+
+    body = b"http://example.com\n" * 3 + b"example.org\n"
+    resp = client.post(
+        "/parse-file?stream=true",
+        files={"file": ("sample.txt", BytesIO(body), "text/plain")},
+    )
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    found = {}
+    for line in lines:
+        for kind, values in line.items():
+            found.setdefault(kind, []).extend(values)
+    assert found["uri"] == ["http://example.com"]
+    assert "example.org" in found["fqdn"]
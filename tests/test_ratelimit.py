@@ -0,0 +1,75 @@
+import asyncio
+
+import httpx
+import pytest
+
+from ioc_checker import providers
+from ioc_checker.clients import ClientPool
+from ioc_checker.config import settings
+from ioc_checker.ratelimit import RateLimited, RateLimiter, TokenBucket
+
+
+def test_bucket_paces_after_burst():
+    bucket = TokenBucket(rate=10, burst=2)
+
+    async def run():
+        await bucket.acquire()
+        await bucket.acquire()
+        assert 0 < bucket.wait_time() <= 0.1
+        await bucket.acquire()
+
+    asyncio.run(run())
+    assert bucket.used == 3
+
+
+def test_backoff_blocks_and_raises_when_wait_is_long():
+    bucket = TokenBucket(daily_quota=100)
+    delay = bucket.backoff(retry_after=30, quota_exhausted=True)
+    assert 30 <= delay <= 37.5
+    assert bucket.remaining_quota() == 0
+    with pytest.raises(RateLimited) as exc:
+        asyncio.run(bucket.acquire(max_wait=1))
+    assert exc.value.retry_after > 1
+    assert not exc.value.called
+    bucket.success()
+    assert bucket.failures == 0
+
+
+def test_backoff_grows_exponentially(monkeypatch):
+    monkeypatch.setattr(settings, "backoff_base", 1.0)
+    monkeypatch.setattr(settings, "backoff_max", 3.0)
+    bucket = TokenBucket()
+    delays = [bucket.backoff() for _ in range(4)]
+    assert 1 <= delays[0] <= 1.25
+    assert 2 <= delays[1] <= 2.5
+    assert 3 <= delays[3] <= 3.75
+
+
+def test_fetch_ioc_raises_rate_limited_with_retry_after(monkeypatch):
+    monkeypatch.setattr(providers, "client_pool", ClientPool(idle_timeout=60))
+    monkeypatch.setattr(providers, "limiter", RateLimiter())
+
+    def factory(token):
+        return httpx.AsyncClient(
+            transport=httpx.MockTransport(
+                lambda r: httpx.Response(429, headers={"Retry-After": "7"}, text="slow down")
+            ),
+            base_url="https://example.com",
+        )
+
+    monkeypatch.setattr(providers.PROVIDERS["kaspersky"], "client_factory", factory)
+
+    async def run():
+        with pytest.raises(RateLimited) as exc:
+            await providers.fetch_ioc("kaspersky", "8.8.8.8", "token1234", {})
+        assert 7 <= exc.value.retry_after <= 8.75
+        assert exc.value.called
+        # The next lookup is rejected without hitting the provider.
+        with pytest.raises(RateLimited) as exc:
+            await providers.fetch_ioc("kaspersky", "8.8.4.4", "token1234", {})
+        assert not exc.value.called
+        await providers.client_pool.aclose()
+
+    asyncio.run(run())
+    stats = providers.limiter.stats()["kaspersky:1234"]
+    assert stats["failures"] == 1 and stats["used"] == 1
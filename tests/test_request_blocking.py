@@ -0,0 +1,54 @@
+import asyncio
+from types import SimpleNamespace
+
+from ioc_checker import virustotal
+from ioc_checker.virustotal import PageMeter, PageStats, should_block
+
+
+def test_should_block_by_type_and_pattern():
+    assert should_block("https://www.virustotal.com/gui/images/logo.svg", "image")
+    assert should_block("https://www.google-analytics.com/g/collect", "xhr")
+    assert not should_block("https://www.virustotal.com/gui/main.js", "script")
+    assert not should_block("https://www.virustotal.com/ui/domains/example.com", "fetch")
+
+
+def test_allow_patterns_override_blocked_types(monkeypatch):
+    monkeypatch.setattr(virustotal.settings, "vt_allow_patterns", ["*/keep.png"])
+    assert not should_block("https://example.com/keep.png", "image")
+    assert should_block("https://example.com/drop.png", "image")
+
+
+class FakeRoute:
+    def __init__(self, url, resource_type):
+        self.request = SimpleNamespace(url=url, resource_type=resource_type)
+        self.action = None
+
+    async def abort(self, error_code=None):
+        self.action = "abort"
+
+    async def fallback(self):
+        self.action = "continue"
+
+
+class FakeRequest:
+    async def sizes(self):
+        return {"responseHeadersSize": 100, "responseBodySize": 900}
+
+
+def test_meter_counts_blocked_requests_and_bytes():
+    meter = PageMeter()
+    stats = PageStats()
+
+    async def run():
+        font = FakeRoute("https://example.com/a.woff2", "font")
+        api = FakeRoute("https://www.virustotal.com/ui/files/abc", "fetch")
+        await meter.route(font)
+        await meter.route(api)
+        await meter.finished(FakeRequest())
+        assert (font.action, api.action) == ("abort", "continue")
+
+    asyncio.run(run())
+    assert (meter.requests, meter.blocked, meter.bytes) == (1, 1, 1000)
+    stats.record(meter, 0.25)
+    assert stats.stats()["avg_bytes"] == 1000
+    assert stats.stats()["avg_latency_ms"] == 250.0
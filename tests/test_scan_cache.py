@@ -0,0 +1,79 @@
+import asyncio
+import importlib
+
+from fastapi.testclient import TestClient
+
+from ioc_checker.config import settings
+
+
+def test_scan_returns_cached_results_inline(tmp_path):
+    settings.database_url = f"sqlite+aiosqlite:///{tmp_path/'scan.db'}"
+    import ioc_checker.database as database
+    import ioc_checker.queue as queue
+    importlib.reload(database)
+    importlib.reload(queue)
+    import ioc_checker.main as main
+    importlib.reload(main)
+
+    async def seed():
+        await database.init_db()
+        await database.cache_result("8.8.8.8", "kaspersky", {"status_code": 200, "data": {"zone": "Green"}})
+        await database.cache_result("1.1.1.1", "kaspersky", {"status_code": 404})
+
+    asyncio.run(seed())
+
+    client = TestClient(main.app)
+    resp = client.post(
+        "/scan",
+        json={"service": "kaspersky", "token": "t", "iocs": ["8.8.8.8", "1.1.1.1", "9.9.9.9", ""]},
+    )
+    data = resp.json()
+    tasks = {t["ioc"]: t for t in data["tasks"]}
+    assert set(tasks) == {"8.8.8.8", "1.1.1.1", "9.9.9.9"}
+    assert tasks["8.8.8.8"]["status"] == "done"
+    assert tasks["8.8.8.8"]["result"]["data"] == {"zone": "Green"}
+    assert tasks["1.1.1.1"]["result"] == {"status_code": 404}
+    assert "status" not in tasks["9.9.9.9"]
+    # Only the miss is queued for the workers.
+    assert data["queue"] == 1
+    assert queue.queue.qsize() == 1
+    assert client.get(f"/status/{tasks['8.8.8.8']['id']}").json()["status"] == "done"
+
+
+def test_get_cached_results_chunks(tmp_path, monkeypatch):
+    settings.database_url = f"sqlite+aiosqlite:///{tmp_path/'bulk.db'}"
+    import ioc_checker.database as database
+    importlib.reload(database)
+    monkeypatch.setattr(database, "BULK_CHUNK_SIZE", 3)
+
+    async def run():
+        await database.init_db()
+        for i in range(10):
+            await database.cache_result(f"ioc{i}", "svc", {"status_code": 200, "data": i})
+        found = await database.get_cached_results([f"ioc{i}" for i in range(12)], "svc")
+        assert found == {f"ioc{i}": {"status_code": 200, "data": i} for i in range(10)}
+
+    asyncio.run(run())
+
+
+def test_scan_rejects_unknown_and_disabled_services(tmp_path, monkeypatch):
+    settings.database_url = f"sqlite+aiosqlite:///{tmp_path/'reject.db'}"
+    monkeypatch.setattr(settings, "providers", ["kaspersky"])
+    import ioc_checker.database as database
+    import ioc_checker.queue as queue
+    importlib.reload(database)
+    importlib.reload(queue)
+    import ioc_checker.main as main
+    importlib.reload(main)
+
+    client = TestClient(main.app)
+    for service in ("virustotal", "nosuch"):
+        resp = client.post("/scan", json={"service": service, "iocs": ["8.8.8.8"]})
+        assert resp.status_code == 400
+    assert client.get("/queue").json() == {"queue": 0, "providers": {"kaspersky": 0}}
+    try:
+        queue.get_queue("nosuch")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("expected ValueError")
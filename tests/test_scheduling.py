@@ -0,0 +1,71 @@
+import asyncio
+import importlib
+
+from ioc_checker.config import settings
+from ioc_checker.scheduling import FairQueue, FairShare
+
+
+def _drain(q):
+    return [q.get_nowait() for _ in range(q.qsize())]
+
+
+def test_groups_take_turns_within_a_priority():
+    share = FairShare()
+    keys = {}
+
+    def put(q, name, group, priority=0):
+        keys[name] = (priority, share.stamp(("svc", priority), group))
+        q.put_nowait(name)
+
+    q = FairQueue(keys.__getitem__, lambda name: share.advance(("svc", keys[name][0]), keys[name][1]))
+    for i in range(5):
+        put(q, f"bulk{i}", "alice")
+    for i in range(2):
+        put(q, f"small{i}", "bob")
+    put(q, "urgent", "carol", priority=1)
+    assert _drain(q) == [
+        "urgent", "bulk0", "small0", "bulk1", "small1", "bulk2", "bulk3", "bulk4"
+    ]
+
+    # A group arriving late starts at the clock, not behind alice's backlog.
+    for i in range(4):
+        put(q, f"more{i}", "alice")
+    assert q.get_nowait() == "more0"
+    put(q, "late", "dave")
+    assert _drain(q) == ["more1", "late", "more2", "more3"]
+
+
+def test_tasks_without_group_stay_fifo():
+    share = FairShare()
+    tags = [share.stamp(("svc", 0)) for _ in range(3)]
+    assert tags == [1, 1, 1]
+    share.advance(("svc", 0), 1)
+    assert share.stamp(("svc", 0), "g") == 2
+    share.advance(("svc", 0), 2)
+    assert share.prune() == 1
+
+
+def test_small_scans_jump_ahead_of_bulk_jobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "database_url", f"sqlite+aiosqlite:///{tmp_path/'s.db'}")
+    import ioc_checker.database as database
+    import ioc_checker.queue as queue
+    import ioc_checker.worker as worker
+    import ioc_checker.main as main
+    for module in (database, queue, worker, main):
+        importlib.reload(module)
+
+    async def run():
+        await database.init_db()
+        bulk = await main.scan(
+            main.ScanRequest(iocs=[f"bulk{i}.example" for i in range(20)], token="t")
+        )
+        one = await main.scan(main.ScanRequest(iocs=["one.example"], token="t"))
+        low = await main.scan(
+            main.ScanRequest(iocs=["low.example"], token="t", priority=0)
+        )
+        q = queue.get_queue("kaspersky")
+        order = [queue.get_task(q.get_nowait()).ioc for _ in range(4)]
+        return bulk, one, low, order
+
+    bulk, one, low, order = asyncio.run(run())
+    assert order == ["one.example", "bulk0.example", "low.example", "bulk1.example"]
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from ioc_checker.singleflight import SingleFlight
+
+
+def test_concurrent_calls_are_coalesced():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"status_code": 200}
+
+    async def run():
+        results = await asyncio.gather(
+            *(flight.do(("ioc1", "kaspersky"), fetch) for _ in range(5)),
+            flight.do(("ioc2", "kaspersky"), fetch),
+        )
+        assert all(r == {"status_code": 200} for r in results)
+
+    asyncio.run(run())
+    assert len(calls) == 2
+    assert flight.stats() == {"in_flight": 0, "calls": 2, "coalesced": 4}
+
+
+def test_errors_are_shared_with_waiters():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def run():
+        results = await asyncio.gather(
+            *(flight.do("key", fail) for _ in range(3)), return_exceptions=True
+        )
+        assert all(isinstance(r, ValueError) for r in results)
+        # The key is released so later calls run again.
+        with pytest.raises(ValueError):
+            await flight.do("key", fail)
+
+    asyncio.run(run())
+    assert flight.calls == 2
@@ -0,0 +1,65 @@
+import time
+
+from ioc_checker.queue import Task, TaskStore
+import ioc_checker.queue as queue
+
+
+def test_outstanding_counter_tracks_status_changes(monkeypatch):
+    store = TaskStore(retention=60, max_finished=10)
+    monkeypatch.setattr(queue, "_tasks", store)
+    tasks = [Task(id=str(i), ioc=f"ioc{i}", token="t") for i in range(3)]
+    for task in tasks:
+        store.add(task)
+    assert store.outstanding == 3
+    tasks[0].status = "processing"
+    assert store.outstanding == 3
+    tasks[0].status = "done"
+    tasks[1].status = "error"
+    assert store.outstanding == 1
+    assert store.counts["done"] == 1 and store.counts["error"] == 1
+    # Finished tasks no longer hold on to the API token.
+    assert tasks[0].token is None and tasks[2].token == "t"
+
+
+def test_finished_tasks_are_evicted_by_cap(monkeypatch):
+    store = TaskStore(retention=60, max_finished=2)
+    monkeypatch.setattr(queue, "_tasks", store)
+    for i in range(5):
+        store.add(Task(id=str(i), ioc=f"ioc{i}", status="done"))
+    store.add(Task(id="pending", ioc="ioc"))
+    assert len(store) == 3
+    assert store.get("0") is None and store.get("4") is not None
+    assert store.get("pending") is not None
+    assert store.outstanding == 1
+
+
+def test_finished_tasks_are_evicted_after_retention(monkeypatch):
+    store = TaskStore(retention=0.01, max_finished=100)
+    monkeypatch.setattr(queue, "_tasks", store)
+    task = Task(id="1", ioc="ioc")
+    store.add(task)
+    task.status = "done"
+    time.sleep(0.02)
+    assert store.evict() == 1
+    assert store.get("1") is None
+    assert store.counts["done"] == 0
+
+
+def test_jobs_hold_task_ids_and_are_bounded(monkeypatch):
+    store = TaskStore(retention=60, max_finished=1, max_jobs=2)
+    monkeypatch.setattr(queue, "_tasks", store)
+    jobs = [queue.Job(id=f"job{i}", service="kaspersky") for i in range(3)]
+    store.add_job(jobs[0])
+    store.add_job(jobs[1])
+    for i in range(3):
+        store.add(Task(id=str(i), ioc=f"ioc{i}", status="done", job_id="job0"))
+    store.close_job(jobs[0])
+    store.add(Task(id="pending", ioc="ioc", job_id="job1"))
+    # The job keeps its counts, not the tasks evicted from the store.
+    assert jobs[0].task_ids == ["0", "1", "2"]
+    assert jobs[0].counts["done"] == 3
+    assert len(store) == 2
+    # The finished job makes room first, even though it is not expired.
+    store.add_job(jobs[2])
+    assert store.get_job("job0") is None
+    assert store.get_job("job1") is jobs[1] and store.get_job("job2") is jobs[2]
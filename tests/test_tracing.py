@@ -0,0 +1,101 @@
+import asyncio
+import importlib
+
+from ioc_checker import tracing
+from ioc_checker.config import settings
+
+
+def test_spans_are_recorded_only_inside_a_trace():
+    async def run():
+        with tracing.span("ignored"):
+            pass
+        trace = tracing.begin("t1")
+        with tracing.span("fetch"):
+            await asyncio.sleep(0.01)
+        with tracing.span("fetch"):
+            pass
+        spans = tracing.end(trace)
+        with tracing.span("after"):
+            pass
+        return trace, spans
+
+    trace, spans = asyncio.run(run())
+    assert set(spans) == {"fetch", "total"}
+    assert spans["fetch"] >= 10
+    assert spans["total"] >= spans["fetch"]
+    assert "after" not in trace.spans
+
+
+def test_worker_records_trace_and_status_returns_it(monkeypatch):
+    import ioc_checker.queue as queue
+    import ioc_checker.worker as worker
+    import ioc_checker.main as main
+    importlib.reload(queue)
+    importlib.reload(worker)
+    importlib.reload(main)
+
+    async def get_cached_result(ioc, service):
+        return None
+
+    async def fetch_ioc(service, ioc, token, contexts):
+        with tracing.span("fetch"):
+            await asyncio.sleep(0.02)
+        return {"status_code": 200}
+
+    async def cache_result(ioc, service, result):
+        pass
+
+    monkeypatch.setattr(worker, "get_cached_result", get_cached_result)
+    monkeypatch.setattr(worker, "fetch_ioc", fetch_ioc)
+    monkeypatch.setattr(worker, "cache_result", cache_result)
+
+    async def run():
+        task_id = await queue.add_task("example.com", "kaspersky", "t")
+        runner = asyncio.create_task(worker.worker("kaspersky"))
+        await asyncio.wait_for(queue.get_queue("kaspersky").join(), 1)
+        runner.cancel()
+        return task_id, await main.status(task_id, trace=True), await main.status(task_id)
+
+    task_id, traced, plain = asyncio.run(run())
+    assert traced["status"] == "done"
+    assert {"queue_wait", "cache_read", "fetch", "cache_write", "total"} <= set(
+        traced["trace"]
+    )
+    assert traced["trace"]["fetch"] >= 20
+    assert "trace" not in plain
+
+
+def test_slow_tasks_leave_a_profile(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "profile_slow_tasks", 0.05)
+    monkeypatch.setattr(settings, "profile_interval", 0.005)
+    monkeypatch.setattr(settings, "profile_dir", str(tmp_path))
+
+    async def slow_download():
+        await asyncio.sleep(0.15)
+
+    def busy_parse():
+        deadline = tracing.time.perf_counter() + 0.05
+        while tracing.time.perf_counter() < deadline:
+            pass
+
+    async def handle(task_id):
+        trace = tracing.begin(task_id)
+        await slow_download()
+        busy_parse()
+        tracing.end(trace)
+
+    async def run():
+        await handle("slow")
+        trace = tracing.begin("fast")
+        tracing.end(trace)
+
+    asyncio.run(run())
+    assert [p.name for p in tmp_path.iterdir()] == ["slow.folded"]
+    profile = (tmp_path / "slow.folded").read_text()
+    # Suspended and running phases are both attributed to the task.
+    assert "handle (test_tracing.py" in profile
+    assert "slow_download" in profile
+    assert "busy_parse" in profile
+    for line in profile.splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
@@ -0,0 +1,157 @@
+import asyncio
+import importlib
+from types import SimpleNamespace
+
+from ioc_checker import virustotal
+
+
+class FakeResponse:
+    def __init__(self, status, data=None):
+        self.status = status
+        self.ok = status == 200
+        self._data = data
+
+    async def json(self):
+        return {"data": {"attributes": self._data}}
+
+
+class FakeRequest:
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+
+    async def get(self, url, **kwargs):
+        self.calls.append(url)
+        return self.responses.pop(0)
+
+
+def _pool(responses):
+    context = SimpleNamespace(request=FakeRequest(responses))
+
+    async def get_context():
+        return context
+
+    return SimpleNamespace(context=context, get_context=get_context)
+
+
+def test_direct_lookup_skips_gui(monkeypatch):
+    vt = importlib.reload(virustotal)
+    monkeypatch.setattr(vt.settings, "vt_render_tags", False)
+    attributes = {"reputation": -5, "last_analysis_stats": {"malicious": 3}, "tags": ["c2"]}
+    pool = _pool([FakeResponse(200, attributes)])
+
+    async def gui(*args):
+        raise AssertionError("GUI should not be loaded")
+
+    monkeypatch.setattr(vt, "fetch_gui", gui)
+    result = asyncio.run(vt.fetch_ioc_info("example.com", pool))
+    assert result["reputation"] == -5
+    assert result["tags"] == ["c2"]
+    assert pool.context.request.calls[0].startswith("https://www.virustotal.com/ui/domains/")
+    assert vt.direct_stats["direct"] == 1
+
+
+def test_rejected_direct_lookup_falls_back_and_pauses(monkeypatch):
+    vt = importlib.reload(virustotal)
+    monkeypatch.setattr(vt.settings, "vt_render_tags", False)
+    pool = _pool([FakeResponse(403)])
+
+    async def gui(ioc_type, gui_url, api_url, pool):
+        return {"reputation": 0, "last_analysis_stats": {}}, ["from-gui"]
+
+    monkeypatch.setattr(vt, "fetch_gui", gui)
+
+    async def run():
+        first = await vt.fetch_ioc_info("example.com", pool)
+        second = await vt.fetch_ioc_info("example.org", pool)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first["tags"] == second["tags"] == ["from-gui"]
+    # The second lookup goes straight to the GUI while direct calls pause.
+    assert len(pool.context.request.calls) == 1
+    assert vt.direct_stats["rejected"] == 1
+    assert vt.direct_stats["gui"] == 2
+
+
+def test_render_tags_always_uses_gui(monkeypatch):
+    vt = importlib.reload(virustotal)
+    monkeypatch.setattr(vt.settings, "vt_render_tags", True)
+    pool = _pool([])
+
+    async def gui(ioc_type, gui_url, api_url, pool):
+        return {"reputation": 1}, []
+
+    monkeypatch.setattr(vt, "fetch_gui", gui)
+    result = asyncio.run(vt.fetch_ioc_info("8.8.8.8", pool))
+    assert result["type"] == "ip"
+    assert pool.context.request.calls == []
+
+
+def test_unknown_ioc_is_a_result_not_a_rejection(monkeypatch):
+    vt = importlib.reload(virustotal)
+    monkeypatch.setattr(vt.settings, "vt_render_tags", False)
+    attributes = {"reputation": 1, "last_analysis_stats": {"harmless": 60}}
+    pool = _pool([FakeResponse(404), FakeResponse(200, attributes)])
+
+    async def gui(*args):
+        raise AssertionError("GUI should not be loaded")
+
+    monkeypatch.setattr(vt, "fetch_gui", gui)
+
+    async def run():
+        missing = await vt.fetch_ioc_info("a" * 64, pool)
+        found = await vt.fetch_ioc_info("example.org", pool)
+        return missing, found
+
+    missing, found = asyncio.run(run())
+    assert missing["status_code"] == 404
+    assert found["status_code"] == 200
+    assert vt.verdict(missing) == "unknown"
+    # The 404 did not pause direct calls for the next lookup.
+    assert found["reputation"] == 1
+    assert len(pool.context.request.calls) == 2
+    assert vt.direct_stats["rejected"] == 0
+
+
+def test_server_errors_fall_back_without_pausing(monkeypatch):
+    vt = importlib.reload(virustotal)
+    monkeypatch.setattr(vt.settings, "vt_render_tags", False)
+    pool = _pool([FakeResponse(500), FakeResponse(500)])
+
+    async def gui(ioc_type, gui_url, api_url, pool):
+        return {"reputation": 0, "last_analysis_stats": {}}, []
+
+    monkeypatch.setattr(vt, "fetch_gui", gui)
+
+    async def run():
+        await vt.fetch_ioc_info("example.com", pool)
+        await vt.fetch_ioc_info("example.org", pool)
+
+    asyncio.run(run())
+    assert len(pool.context.request.calls) == 2
+    assert vt.direct_stats["gui"] == 2
+    assert vt.direct_stats["rejected"] == 0
+
+
+def test_found_and_not_found_results_are_both_cached(tmp_path, monkeypatch):
+    from ioc_checker import database
+    from ioc_checker.config import settings
+
+    monkeypatch.setattr(settings, "database_url", f"sqlite+aiosqlite:///{tmp_path/'vt.db'}")
+    db = importlib.reload(database)
+    vt = importlib.reload(virustotal)
+    monkeypatch.setattr(vt.settings, "vt_render_tags", False)
+    attributes = {"reputation": 1, "last_analysis_stats": {"harmless": 60}}
+    pool = _pool([FakeResponse(404), FakeResponse(200, attributes)])
+
+    async def run():
+        await db.init_db()
+        for ioc in ("a" * 64, "example.org"):
+            await db.cache_result(ioc, "virustotal", await vt.fetch_ioc_info(ioc, pool))
+        await db.flush_cache()
+        return await db.get_cached_results(["a" * 64, "example.org"], "virustotal")
+
+    cached = asyncio.run(run())
+    assert cached["a" * 64]["status_code"] == 404
+    assert cached["example.org"]["reputation"] == 1
@@ -0,0 +1,129 @@
+import asyncio
+import contextlib
+import importlib
+
+from ioc_checker.config import settings
+
+
+def test_provider_pools_are_independent(monkeypatch):
+    import ioc_checker.queue as queue
+    import ioc_checker.worker as worker
+    importlib.reload(queue)
+    importlib.reload(worker)
+    monkeypatch.setattr(settings, "providers", ["kaspersky", "virustotal"])
+    monkeypatch.setattr(settings, "worker_pools", {"kaspersky": 4, "virustotal": 1})
+
+    initialised = []
+
+    async def init_contexts(names):
+        initialised.append(names)
+        return {}, contextlib.AsyncExitStack()
+
+    active = {"kaspersky": 0, "virustotal": 0}
+    peak = {"kaspersky": 0, "virustotal": 0}
+
+    async def lookup(task, contexts):
+        active[task.service] += 1
+        peak[task.service] = max(peak[task.service], active[task.service])
+        await asyncio.sleep(0.5 if task.service == "virustotal" else 0.01)
+        active[task.service] -= 1
+        return {"status_code": 200}
+
+    monkeypatch.setattr(worker, "init_contexts", init_contexts)
+    monkeypatch.setattr(worker, "lookup", lookup)
+
+    async def run():
+        pools = worker.start_workers(1)
+        slow = [await queue.add_task(f"slow{i}", "virustotal") for i in range(2)]
+        fast = [await queue.add_task(f"fast{i}", "kaspersky", "t") for i in range(8)]
+        await asyncio.wait_for(queue.get_queue("kaspersky").join(), 0.3)
+        assert all(queue.get_task(t).status == "done" for t in fast)
+        assert queue.get_task(slow[1]).status == "queued"
+        for pool in pools:
+            pool.cancel()
+        await asyncio.gather(*pools, return_exceptions=True)
+
+    asyncio.run(run())
+    assert sorted(initialised) == [["kaspersky"], ["virustotal"]]
+    assert peak == {"kaspersky": 4, "virustotal": 1}
+
+
+def test_lookups_are_only_shared_between_tasks_with_the_same_token(monkeypatch):
+    import ioc_checker.queue as queue
+    import ioc_checker.worker as worker
+    importlib.reload(queue)
+    importlib.reload(worker)
+    monkeypatch.setattr(settings, "worker_pools", {"kaspersky": 3})
+
+    async def init_contexts(names):
+        return {}, contextlib.AsyncExitStack()
+
+    calls = []
+
+    async def lookup(task, contexts):
+        calls.append(task.token)
+        await asyncio.sleep(0.05)
+        if task.token == "bad":
+            raise RuntimeError("status 401")
+        return {"status_code": 200}
+
+    monkeypatch.setattr(worker, "init_contexts", init_contexts)
+    monkeypatch.setattr(worker, "lookup", lookup)
+
+    async def run():
+        pools = worker.start_workers(1, ["kaspersky"])
+        ids = [
+            await queue.add_task("8.8.8.8", "kaspersky", token)
+            for token in ("bad", "good", "good")
+        ]
+        await asyncio.wait_for(queue.get_queue("kaspersky").join(), 1)
+        for pool in pools:
+            pool.cancel()
+        await asyncio.gather(*pools, return_exceptions=True)
+        return [queue.get_task(task_id).status for task_id in ids]
+
+    assert asyncio.run(run()) == ["error", "done", "done"]
+    assert sorted(calls) == ["bad", "good"]
+
+
+def test_waiting_for_a_token_does_not_use_up_attempts(monkeypatch):
+    import ioc_checker.queue as queue
+    import ioc_checker.worker as worker
+    from ioc_checker.ratelimit import RateLimited
+    importlib.reload(queue)
+    importlib.reload(worker)
+    monkeypatch.setattr(settings, "max_retries", 1)
+
+    async def init_contexts(names):
+        return {}, contextlib.AsyncExitStack()
+
+    calls = {"waiting": 0, "throttled": 0}
+
+    async def lookup(task, contexts):
+        calls[task.ioc] += 1
+        if task.ioc == "waiting" and calls["waiting"] <= 3:
+            raise RateLimited(0.01, called=False)
+        if task.ioc == "throttled":
+            raise RateLimited(0.01, "status 429")
+        return {"status_code": 200}
+
+    monkeypatch.setattr(worker, "init_contexts", init_contexts)
+    monkeypatch.setattr(worker, "lookup", lookup)
+
+    async def run():
+        pools = worker.start_workers(1, ["kaspersky"])
+        ids = [await queue.add_task(ioc, "kaspersky", "t") for ioc in ("waiting", "throttled")]
+        tasks = [queue.get_task(task_id) for task_id in ids]
+        for _ in range(100):
+            if all(task.status in ("done", "error") for task in tasks):
+                break
+            await asyncio.sleep(0.01)
+        for pool in pools:
+            pool.cancel()
+        await asyncio.gather(*pools, return_exceptions=True)
+        return tasks
+
+    waiting, throttled = asyncio.run(run())
+    assert (waiting.status, waiting.attempts) == ("done", 0)
+    assert (throttled.status, throttled.attempts) == ("error", 1)
+    assert calls == {"waiting": 4, "throttled": 2}